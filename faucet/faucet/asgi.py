@@ -0,0 +1,28 @@
+"""
+ASGI config for faucet project.
+
+GET and POST /transactions/ are served by asyncio handlers
+(transactions.async_views), everything else by the WSGI application.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "faucet.settings")
+
+wsgi_application = get_wsgi_application()
+
+from transactions.async_views import (  # noqa: E402
+    TransactionsApplication,
+    ThreadedWsgiToAsgi,
+)
+from transactions.utils import health  # noqa: E402
+
+if settings.PREWARM_ENABLE:
+    health.start_prewarm()
+
+application = TransactionsApplication(ThreadedWsgiToAsgi(wsgi_application))
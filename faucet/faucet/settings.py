@@ -29,6 +29,56 @@ env = environ.Env(
     DEFAULT_MIXIN=(str, "10"),
     DAEMON_HOST=(str, "localhost"),
     DAEMON_PORT=(int, 38081),
+    NETWORKS=(list, []),
+    WALLET_BACKENDS=(list, []),
+    WALLET_BACKEND_RETRY_INTERVAL=(int, 60),
+    PAYOUT_BATCH_ENABLE=(bool, False),
+    PAYOUT_BATCH_WINDOW=(float, 2.0),
+    PAYOUT_BATCH_SIZE=(int, 15),
+    PAYOUT_ASYNC_ENABLE=(bool, False),
+    PAYOUT_WORKER_INTERVAL=(float, 1.0),
+    PAYOUT_SENDING_TIMEOUT=(int, 600),
+    OUTPUT_SPLIT_TARGET=(int, 20),
+    OUTPUT_SPLIT_INTERVAL=(float, 600.0),
+    RPC_CONNECT_TIMEOUT=(float, 3.05),
+    RPC_READ_TIMEOUT=(float, 10.0),
+    RPC_TRANSFER_TIMEOUT=(float, 120.0),
+    RPC_RETRIES=(int, 2),
+    RPC_RETRY_BACKOFF=(float, 0.2),
+    RPC_POOL_SIZE=(int, 10),
+    BALANCE_CACHE_TTL=(int, 30),
+    BALANCE_CACHE_MAX_AGE=(int, 600),
+    PREWARM_ENABLE=(bool, True),
+    HEALTH_CHECK_INTERVAL=(float, 10.0),
+    WALLET_METADATA_TTL=(int, 3600),
+    LEDGER_ENABLE=(bool, False),
+    PAYOUT_LOCK_BACKEND=(str, "cache"),
+    PAYOUT_LOCK_TIMEOUT=(int, 180),
+    IDEMPOTENCY_KEY_TTL=(int, 86400),
+    METRICS_ENABLE=(bool, False),
+    SERVER_TIMING_SAMPLE_RATE=(float, 0.0),
+    TRANSACTION_RETENTION_DAYS=(int, 90),
+    ARCHIVE_DIR=(str, ""),
+    STATS_CACHE_TTL=(int, 60),
+    WITHDRAWAL_LIMIT_BACKEND=(str, "database"),
+    WITHDRAWAL_BUCKET_SECONDS=(int, 3600),
+    IP_HASH_RATE_PER_DAY=(int, 0),
+    IP_HASH_KEY=(str, ""),
+    IP_RATELIMIT_BACKEND=(str, "django-ratelimit"),
+    TOKEN_BUCKET_CAPACITY=(int, 1),
+    IPV4_PREFIX=(int, 32),
+    IPV6_PREFIX=(int, 64),
+    TRUSTED_PROXIES=(
+        list,
+        [
+            "127.0.0.0/8",
+            "10.0.0.0/8",
+            "172.16.0.0/12",
+            "192.168.0.0/16",
+            "::1/128",
+            "fc00::/7",
+        ],
+    ),
 )
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -46,11 +96,97 @@ WALLET_HOST = env("WALLET_HOST")
 WALLET_PORT = env("WALLET_PORT")
 DAEMON_HOST = env("DAEMON_HOST")
 DAEMON_PORT = env("DAEMON_PORT")
+# several monero-wallet-rpc instances ("host:port") to spread payouts over,
+# replacing WALLET_HOST/WALLET_PORT
+WALLET_BACKENDS = env("WALLET_BACKENDS")
+# seconds a wallet backend is skipped after a connection error
+WALLET_BACKEND_RETRY_INTERVAL = env("WALLET_BACKEND_RETRY_INTERVAL")
+# networks served at /<network>/ besides the one above, configured by
+# <NETWORK>_WALLET_HOST, <NETWORK>_WALLET_PORT, <NETWORK>_WALLET_BACKENDS,
+# <NETWORK>_DAEMON_HOST and <NETWORK>_DAEMON_PORT
+# (e.g. NETWORKS=stagenet,testnet)
+NETWORKS = {
+    network: {
+        "WALLET_HOST": env.str(
+            network.upper() + "_WALLET_HOST", default=WALLET_HOST
+        ),
+        "WALLET_PORT": env.int(
+            network.upper() + "_WALLET_PORT", default=WALLET_PORT
+        ),
+        "WALLET_BACKENDS": env.list(
+            network.upper() + "_WALLET_BACKENDS", default=[]
+        ),
+        "DAEMON_HOST": env.str(
+            network.upper() + "_DAEMON_HOST", default=DAEMON_HOST
+        ),
+        "DAEMON_PORT": env.int(
+            network.upper() + "_DAEMON_PORT", default=DAEMON_PORT
+        ),
+    }
+    for network in env("NETWORKS")
+}
 ONCE_EVERY_N_MINUTE = env("ONCE_EVERY_N_MINUTE")
+# Aggregate payouts into multi-destination transfers
+PAYOUT_BATCH_ENABLE = env("PAYOUT_BATCH_ENABLE")
+PAYOUT_BATCH_WINDOW = env("PAYOUT_BATCH_WINDOW")
+PAYOUT_BATCH_SIZE = env("PAYOUT_BATCH_SIZE")
+# Queue payouts and send them with 'manage.py process_payouts'
+PAYOUT_ASYNC_ENABLE = env("PAYOUT_ASYNC_ENABLE")
+PAYOUT_WORKER_INTERVAL = env("PAYOUT_WORKER_INTERVAL")
+# seconds after which a payout still being sent (or of unknown state) is
+# reconciled with the wallet's transfers, longer than RPC_TRANSFER_TIMEOUT
+PAYOUT_SENDING_TIMEOUT = env("PAYOUT_SENDING_TIMEOUT")
+# spendable outputs kept per wallet by split_outputs
+OUTPUT_SPLIT_TARGET = env("OUTPUT_SPLIT_TARGET")
+OUTPUT_SPLIT_INTERVAL = env("OUTPUT_SPLIT_INTERVAL")
+# wallet/daemon RPC client
+RPC_CONNECT_TIMEOUT = env("RPC_CONNECT_TIMEOUT")
+RPC_READ_TIMEOUT = env("RPC_READ_TIMEOUT")
+RPC_TRANSFER_TIMEOUT = env("RPC_TRANSFER_TIMEOUT")
+# (connect, read) timeouts per RPC method
+RPC_TIMEOUTS = {
+    "default": (RPC_CONNECT_TIMEOUT, RPC_READ_TIMEOUT),
+    "transfer_split": (RPC_CONNECT_TIMEOUT, RPC_TRANSFER_TIMEOUT),
+}
+# retries are only done for idempotent methods (never for transfers)
+RPC_RETRIES = env("RPC_RETRIES")
+RPC_RETRY_BACKOFF = env("RPC_RETRY_BACKOFF")
+RPC_POOL_SIZE = env("RPC_POOL_SIZE")
+# seconds a cached balance is fresh; stale balances are served (while being
+# refreshed) up to BALANCE_CACHE_MAX_AGE seconds
+BALANCE_CACHE_TTL = env("BALANCE_CACHE_TTL")
+BALANCE_CACHE_MAX_AGE = env("BALANCE_CACHE_MAX_AGE")
+# seconds until the wallet address and the rendered index page are refreshed
+WALLET_METADATA_TTL = env("WALLET_METADATA_TTL")
+# fetch the wallet metadata and balance when a worker starts
+PREWARM_ENABLE = env("PREWARM_ENABLE")
+# seconds between the dependency checks of /healthz and /readyz
+HEALTH_CHECK_INTERVAL = env("HEALTH_CHECK_INTERVAL")
+# derive the available balance from the cached wallet balance
+# minus the payouts sent or reserved since
+LEDGER_ENABLE = env("LEDGER_ENABLE")
+# lock per destination address around check-and-pay
+# "cache", "database" (postgres advisory locks) or "" (no lock)
+PAYOUT_LOCK_BACKEND = env("PAYOUT_LOCK_BACKEND")
+# seconds until a cache lock expires (if its process died)
+PAYOUT_LOCK_TIMEOUT = env("PAYOUT_LOCK_TIMEOUT")
+# seconds the responses of requests with an Idempotency-Key are replayed
+IDEMPOTENCY_KEY_TTL = env("IDEMPOTENCY_KEY_TTL")
+# serve prometheus metrics at /metrics
+METRICS_ENABLE = env("METRICS_ENABLE")
+# share of requests answered with a Server-Timing header (0 disables it)
+SERVER_TIMING_SAMPLE_RATE = env("SERVER_TIMING_SAMPLE_RATE")
+# seconds the payout statistics at /stats are cached
+STATS_CACHE_TTL = env("STATS_CACHE_TTL")
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# days transactions are kept before 'manage.py archive_transactions'
+# moves them into monthly gzipped NDJSON files in ARCHIVE_DIR
+TRANSACTION_RETENTION_DAYS = env("TRANSACTION_RETENTION_DAYS")
+ARCHIVE_DIR = env("ARCHIVE_DIR") or os.path.join(BASE_DIR, "archive")
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.0/howto/deployment/checklist/
@@ -75,6 +211,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "transactions.middleware.MetricsMiddleware",
+    "transactions.middleware.ServerTimingMiddleware",
+    "transactions.middleware.NetworkMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -113,7 +252,24 @@ DATABASES = {"default": env.db()}
 # RATELIMIT SETTINGS
 RATELIMIT_ENABLE = env("RATELIMIT_ENABLE")
 RATELIMIT_USE_CACHE = "default"
+# "django-ratelimit" or "token-bucket"
+IP_RATELIMIT_BACKEND = env("IP_RATELIMIT_BACKEND")
+# burst of the token bucket, refilled once every ONCE_EVERY_N_MINUTE minutes
+TOKEN_BUCKET_CAPACITY = env("TOKEN_BUCKET_CAPACITY")
+# clients are limited by subnet
+IPV4_PREFIX = env("IPV4_PREFIX")
+IPV6_PREFIX = env("IPV6_PREFIX")
+# proxies whose X-Real-IP/X-Forwarded-For headers are used
+TRUSTED_PROXIES = env("TRUSTED_PROXIES")
 ADDRESS_RATE_PER_DAY = 5
+# withdrawals per day from the same (hashed) IP address, 0 disables the check
+IP_HASH_RATE_PER_DAY = env("IP_HASH_RATE_PER_DAY")
+# key of the IP address hashes (HMAC), defaults to SECRET_KEY
+IP_HASH_KEY = env("IP_HASH_KEY") or SECRET_KEY
+# "database" or "cache" (counters in CACHES["default"], database as fallback)
+WITHDRAWAL_LIMIT_BACKEND = env("WITHDRAWAL_LIMIT_BACKEND")
+# size of the buckets of the sliding window counters
+WITHDRAWAL_BUCKET_SECONDS = env("WITHDRAWAL_BUCKET_SECONDS")
 
 CACHES = {"default": env.cache()}
 
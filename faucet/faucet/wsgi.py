@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/2.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "faucet.settings")
 
 application = get_wsgi_application()
+
+from transactions.utils import health  # noqa: E402
+
+# uWSGI workers are prewarmed after forking (TransactionsConfig.ready())
+if settings.PREWARM_ENABLE and not health.is_uwsgi():
+    health.start_prewarm()
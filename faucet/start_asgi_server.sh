@@ -0,0 +1,10 @@
+#!/bin/sh
+
+# metrics of previous runs are to be removed
+if [ -n "$prometheus_multiproc_dir" ]; then
+    mkdir -p "$prometheus_multiproc_dir"
+    rm -f "$prometheus_multiproc_dir"/*.db
+fi
+
+# serves GET/POST /transactions/ on the event loop, see faucet/asgi.py
+uvicorn --host 0.0.0.0 --port "$FAUCET_PORT" faucet.asgi:application
@@ -1,3 +1,12 @@
 #!/bin/sh
 
-uwsgi --http 0.0.0.0:"$FAUCET_PORT" --static-map /static/=/data/static/ --module faucet.wsgi
+# metrics of previous runs are to be removed
+if [ -n "$prometheus_multiproc_dir" ]; then
+    mkdir -p "$prometheus_multiproc_dir"
+    rm -f "$prometheus_multiproc_dir"/*.db
+fi
+
+# --threads: every worker serves UWSGI_THREADS requests at a time, so the
+# payouts of concurrent requests can be batched (PAYOUT_BATCH_ENABLE)
+# --enable-threads: background threads are used e.g. for batching payouts
+uwsgi --http 0.0.0.0:"$FAUCET_PORT" --static-map /static/=/data/static/ --threads "${UWSGI_THREADS:-8}" --enable-threads --module faucet.wsgi
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TransactionsConfig(AppConfig):
     name = "transactions"
+
+    def ready(self):
+        if settings.PREWARM_ENABLE:
+            from .utils import health
+
+            health.schedule_prewarm()
@@ -0,0 +1,334 @@
+"""asyncio versions of the TransactionsApiView handlers.
+
+Django 2.1 has no async views, so GET and POST /transactions/ are served by
+a small ASGI application (see faucet/asgi.py). Wallet RPCs are awaited on
+the event loop, database and cache access is run in a thread.
+All other requests are served by the WSGI application in a thread pool.
+"""
+
+import io
+import time
+import logging
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from ratelimit.utils import is_ratelimited
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import resolve, Resolver404
+
+from .exceptions import (
+    MakeTransactionError,
+    RatelimitedByIPError,
+    RpcConnectionError,
+    TransferStateUnknownError,
+)
+from .models import Transaction
+from .serializers import TransactionSerializer
+from .utils import tools, throttle, locks, batch, metrics, idempotency
+from .utils import backends
+from .utils import async_wallet_rpc
+from .utils.async_wallet_rpc import AsyncWalletRPC
+from .views import TransactionsApiView, get_client_ip, client_ip_key
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def build_request(scope, body):
+    """Builds a Django request of an ASGI HTTP scope.
+
+    :param scope: the ASGI connection scope
+    :param body: the request body
+    :returns: WSGIRequest
+    """
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": scope.get("server", ("localhost", 80))[0],
+        "SERVER_PORT": str(scope.get("server", ("localhost", 80))[1]),
+        "REMOTE_ADDR": scope.get("client", ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return WSGIRequest(environ)
+
+
+class WithdrawalLock:
+    """Asynchronous context manager of locks.withdrawal_lock().
+    """
+
+    def __init__(self, destination_address, ip_address_hash):
+        self.lock = locks.withdrawal_lock(destination_address, ip_address_hash)
+
+    async def __aenter__(self):
+        await sync_to_async(self.lock.__enter__)()
+
+    async def __aexit__(self, *exc_info):
+        return await sync_to_async(self.lock.__exit__)(*exc_info)
+
+
+async def make_transaction(destination_address, amount):
+    """Sends a payout.
+
+    Batched payouts are collected by batch.PayoutBatcher, which blocks
+    until the batch is sent, so it is waited for in a separate thread.
+    """
+
+    try:
+        if settings.PAYOUT_BATCH_ENABLE:
+            return await sync_to_async(
+                batch.make_transaction, thread_sensitive=False
+            )(destination_address=destination_address, amount=amount)
+        return await AsyncWalletRPC.make_transaction(
+            destination_address=destination_address, amount=amount
+        )
+    except TransferStateUnknownError:
+        metrics.payout(Transaction.UNKNOWN)
+        raise
+    except (ValueError, RpcConnectionError):
+        metrics.payout(Transaction.FAILED)
+        raise
+
+
+async def check_and_pay(serializer):
+    """Asynchronous version of TransactionSerializer.check_and_pay().
+
+    Payouts routed across several wallet backends are made by the
+    synchronous version in a separate thread.
+    """
+
+    if not settings.PAYOUT_ASYNC_ENABLE and backends.is_routed():
+        return await sync_to_async(
+            serializer.check_and_pay, thread_sensitive=False
+        )(serializer.validated_data.get("destination_address"))
+
+    destination_address = serializer.validated_data.get("destination_address")
+    await sync_to_async(serializer.check_withdrawals)()
+    amount = await async_wallet_rpc.get_current_amount(settings.FACTOR_BALANCE)
+    if settings.PAYOUT_ASYNC_ENABLE:
+        instance = await sync_to_async(serializer.queue)(amount)
+    elif settings.LEDGER_ENABLE:
+        instance = await sync_to_async(serializer.reserve)(amount)
+        try:
+            transaction = await make_transaction(destination_address, amount)
+        except BaseException as e:
+            # also if the request is cancelled (asyncio.CancelledError)
+            await sync_to_async(serializer.release)(instance, e)
+            raise
+        await sync_to_async(serializer.complete)(instance, transaction)
+    else:
+        try:
+            transaction = await make_transaction(destination_address, amount)
+        except TransferStateUnknownError as e:
+            instance = await sync_to_async(serializer.reserve)(amount)
+            await sync_to_async(serializer.release)(instance, e)
+            raise
+        instance = await sync_to_async(serializer.store)(transaction)
+    await sync_to_async(serializer.record)()
+    return instance
+
+
+def is_ip_limited(request):
+    """Checks the IP rate limitation of TransactionsApiView.
+
+    :returns: True if the request is to be blocked, False otherwise
+    """
+
+    if not settings.RATELIMIT_ENABLE:
+        return False
+    if settings.IP_RATELIMIT_BACKEND == "token-bucket":
+        return throttle.is_limited(get_client_ip(request))
+    return is_ratelimited(
+        request,
+        group=TransactionsApiView.ratelimit_group,
+        key=client_ip_key,
+        rate=TransactionsApiView.ratelimit_rate,
+        method=TransactionsApiView.ratelimit_method,
+        increment=True,
+    )
+
+
+async def get(request):
+    """Returns the current balance of the wallet.
+    """
+
+    balance = await async_wallet_rpc.get_balance()
+    return status.HTTP_200_OK, {"balance": int(tools.xmr_to_float(balance))}
+
+
+async def post(request):
+    """Makes a transaction to the given XMR wallet address.
+
+    Once per Idempotency-Key (if given), see TransactionsApiView.create().
+    """
+
+    data = Request(
+        request, parsers=(JSONParser(), FormParser(), MultiPartParser())
+    ).data
+    serializer = TransactionSerializer(data=data)
+    key = idempotency.get_key(request)
+    if key is None:
+        return await make_payout(request, serializer)
+    request_fingerprint = idempotency.fingerprint(data)
+    stored = await sync_to_async(idempotency.begin)(key, request_fingerprint)
+    if stored is not None:
+        return stored
+    try:
+        status_code, response_data = await make_payout(request, serializer)
+    except BaseException as e:
+        # also if the request is cancelled (asyncio.CancelledError)
+        await sync_to_async(idempotency.fail)(
+            key, request_fingerprint, e, serializer.instance
+        )
+        raise
+    await sync_to_async(idempotency.finish)(
+        key, request_fingerprint, status_code, response_data
+    )
+    return status_code, response_data
+
+
+async def make_payout(request, serializer):
+    if await sync_to_async(is_ip_limited)(request):
+        logger.warning("Blocked by IP limitation.")
+        raise RatelimitedByIPError
+
+    serializer.is_valid(raise_exception=True)
+    serializer.validated_data.update(
+        {"ip_address_hash": tools.hash_ip(get_client_ip(request))}
+    )
+
+    destination_address = serializer.validated_data.get("destination_address")
+    try:
+        async with WithdrawalLock(
+            destination_address,
+            serializer.validated_data.get("ip_address_hash"),
+        ):
+            await check_and_pay(serializer)
+    except (ValueError, RpcConnectionError) as e:
+        logger.error(str(e))
+        raise MakeTransactionError(str(e))
+
+    if settings.PAYOUT_ASYNC_ENABLE:
+        # payout is queued, poll the transaction's status endpoint
+        return status.HTTP_202_ACCEPTED, serializer.data
+    return status.HTTP_201_CREATED, serializer.data
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs the WSGI application in the thread sensitive thread, one
+    # request at a time and along with the thread sensitive sync_to_async()
+    # calls of the handlers above (ThreadSensitiveContext has no effect
+    # before Python 3.7), so it is run in the thread pool instead
+    run_wsgi_app = sync_to_async(
+        vars(WsgiToAsgiInstance)["run_wsgi_app"].func, thread_sensitive=False
+    )
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """Serves a WSGI application, each request in a thread of its own.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(
+            scope, receive, send
+        )
+
+
+class TransactionsApplication:
+    """ASGI application serving GET and POST /transactions/.
+
+    All other requests (including the ones of settings.NETWORKS) are passed
+    on to the given (WSGI) application.
+    """
+
+    handlers = {"GET": get, "POST": post}
+
+    def __init__(self, application):
+        self.application = application
+
+    def is_transactions_path(self, path):
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return False
+        return match.url_name == "transactions" and match.namespaces == [
+            "transactions"
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in self.handlers
+            or not self.is_transactions_path(scope["path"])
+        ):
+            await self.application(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        try:
+            request = build_request(scope, body)
+            handler = self.handlers[scope["method"]]
+            status_code, data = await handler(request)
+        except APIException as e:
+            metrics.reject(e)
+            status_code = e.status_code
+            if isinstance(e.detail, (list, dict)):
+                data = e.detail
+            else:
+                data = {"detail": e.detail}
+        except Exception as e:
+            logger.exception(e)
+            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            data = {"detail": "A server error occurred."}
+        finally:
+            await sync_to_async(close_old_connections)()
+
+        content = JSONRenderer().render(data)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(content)).encode("ascii")),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+        metrics.REQUEST_DURATION.labels(
+            view="transactions:transactions",
+            method=scope["method"],
+            status=status_code,
+        ).observe(time.perf_counter() - start)
@@ -17,6 +17,12 @@ class RpcConnectionError(TransactionError):
     """
 
 
+class TransferStateUnknownError(RpcConnectionError):
+    """Exception if a failed transfer may have been sent anyway
+    (e.g. its response timed out).
+    """
+
+
 class GetWalletError(TransactionError):
     """Exception in combination with
     getting/calculating the tarnsaction's amount.
@@ -41,3 +47,28 @@ class MakeTransactionError(APIException):
 class RatelimitedByWithdrawalsError(APIException):
     status_code = status.HTTP_403_FORBIDDEN
     default_detail = "Sorry you are blocked."
+
+
+class RatelimitedByIPError(APIException):
+    status_code = status.HTTP_403_FORBIDDEN
+    default_detail = "Sorry you are blocked."
+
+
+class PayoutInProgressError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A payout to this address is already in progress."
+
+
+class WalletBusyError(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "All wallets are busy, please try again later."
+
+
+class IdempotencyKeyInUseError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is in progress."
+
+
+class IdempotencyKeyMismatchError(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was used for another request."
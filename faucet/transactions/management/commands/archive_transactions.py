@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import archive, stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves sent and failed transactions older than the retention period "
+        "into monthly gzipped NDJSON files, in batches. Run it regularly "
+        "(e.g. daily by cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.TRANSACTION_RETENTION_DAYS,
+            help="Retention period in days.",
+        )
+        parser.add_argument("--directory", default=settings.ARCHIVE_DIR)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Transactions archived and deleted at once.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the transactions to archive.",
+        )
+
+    def handle(self, *args, **options):
+        # the withdrawal limits consider the last day
+        if options["days"] < 1:
+            raise CommandError("The retention period is at least one day.")
+        if options["batch_size"] < 1:
+            raise CommandError("Invalid batch size.")
+        # the statistics of archived days are kept
+        stats.update()
+        count = archive.archive(
+            archive.cutoff(options["days"]),
+            directory=options["directory"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            self.stdout.write("{} transactions to archive".format(count))
+        else:
+            self.stdout.write(
+                "Archived {0} transactions in {1}".format(
+                    count, options["directory"]
+                )
+            )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import history, stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily payout statistics from the transactions, "
+        "e.g. after upgrading. Days whose transactions were archived "
+        "should be skipped using --since."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            default=None,
+            help="ISO 8601 date to recompute from (default: all days).",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = history.parse_time(options["since"]).date()
+            except ValueError as e:
+                raise CommandError(str(e))
+        days = stats.backfill(since)
+        self.stdout.write("Recomputed {} days".format(days))
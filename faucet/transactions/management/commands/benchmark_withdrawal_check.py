@@ -0,0 +1,95 @@
+import datetime
+import os
+import time
+import binascii
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ...models import Transaction
+from ...utils import tools
+
+
+class Rollback(Exception):
+    """Raised to roll back the benchmark data.
+    """
+
+
+def random_address():
+    return "5" + binascii.hexlify(os.urandom(47)).decode()[:94]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of the per address withdrawal check while the "
+        "transactions table grows. All rows are inserted within a single "
+        "database transaction, which is rolled back at the end. Do not run "
+        "this against a production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            default="1000,10000,100000,1000000",
+            help="Comma separated table sizes to measure.",
+        )
+        parser.add_argument(
+            "--queries",
+            type=int,
+            default=200,
+            help="Number of checks per table size.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows per INSERT.",
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["rows"].split(","))
+        try:
+            with transaction.atomic():
+                self.run(sizes, options["queries"], options["batch_size"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run(self, sizes, queries, batch_size):
+        address = random_address()
+        now = timezone.now()
+        rows = Transaction.objects.count()
+        self.stdout.write("rows\tmean_ms\tp95_ms")
+        for size in sizes:
+            while rows < size:
+                count = min(batch_size, size - rows)
+                Transaction.objects.bulk_create(
+                    Transaction(
+                        amount=1,
+                        destination_address=random_address(),
+                        ip_address_hash="0" * 64,
+                    )
+                    for _ in range(count)
+                )
+                rows += count
+            # all rows are part of today's traffic
+            Transaction.objects.filter(timestamp__gt=now).update(
+                timestamp=now - datetime.timedelta(hours=12)
+            )
+
+            durations = list()
+            for _ in range(queries):
+                start = time.perf_counter()
+                tools.addr_withdrew_too_often(
+                    destination_address=address, rate_allowed=5, days=1
+                )
+                durations.append((time.perf_counter() - start) * 1000)
+            durations.sort()
+            self.stdout.write(
+                "{0}\t{1:.3f}\t{2:.3f}".format(
+                    rows,
+                    sum(durations) / len(durations),
+                    durations[int(len(durations) * 0.95) - 1],
+                )
+            )
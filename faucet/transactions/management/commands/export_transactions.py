@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Transaction
+from ...utils import history, tools
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the payouts as CSV or NDJSON, oldest first. Rows are "
+        "streamed from the database in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=sorted(history.FORMATS), default="csv"
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="File to write to (default: stdout).",
+        )
+        parser.add_argument(
+            "--address", default=None, help="Destination address."
+        )
+        parser.add_argument(
+            "--tx-hash",
+            default=None,
+            help="Hash of one of the transfer's transactions.",
+        )
+        parser.add_argument(
+            "--since",
+            default=None,
+            help="ISO 8601 date/time to export from (including).",
+        )
+        parser.add_argument(
+            "--until",
+            default=None,
+            help="ISO 8601 date/time to export until (excluding).",
+        )
+
+    def handle(self, *args, **options):
+        times = dict()
+        for name in ("since", "until"):
+            if options[name]:
+                try:
+                    times[name] = history.parse_time(options[name])
+                except ValueError as e:
+                    raise CommandError(str(e))
+        if options["tx_hash"] and not tools.is_hash(options["tx_hash"]):
+            raise CommandError("Invalid tx hash.")
+        queryset = history.filter_transactions(
+            Transaction.objects.all(),
+            address=options["address"],
+            tx_hash=options["tx_hash"],
+            **times
+        )
+        _, lines = history.FORMATS[options["format"]]
+
+        rows = history.export_rows(queryset)
+        if not options["output"]:
+            for line in lines(rows):
+                self.stdout.write(line, ending="")
+            return
+        with open(options["output"], "w", newline="") as f:
+            for line in lines(rows):
+                f.write(line)
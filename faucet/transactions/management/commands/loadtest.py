@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import tools
+from ...utils.loadtest import LoadGenerator, parse_mix
+from ...utils.wallet_simulator import SimulatedWallet, WalletSimulator
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the faucet against a wallet simulator and reports throughput, "
+        "latency percentiles and error rates per endpoint as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--server",
+            choices=("uwsgi", "runserver", "uvicorn"),
+            default="uwsgi",
+            help="Server to run the faucet with.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=2,
+            help="Server processes (uwsgi, uvicorn).",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Threads per server process (uwsgi).",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="Number of concurrent clients.",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=30,
+            help="Seconds to send requests for.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=None,
+            help="Stop after this many requests.",
+        )
+        parser.add_argument(
+            "--mix",
+            default="index=1,balance=8,withdraw=1",
+            help="Traffic mix as endpoint=weight pairs.",
+        )
+        parser.add_argument(
+            "--wallet-latency",
+            type=float,
+            default=0.01,
+            help="Seconds the wallet takes per RPC call.",
+        )
+        parser.add_argument(
+            "--transfer-latency",
+            type=float,
+            default=0.5,
+            help="Seconds the wallet takes per transfer.",
+        )
+        parser.add_argument(
+            "--wallet-error-rate",
+            type=float,
+            default=0,
+            help="Share of wallet calls failing with HTTP 500.",
+        )
+        parser.add_argument(
+            "--wallet-balance",
+            type=float,
+            default=10000,
+            help="Balance of the wallet in XMR.",
+        )
+        parser.add_argument(
+            "--wallet-outputs",
+            type=int,
+            default=1000,
+            help="Number of outputs, each payout locks one for 10 blocks.",
+        )
+        parser.add_argument(
+            "--database-url",
+            default=None,
+            help="Database of the faucet (default: temporary sqlite file).",
+        )
+        parser.add_argument(
+            "--env",
+            action="append",
+            default=list(),
+            metavar="NAME=VALUE",
+            help="Setting passed to the faucet, e.g. LEDGER_ENABLE=True.",
+        )
+        parser.add_argument(
+            "--output", default=None, help="File to write the results to."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options["mix"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        workdir = tempfile.mkdtemp(prefix="faucet-loadtest-")
+        simulator = WalletSimulator(
+            wallet=SimulatedWallet(
+                balance=tools.float_to_xmr(options["wallet_balance"]),
+                outputs=options["wallet_outputs"],
+            ),
+            latency={
+                None: options["wallet_latency"],
+                "transfer_split": options["transfer_latency"],
+            },
+            error_rate={None: options["wallet_error_rate"]},
+        )
+        host, port = simulator.start()
+        env = self.server_env(options, host, port, workdir)
+        server = None
+        try:
+            subprocess.check_call(
+                [sys.executable, "manage.py", "migrate", "-v", "0"],
+                cwd=settings.BASE_DIR,
+                env=env,
+            )
+            server_port = free_port()
+            log = os.path.join(workdir, "server.log")
+            with open(log, "w") as f:
+                server = subprocess.Popen(
+                    self.server_command(options, server_port),
+                    cwd=settings.BASE_DIR,
+                    env=env,
+                    stdout=f,
+                    stderr=subprocess.STDOUT,
+                )
+            url = "http://127.0.0.1:{}".format(server_port)
+            self.wait_for(url, server, log)
+
+            results = LoadGenerator(url, mix, options["concurrency"]).run(
+                options["duration"], options["requests"]
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            simulator.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        results["config"] = {
+            "server": options["server"],
+            "processes": options["processes"],
+            "threads": options["threads"],
+            "concurrency": options["concurrency"],
+            "mix": mix,
+            "wallet_latency": options["wallet_latency"],
+            "transfer_latency": options["transfer_latency"],
+            "wallet_error_rate": options["wallet_error_rate"],
+            "wallet_balance": options["wallet_balance"],
+            "wallet_outputs": options["wallet_outputs"],
+            "env": options["env"],
+        }
+        results["wallet"] = {
+            "calls": dict(simulator.calls),
+            "errors": dict(simulator.errors),
+        }
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def server_env(self, options, host, port, workdir):
+        env = dict(os.environ)
+        env.update(
+            {
+                "WALLET_HOST": host,
+                "WALLET_PORT": str(port),
+                "DAEMON_HOST": host,
+                "DAEMON_PORT": str(port),
+                "DATABASE_URL": options["database_url"]
+                or "sqlite:///" + os.path.join(workdir, "db.sqlite3"),
+                "SECRET_KEY": settings.SECRET_KEY or "loadtest",
+            }
+        )
+        for setting in options["env"]:
+            name, _, value = setting.partition("=")
+            env[name] = value
+        return env
+
+    def server_command(self, options, port):
+        address = "127.0.0.1:{}".format(port)
+        if options["server"] == "runserver":
+            command = [sys.executable, "manage.py", "runserver", address]
+            return command + ["--noreload"]
+        if options["server"] == "uvicorn":
+            command = ["uvicorn", "faucet.asgi:application"]
+            command += ["--host", "127.0.0.1", "--port", str(port)]
+            command += ["--workers", str(options["processes"])]
+        else:
+            command = ["uwsgi", "--http", address, "--module", "faucet.wsgi"]
+            command += ["--master", "--enable-threads", "--die-on-term"]
+            command += ["--processes", str(options["processes"])]
+            command += ["--threads", str(options["threads"])]
+            command += ["--disable-logging"]
+        if shutil.which(command[0]) is None:
+            raise CommandError(
+                "{} is not installed, see --server.".format(command[0])
+            )
+        return command
+
+    def wait_for(self, url, server, log, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if server.poll() is not None:
+                with open(log) as f:
+                    raise CommandError("The server exited:\n" + f.read())
+            try:
+                requests.get(url + "/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError("The server did not start in time.")
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...utils import stats
+from ...utils.payout_queue import process_pending, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends queued payouts (PAYOUT_ASYNC_ENABLE) to the wallet, "
+        "reconciles interrupted ones and updates the payout statistics."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the queue once and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.PAYOUT_WORKER_INTERVAL,
+            help="Seconds to wait when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reconcile()
+            processed = process_pending()
+            while processed:
+                processed = process_pending()
+            stats.update()
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...utils import stats
+from ...utils.payout_queue import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Resolves payouts, whose transfers were interrupted or timed out, "
+        "with the transfers of the wallets and updates the payout "
+        "statistics."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Reconcile once and exit."
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60.0,
+            help="Seconds to wait between the runs.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            resolved = reconcile()
+            if resolved:
+                self.stdout.write("Resolved {} payouts".format(resolved))
+            stats.update()
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
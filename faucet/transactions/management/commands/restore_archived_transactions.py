@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import archive, history
+
+
+class Command(BaseCommand):
+    help = (
+        "Restores the archived transactions, filtered by address and time "
+        "range, into the database, or prints them as NDJSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", default=settings.ARCHIVE_DIR)
+        parser.add_argument(
+            "--address", default=None, help="Destination address."
+        )
+        parser.add_argument(
+            "--since",
+            default=None,
+            help="ISO 8601 date/time to read from (including).",
+        )
+        parser.add_argument(
+            "--until",
+            default=None,
+            help="ISO 8601 date/time to read until (excluding).",
+        )
+        parser.add_argument(
+            "--print",
+            action="store_true",
+            help="Only print the transactions as NDJSON.",
+        )
+
+    def handle(self, *args, **options):
+        times = dict()
+        for name in ("since", "until"):
+            if options[name]:
+                try:
+                    times[name] = history.parse_time(options[name])
+                except ValueError as e:
+                    raise CommandError(str(e))
+        rows = archive.read(
+            directory=options["directory"], address=options["address"], **times
+        )
+        if options["print"]:
+            for row in rows:
+                self.stdout.write(archive.to_line(row), ending="")
+            return
+        count = archive.restore(rows)
+        self.stdout.write("Restored {} transactions".format(count))
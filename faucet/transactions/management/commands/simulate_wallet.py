@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import tools
+from ...utils.wallet_simulator import SimulatedWallet, WalletSimulator
+
+
+def parse_options(values):
+    """Parses per method options like ["0.01", "transfer_split=0.5"].
+
+    :param values: list of SECONDS/RATE or METHOD=SECONDS/RATE
+    :returns: dict of method name (None for all others) and value
+    """
+
+    options = dict()
+    for value in values:
+        method, _, number = value.rpartition("=")
+        try:
+            options[method or None] = float(number)
+        except ValueError:
+            raise CommandError("Invalid value: {}".format(value))
+    return options
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a monero-wallet-rpc and monerod JSON-RPC simulator (getbalance, "
+        "get_address, transfer_split, get_info, get_transfers, "
+        "get_transfer_by_txid, incoming_transfers) with a simulated balance, "
+        "locked outputs and configurable latency, timeouts and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=settings.WALLET_PORT)
+        parser.add_argument(
+            "--balance",
+            type=float,
+            default=100,
+            help="Initial balance in XMR.",
+        )
+        parser.add_argument(
+            "--outputs",
+            type=int,
+            default=10,
+            help="Number of outputs the balance is split into.",
+        )
+        parser.add_argument(
+            "--block-time", type=float, default=120, help="Seconds per block."
+        )
+        parser.add_argument(
+            "--unlock-blocks",
+            type=int,
+            default=10,
+            help="Blocks until the change of a transfer is unlocked.",
+        )
+        parser.add_argument(
+            "--nettype",
+            choices=("mainnet", "stagenet", "testnet"),
+            default="stagenet",
+        )
+        parser.add_argument(
+            "--latency",
+            action="append",
+            default=list(),
+            metavar="[METHOD=]SECONDS",
+            help="Seconds to wait before answering (per method).",
+        )
+        parser.add_argument(
+            "--error-rate",
+            action="append",
+            default=list(),
+            metavar="[METHOD=]RATE",
+            help="Share of calls answered with HTTP 500 (per method).",
+        )
+        parser.add_argument(
+            "--timeout-rate",
+            action="append",
+            default=list(),
+            metavar="[METHOD=]RATE",
+            help="Share of calls answered after --hang seconds (per method).",
+        )
+        parser.add_argument(
+            "--hang",
+            type=float,
+            default=60,
+            help="Seconds to wait when simulating a timeout.",
+        )
+
+    def handle(self, *args, **options):
+        wallet = SimulatedWallet(
+            balance=tools.float_to_xmr(options["balance"]),
+            outputs=options["outputs"],
+            block_time=options["block_time"],
+            unlock_blocks=options["unlock_blocks"],
+            nettype=options["nettype"],
+        )
+        simulator = WalletSimulator(
+            host=options["host"],
+            port=options["port"],
+            wallet=wallet,
+            latency=parse_options(options["latency"]),
+            error_rate=parse_options(options["error_rate"]),
+            timeout_rate=parse_options(options["timeout_rate"]),
+            hang=options["hang"],
+        )
+        host, port = simulator.server_address
+        self.stdout.write("Simulating wallet on {0}:{1}".format(host, port))
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.server_close()
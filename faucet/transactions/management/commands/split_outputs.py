@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import networks, outputs, tools
+
+
+class Command(BaseCommand):
+    help = (
+        "Splits large outputs of the wallets into payout sized ones (by "
+        "transfers to the wallet itself), so payouts do not lock most of the "
+        "balance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            type=int,
+            default=settings.OUTPUT_SPLIT_TARGET,
+            help="Number of spendable outputs to keep per wallet.",
+        )
+        parser.add_argument(
+            "--size",
+            type=float,
+            help="Size of the outputs in XMR, defaults to the size of a "
+            "payout (MAXIMUM_PAYOUT, FACTOR_BALANCE) plus 10%%.",
+        )
+        parser.add_argument(
+            "--network",
+            default=networks.DEFAULT,
+            help="Network of the wallets (of NETWORKS).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only show the outputs to create.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Check once and exit."
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.OUTPUT_SPLIT_INTERVAL,
+            help="Seconds to wait between the checks.",
+        )
+
+    def handle(self, *args, **options):
+        if options["target"] < 1:
+            raise CommandError("The target is at least one output.")
+        size = None
+        if options["size"] is not None:
+            size = tools.float_to_xmr(options["size"])
+            if size <= 0:
+                raise CommandError("Invalid output size.")
+        try:
+            networks.activate(options["network"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        while True:
+            reports = outputs.split_outputs(
+                options["target"], size=size, dry_run=options["dry_run"]
+            )
+            for backend, report in reports.items():
+                self.write(backend, report)
+            if options["once"] or options["dry_run"]:
+                break
+            time.sleep(options["interval"])
+
+    def write(self, backend, report):
+        if "outputs" not in report:
+            self.stderr.write("{0}: {1}".format(backend, report["error"]))
+            return
+        self.stdout.write(
+            "{0}: {1} outputs, {2} XMR unlocked, {3} outputs of {4} XMR "
+            "planned, {5} created{6}".format(
+                backend,
+                report["outputs"],
+                tools.xmr_to_float(report["unlocked"]),
+                report["planned"],
+                tools.xmr_to_float(report["size"]),
+                report["created"],
+                " ({})".format(report["error"]) if "error" in report else "",
+            )
+        )
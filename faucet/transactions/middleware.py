@@ -0,0 +1,109 @@
+import json
+import time
+import logging
+
+from django.db import connection
+
+from ratelimit.exceptions import Ratelimited
+
+from .utils import metrics, timing, networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def view_name(request):
+    """Returns the name of the view, that served the request.
+
+    Unresolved paths are not labeled by path, so that scanners cannot
+    create arbitrary many time series.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    return match.view_name
+
+
+class MetricsMiddleware:
+    """Measures the duration of requests per view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        metrics.REQUEST_DURATION.labels(
+            view=view_name(request),
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - start)
+        return response
+
+    def process_exception(self, request, exception):
+        # django-ratelimit blocks before the view handles any exceptions
+        if isinstance(exception, Ratelimited):
+            metrics.reject(exception)
+
+
+class ServerTimingMiddleware:
+    """Reports the durations of a request's phases.
+
+    Phases are wallet RPCs ("rpc_<method>"), database queries ("db") and
+    the steps of a payout. Only a share of settings.SERVER_TIMING_SAMPLE_RATE
+    requests is timed; their phases are returned in the Server-Timing
+    header and logged as one JSON line.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not timing.sampled():
+            return self.get_response(request)
+
+        timer = timing.start()
+        try:
+            with connection.execute_wrapper(timing.database_wrapper):
+                response = self.get_response(request)
+        finally:
+            timing.stop()
+
+        response["Server-Timing"] = timer.header()
+        logger.info(
+            json.dumps(
+                {
+                    "event": "timing",
+                    "method": request.method,
+                    "path": request.path,
+                    "view": view_name(request),
+                    "status": response.status_code,
+                    "total_ms": round(timer.total() * 1000, 3),
+                    "phases": timer.as_dict(),
+                }
+            )
+        )
+        return response
+
+
+class NetworkMiddleware:
+    """Activates the network of the requested URL (/<network>/...).
+
+    The network is not passed on to the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            networks.deactivate()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if "network" in view_kwargs:
+            networks.activate(view_kwargs.pop("network"))
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed')], db_index=True, default='sent', max_length=8),
+        ),
+    ]
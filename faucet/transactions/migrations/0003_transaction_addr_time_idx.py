@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_transaction_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['destination_address', 'timestamp'], name='transaction_addr_time_idx'),
+        ),
+    ]
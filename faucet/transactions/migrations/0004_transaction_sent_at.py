@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_transaction_addr_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_transaction_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp', 'id'], name='transaction_time_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_transaction_time_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPayoutStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('payouts', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('amount', models.BigIntegerField(default=0)),
+                ('unique_addresses', models.PositiveIntegerField(default=0)),
+                ('unique_ip_hashes', models.PositiveIntegerField(default=0)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_dailypayoutstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='network',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
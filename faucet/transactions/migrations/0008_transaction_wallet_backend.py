@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_transaction_network'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='wallet_backend',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
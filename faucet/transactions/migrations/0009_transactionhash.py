@@ -0,0 +1,49 @@
+# Generated by Django 2.1.7 on 2026-10-18 21:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import transactions.models
+
+
+class Migration(migrations.Migration):
+    """Adds the compact columns next to the old ones (filled by 0010).
+    """
+
+    dependencies = [
+        ('transactions', '0008_transaction_wallet_backend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionHash',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tx_hash', transactions.models.HashField(db_index=True)),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashes', to='transactions.Transaction')),
+            ],
+            options={
+                'ordering': ('position',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='transactionhash',
+            unique_together={('transaction', 'position')},
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='ip_address_digest',
+            field=transactions.models.HashField(blank=True, null=True),
+        ),
+        # defaults, so the columns can be added again when migrating back
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_id',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='ip_address_hash',
+            field=models.TextField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,118 @@
+import hashlib
+import string
+
+from django.db import migrations, transaction
+
+# transactions migrated per database transaction
+BATCH_SIZE = 1000
+
+
+def is_hash(value):
+    return len(value) == 64 and all(c in string.hexdigits for c in value)
+
+
+def batches(Transaction, *fields):
+    """Iterates over all transactions in batches of values of fields.
+    """
+
+    last_id = 0
+    while True:
+        rows = list(
+            Transaction.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", *fields)[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+def group(rows):
+    """Returns a dict of value and the ids of the (id, value) rows.
+    """
+
+    groups = dict()
+    for pk, value in rows:
+        groups.setdefault(value, list()).append(pk)
+    return groups
+
+
+def forwards(apps, schema_editor):
+    """Copies the tx hashes into TransactionHash and the IP hashes into the
+    binary column.
+
+    Every batch is committed on its own and migrated again as a whole if
+    the migration is interrupted, so it can be resumed.
+    """
+
+    Transaction = apps.get_model("transactions", "Transaction")
+    TransactionHash = apps.get_model("transactions", "TransactionHash")
+    for rows in batches(Transaction, "transaction_id", "ip_address_hash"):
+        hashes = list()
+        digests = list()
+        for pk, transaction_id, ip_address_hash in rows:
+            tx_hashes = [h for h in transaction_id.split(",") if is_hash(h)]
+            hashes.extend(
+                TransactionHash(transaction_id=pk, tx_hash=h, position=i)
+                for i, h in enumerate(tx_hashes)
+            )
+            if ip_address_hash and not is_hash(ip_address_hash):
+                # keeps them distinct
+                ip_address_hash = hashlib.sha256(
+                    ip_address_hash.encode("utf-8")
+                ).hexdigest()
+            digests.append((pk, ip_address_hash))
+
+        with transaction.atomic():
+            TransactionHash.objects.filter(
+                transaction_id__in=[row[0] for row in rows]
+            ).delete()
+            TransactionHash.objects.bulk_create(hashes)
+            for digest, pks in group(digests).items():
+                Transaction.objects.filter(id__in=pks).update(
+                    ip_address_digest=digest
+                )
+
+
+def backwards(apps, schema_editor):
+    Transaction = apps.get_model("transactions", "Transaction")
+    TransactionHash = apps.get_model("transactions", "TransactionHash")
+    for rows in batches(Transaction, "ip_address_digest"):
+        pks = [row[0] for row in rows]
+        tx_hashes = dict()
+        for pk, tx_hash in (
+            TransactionHash.objects.filter(transaction_id__in=pks)
+            .order_by("transaction_id", "position")
+            .values_list("transaction_id", "tx_hash")
+        ):
+            tx_hashes.setdefault(pk, list()).append(tx_hash)
+        transaction_ids = [
+            (pk, ",".join(tx_hashes.get(pk, list()))) for pk in pks
+        ]
+
+        with transaction.atomic():
+            for transaction_id, ids in group(transaction_ids).items():
+                Transaction.objects.filter(id__in=ids).update(
+                    transaction_id=transaction_id
+                )
+            for ip_address_hash, ids in group(rows).items():
+                Transaction.objects.filter(id__in=ids).update(
+                    ip_address_hash=ip_address_hash
+                )
+
+
+class Migration(migrations.Migration):
+    """Fills the compact columns of 0009 in batches.
+    """
+
+    # batches are committed one by one
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0009_transactionhash'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
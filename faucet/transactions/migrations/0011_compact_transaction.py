@@ -0,0 +1,32 @@
+# Generated by Django 2.1.7 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Replaces the old columns by the compact ones filled by 0010.
+    """
+
+    dependencies = [
+        ('transactions', '0010_transaction_hashes_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='transaction',
+            name='transaction_id',
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='ip_address_hash',
+        ),
+        migrations.RenameField(
+            model_name='transaction',
+            old_name='ip_address_digest',
+            new_name='ip_address_hash',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['ip_address_hash', 'timestamp'], name='transaction_ip_time_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:52
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_compact_transaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # existing rows keep NULL, a default would give all of them the same
+        # token
+        migrations.AddField(
+            model_name='transaction',
+            name='token',
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed'), ('unknown', 'unknown')], db_index=True, default='sent', max_length=8),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.1.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0012_transaction_claimed_at_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailypayoutstats',
+            name='network',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='dailypayoutstats',
+            name='day',
+            field=models.DateField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailypayoutstats',
+            unique_together={('day', 'network')},
+        ),
+    ]
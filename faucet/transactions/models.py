@@ -1,18 +1,189 @@
+import uuid
+
 from django.db import models
 
 
+class HashField(models.BinaryField):
+    """A 32 byte hash (e.g. SHA-256), stored in binary form.
+
+    Values are hex encoded strings in Python, so the field is used like a
+    text field. The empty string is stored as NULL.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return ""
+        return bytes(value).hex()
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value).hex()
+        return value
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            return bytes.fromhex(value) if value else None
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+
 class Transaction(models.Model):
     """Represents a monero withdrawal from the wallet.
+
+    The hashes of the transfer's transactions are stored in TransactionHash,
+    transaction_id joins them (comma separated).
     """
 
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    # the transfer may have been sent (e.g. it timed out), to be reconciled
+    # with the wallet's transfers
+    UNKNOWN = "unknown"
+    STATUS_CHOICES = (
+        (PENDING, "pending"),
+        (SENDING, "sending"),
+        (SENT, "sent"),
+        (FAILED, "failed"),
+        (UNKNOWN, "unknown"),
+    )
+
     amount = models.BigIntegerField()
     destination_address = models.TextField(max_length=95)
-    transaction_id = models.TextField()
-    ip_address_hash = models.TextField(max_length=64)
+    ip_address_hash = HashField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(
+        max_length=8, choices=STATUS_CHOICES, default=SENT, db_index=True
+    )
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # when the transfer was started (status sending)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # looks up the payout's status, empty for payouts stored before
+    token = models.UUIDField(
+        default=uuid.uuid4, unique=True, null=True, editable=False
+    )
+    # one of settings.NETWORKS, empty for the default network
+    network = models.CharField(max_length=16, blank=True, default="")
+    # "host:port" of the monero-wallet-rpc which sent the payout
+    wallet_backend = models.CharField(max_length=255, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["destination_address", "timestamp"],
+                name="transaction_addr_time_idx",
+            ),
+            # keyset pagination of the history
+            models.Index(
+                fields=["timestamp", "id"], name="transaction_time_id_idx"
+            ),
+            models.Index(
+                fields=["ip_address_hash", "timestamp"],
+                name="transaction_ip_time_idx",
+            ),
+        ]
+
+    # tx hashes to be saved, see transaction_id
+    _tx_hashes = None
+
+    @property
+    def transaction_id(self):
+        """The comma separated hashes of the transfer's transactions.
+
+        Set hashes are saved to TransactionHash by save().
+        """
+
+        if self._tx_hashes is not None:
+            return ",".join(self._tx_hashes)
+        if self.pk is None:
+            return ""
+        return ",".join(h.tx_hash for h in self.hashes.all())
+
+    @transaction_id.setter
+    def transaction_id(self, value):
+        self._tx_hashes = [h for h in (value or "").split(",") if h]
+
+    def tx_hash_objects(self):
+        """Returns the (unsaved) TransactionHash of the set hashes.
+        """
+
+        return [
+            TransactionHash(transaction=self, tx_hash=tx_hash, position=i)
+            for i, tx_hash in enumerate(self._tx_hashes or list())
+        ]
+
+    def save(self, *args, **kwargs):
+        """Saves the transaction and its set hashes.
+
+        "transaction_id" may be part of update_fields.
+        """
+
+        update_fields = kwargs.get("update_fields")
+        save_hashes = self._tx_hashes is not None
+        if update_fields is not None:
+            save_hashes = save_hashes and "transaction_id" in update_fields
+            kwargs["update_fields"] = [
+                f for f in update_fields if f != "transaction_id"
+            ]
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if save_hashes:
+            if not adding:
+                self.hashes.all().delete()
+            TransactionHash.objects.bulk_create(self.tx_hash_objects())
 
     def __str__(self):
         """Converts the object to string and only returns most relevant information.
         """
 
         return self.transaction_id
+
+
+class TransactionHash(models.Model):
+    """The hash of a transaction of a payout's transfer.
+
+    A transfer may consist of several transactions, and a batched transfer
+    pays several payouts.
+    """
+
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name="hashes"
+    )
+    tx_hash = HashField(db_index=True)
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ("position",)
+        unique_together = (("transaction", "position"),)
+
+    def __str__(self):
+        return self.tx_hash
+
+
+class DailyPayoutStats(models.Model):
+    """Rollup of the transactions of a day (UTC).
+
+    Maintained by transactions.utils.stats from the transactions with ids
+    greater than last_transaction_id, per day and network.
+    """
+
+    day = models.DateField()
+    # one of settings.NETWORKS, empty for the default network
+    network = models.CharField(max_length=16, blank=True, default="")
+    payouts = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # sent in XMR format
+    amount = models.BigIntegerField(default=0)
+    unique_addresses = models.PositiveIntegerField(default=0)
+    unique_ip_hashes = models.PositiveIntegerField(default=0)
+    last_transaction_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("day", "network"),)
+
+    def __str__(self):
+        return str(self.day)
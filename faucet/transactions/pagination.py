@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .utils import history
+
+
+class KeysetPagination(BasePagination):
+    """Paginates transactions by (timestamp, id), newest first.
+
+    The next page is requested with the cursor parameter returned as "next",
+    its size with the limit parameter.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 100
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(
+                request.query_params.get(
+                    self.page_size_query_param, self.page_size
+                )
+            )
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Invalid."})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: "Invalid."})
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                queryset = history.before(
+                    queryset, *history.decode_cursor(cursor)
+                )
+            except ValueError as e:
+                raise ValidationError({self.cursor_query_param: str(e)})
+
+        # one more to know whether there is a next page
+        page = list(queryset.order_by("-timestamp", "-id")[: page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            self.next_cursor = history.encode_cursor(last.timestamp, last.pk)
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
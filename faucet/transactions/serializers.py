@@ -1,20 +1,32 @@
 import logging
+from contextlib import contextmanager
 
 from rest_framework import serializers
 from django.conf import settings
 from django.core.validators import MinLengthValidator
 from django.http import JsonResponse
+from django.utils import timezone
 from rest_framework import status
 
-from .models import Transaction
+from .models import Transaction, DailyPayoutStats
 from .exceptions import (
     RpcConnectionError,
+    TransferStateUnknownError,
     MakeTransactionError,
     RatelimitedByWithdrawalsError,
 )
 
-from .utils.wallet_rpc import WalletRPC, get_current_amount
-from .utils import tools
+from .utils.wallet_rpc import get_current_amount
+from .utils import (
+    tools,
+    backends,
+    batch,
+    limits,
+    locks,
+    metrics,
+    timing,
+    history,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -49,33 +61,278 @@ class TransactionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Transaction
-        fields = ("amount", "transaction_id", "destination_address")
-        read_only_fields = ("amount", "transaction_id")
+        fields = (
+            "id",
+            "token",
+            "status",
+            "amount",
+            "transaction_id",
+            "destination_address",
+        )
+        read_only_fields = (
+            "id",
+            "token",
+            "status",
+            "amount",
+            "transaction_id",
+        )
 
     def save(self, **kwargs):
         try:
             destination_address = self.validated_data.get(
                 "destination_address"
             )
-            if tools.addr_withdrew_too_often(
-                destination_address=destination_address,
-                rate_allowed=settings.ADDRESS_RATE_PER_DAY,
-                days=1,
+            # only one payout per address (and IP address) is in flight
+            # concurrent requests for the same address are rejected
+            with locks.withdrawal_lock(
+                destination_address, self.validated_data.get("ip_address_hash")
             ):
-                logger.warning(
-                    "Blocked by number of withdrawals per day limitation."
-                )
-                raise RatelimitedByWithdrawalsError
-            transaction = WalletRPC.make_transaction(
-                destination_address=destination_address,
-                amount=get_current_amount(settings.FACTOR_BALANCE),
-            )
-            self.validated_data.update(transaction)
-            logger.info("store tx {}".format(transaction))
-            return super().save(**kwargs)
+                return self.check_and_pay(destination_address, **kwargs)
         except (ValueError, RpcConnectionError) as e:
             logger.error(str(e))
             raise MakeTransactionError(str(e))
 
+    def check_and_pay(self, destination_address, **kwargs):
+        self.check_withdrawals()
+        with self.wallet_backend() as backend:
+            with timing.phase("amount"):
+                amount = get_current_amount(settings.FACTOR_BALANCE, backend)
+            if settings.PAYOUT_ASYNC_ENABLE:
+                instance = self.queue(amount, **kwargs)
+            elif settings.LEDGER_ENABLE:
+                instance = self.reserve(amount, **kwargs)
+                try:
+                    transaction = self.pay(
+                        destination_address, amount, backend
+                    )
+                except BaseException as e:
+                    self.release(instance, e)
+                    raise
+                self.complete(instance, transaction)
+            else:
+                try:
+                    transaction = self.pay(
+                        destination_address, amount, backend
+                    )
+                except TransferStateUnknownError as e:
+                    self.release(self.reserve(amount, **kwargs), e)
+                    raise
+                instance = self.store(transaction, **kwargs)
+        self.record()
+        return instance
+
+    @contextmanager
+    def wallet_backend(self):
+        """Acquires the wallet backend to pay from.
+
+        Only if payouts are routed across several wallet backends and sent
+        right away (not queued or batched), so the amount is calculated from
+        the balance of the backend sending it. None otherwise, the backend
+        is chosen when the transfer is made.
+
+        :raises WalletBusyError: if all wallet backends are busy
+        """
+
+        if (
+            settings.PAYOUT_ASYNC_ENABLE
+            or settings.PAYOUT_BATCH_ENABLE
+            or not backends.is_routed()
+        ):
+            yield None
+            return
+        with backends.acquire() as backend:
+            yield backend
+
+    @timing.phase("transfer")
+    def pay(self, destination_address, amount, backend=None):
+        """Sends the payout (within a batch if enabled).
+        """
+
+        try:
+            return batch.make_transaction(
+                destination_address=destination_address,
+                amount=amount,
+                backend=backend,
+            )
+        except TransferStateUnknownError:
+            metrics.payout(Transaction.UNKNOWN)
+            raise
+        except (ValueError, RpcConnectionError):
+            metrics.payout(Transaction.FAILED)
+            raise
+
+    @timing.phase("withdrawal_check")
+    def check_withdrawals(self):
+        """Checks the daily withdrawal quotas.
+
+        :raises RatelimitedByWithdrawalsError: if the payout is blocked
+        """
+
+        if limits.withdrew_too_often(
+            destination_address=self.validated_data.get("destination_address"),
+            ip_address_hash=self.validated_data.get("ip_address_hash"),
+            days=1,
+        ):
+            logger.warning(
+                "Blocked by number of withdrawals per day limitation."
+            )
+            raise RatelimitedByWithdrawalsError
+
+    def record(self):
+        """Counts the payout towards the daily withdrawal quotas.
+        """
+
+        limits.record(
+            self.validated_data.get("destination_address"),
+            self.validated_data.get("ip_address_hash"),
+        )
+
+    @timing.phase("store")
+    def queue(self, amount, **kwargs):
+        """Stores the payout to be sent by the process_payouts worker.
+        """
+
+        self.validated_data.update(
+            {
+                "amount": amount,
+                "transaction_id": "",
+                "status": Transaction.PENDING,
+            }
+        )
+        logger.info("queue payout {}".format(amount))
+        metrics.payout(Transaction.PENDING)
+        return super().save(**kwargs)
+
+    @timing.phase("store")
+    def reserve(self, amount, **kwargs):
+        """Stores the payout before sending it.
+
+        This way, the amount is already reserved in the ledger for
+        concurrent requests, while the transfer is in flight.
+        The payout is to be released if the transfer fails.
+        """
+
+        self.validated_data.update(
+            {
+                "amount": amount,
+                "transaction_id": "",
+                "status": Transaction.SENDING,
+                "claimed_at": timezone.now(),
+            }
+        )
+        return super().save(**kwargs)
+
+    @timing.phase("store")
+    def release(self, instance, error):
+        """Releases a reserved payout, whose transfer failed.
+
+        The payout is removed, if the transfer was certainly not sent (no
+        connection or an error answered by the wallet). Otherwise (e.g. it
+        timed out or the request was interrupted), it is marked unknown: it
+        still counts towards the quotas and the ledger, until
+        payout_queue.reconcile() finds out whether it was sent.
+
+        :param instance: the reserved payout
+        :param error: the exception raised while sending it
+        """
+
+        if isinstance(error, RpcConnectionError) and not isinstance(
+            error, TransferStateUnknownError
+        ):
+            instance.delete()
+            return
+        Transaction.objects.filter(pk=instance.pk).update(
+            status=Transaction.UNKNOWN
+        )
+        self.record()
+
+    @timing.phase("store")
+    def complete(self, instance, transaction):
+        """Marks a reserved payout as sent.
+        """
+
+        instance.transaction_id = transaction["transaction_id"]
+        instance.wallet_backend = transaction.get("wallet_backend", "")
+        instance.status = Transaction.SENT
+        instance.sent_at = timezone.now()
+        instance.save(
+            update_fields=[
+                "transaction_id",
+                "wallet_backend",
+                "status",
+                "sent_at",
+            ]
+        )
+        logger.info("store tx {}".format(transaction))
+        metrics.payout(Transaction.SENT, instance.amount)
+        return instance
+
+    @timing.phase("store")
+    def store(self, transaction, **kwargs):
+        """Stores a payout that was sent already.
+        """
+
+        self.validated_data.update(transaction)
+        self.validated_data.update({"sent_at": timezone.now()})
+        logger.info("store tx {}".format(transaction))
+        metrics.payout(Transaction.SENT, transaction["amount"])
+        return super().save(**kwargs)
+
+    @timing.phase("serialize")
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+    def get_amount(self, obj):
+        return tools.xmr_to_float(obj.amount)
+
+
+class TransactionStatusSerializer(serializers.ModelSerializer):
+    """Serializes the state of a (queued) payout.
+    """
+
+    amount = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Transaction
+        fields = ("token", "status", "amount", "transaction_id")
+        read_only_fields = fields
+
+    def get_amount(self, obj):
+        return tools.xmr_to_float(obj.amount)
+
+
+class TransactionHistorySerializer(serializers.ModelSerializer):
+    """Serializes a payout of the history.
+    """
+
+    amount = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Transaction
+        fields = history.FIELDS
+        read_only_fields = fields
+
+    def get_amount(self, obj):
+        return tools.xmr_to_float(obj.amount)
+
+
+class DailyPayoutStatsSerializer(serializers.ModelSerializer):
+    """Serializes the payout statistics of a day.
+    """
+
+    amount = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DailyPayoutStats
+        fields = (
+            "day",
+            "payouts",
+            "failed",
+            "amount",
+            "unique_addresses",
+            "unique_ip_hashes",
+        )
+        read_only_fields = fields
+
     def get_amount(self, obj):
         return tools.xmr_to_float(obj.amount)
@@ -1,18 +1,71 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 from django.test.utils import override_settings
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
 from rest_framework.test import APITestCase
 
-from .exceptions import MakeTransactionError
-from .models import Transaction
+from .exceptions import (
+    MakeTransactionError,
+    PayoutInProgressError,
+    RpcConnectionError,
+    TransferStateUnknownError,
+    WalletBusyError,
+)
+from .models import Transaction, TransactionHash, DailyPayoutStats
 
 from unittest import mock
 import logging
+import threading
+import time
+import datetime
+import asyncio
+import json
+import io
+import os
+import shutil
+import tempfile
+import socket
+import requests
 from decimal import Decimal
 
 from .utils import tools
+from .utils.batch import PayoutBatcher
+from .utils import payout_queue
+from .utils import rpc_client
+from .utils.rpc_client import RpcClient
+from .utils import wallet_rpc
+from .utils import limits
+from .utils import throttle
+from .utils import ledger
+from .utils import locks
+from .utils import loadtest
+from .utils import history
+from .utils import archive
+from .utils import stats
+from .utils import networks
+from .utils import backends
+from .utils import outputs
+from .utils import idempotency
+from .utils import health
+from .utils import metrics
+from .utils.wallet_simulator import SimulatedWallet, WalletSimulator
+from .utils.rpc_client import get_wallet_client
+from . import views
+from . import async_views
+from .utils import async_rpc_client
+from .utils.async_rpc_client import AsyncRpcClient
+from .utils.async_wallet_rpc import AsyncWalletRPC
+from asgiref.sync import async_to_sync, sync_to_async
+from prometheus_client import REGISTRY
 from .utils.wallet_rpc import WalletRPC
-from .utils.wallet_rpc import AuthServiceProxy
+from .utils.wallet_rpc import AuthServiceProxy, JSONRPCException
 
 # logging.basicConfig()
 # logger = logging.getLogger(__name__)
@@ -43,7 +96,7 @@ def mocked_make_rpc_success(url, rpc_input, headers):
     return RpcResponse()
 
 
-def mocked_make_transaction(destination_address, amount):
+def mocked_make_transaction(destination_address, amount, backend=None):
     transaction = dict()
     transaction.update(
         {
@@ -56,6 +109,23 @@ def mocked_make_transaction(destination_address, amount):
     return transaction
 
 
+def mocked_make_transactions(destinations, backend=None):
+    return [
+        mocked_make_transaction(
+            destination_address=d["address"], amount=d["amount"]
+        )
+        for d in destinations
+    ]
+
+
+async def mocked_async_get_balance():
+    return mocked_get_balance()
+
+
+async def mocked_async_make_transaction(destination_address, amount):
+    return mocked_make_transaction(destination_address, amount)
+
+
 def mocked_get_client_ip_error(_):
     raise MakeTransactionError()
 
@@ -186,6 +256,10 @@ class TransactionsApiViewTests(TestCase):
 
 
 class TransactionsApiViewTests_Api(APITestCase):
+    def setUp(self):
+        # balances and rate limits are cached
+        cache.clear()
+
     @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
     @mock.patch.object(
         AuthServiceProxy, "_get_response", mocked_make_rpc_success
@@ -333,3 +407,2478 @@ class TransactionsApiViewTests_Api(APITestCase):
         )
         self.assertEqual(response.status_code, 500)
         self.assertEqual(Transaction.objects.count(), 0)
+
+
+class PayoutBatcherTests(TestCase):
+    @mock.patch.object(WalletRPC, "make_transactions")
+    def test_batch_is_sent_when_full(self, make_transactions):
+        """A full batch is sent with a single transfer_split.
+
+        Every caller gets the shared transaction ID.
+        """
+
+        make_transactions.side_effect = mocked_make_transactions
+        batcher = PayoutBatcher(window=60, size=3)
+        address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+        results = list()
+
+        def submit(amount):
+            results.append(batcher.submit(address, amount))
+
+        threads = [
+            threading.Thread(target=submit, args=(amount,))
+            for amount in range(1, 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(make_transactions.call_count, 1)
+        self.assertEqual(len(make_transactions.call_args[0][0]), 3)
+        self.assertEqual(
+            sorted(result["amount"] for result in results), [1, 2, 3]
+        )
+        self.assertEqual(
+            len(set(result["transaction_id"] for result in results)), 1
+        )
+
+    @mock.patch.object(WalletRPC, "make_transactions")
+    def test_integrated_addresses_are_not_batched_together(
+        self, make_transactions
+    ):
+        """A transaction can only contain one payment ID.
+        """
+
+        make_transactions.side_effect = mocked_make_transactions
+        batcher = PayoutBatcher(window=0.01, size=15)
+        integrated = "5KR5fayZWUWixRyVnDRrhKGiA7UBHujuqakhxem7tmUS6MLpeeFWCgpcoQaxSpfzTeKUHTfd8nn4sDG8uTKqdunZhW8B3xaDLUfGgjMobn"
+        threads = [
+            threading.Thread(target=batcher.submit, args=(integrated, 1))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(make_transactions.call_count, 2)
+        for call in make_transactions.call_args_list:
+            self.assertEqual(len(call[0][0]), 1)
+
+    @mock.patch.object(WalletRPC, "make_transactions")
+    def test_errors_are_raised_for_every_payout(self, make_transactions):
+        """If the transfer fails, every caller of the batch gets the error.
+        """
+
+        make_transactions.side_effect = RpcConnectionError("no wallet")
+        batcher = PayoutBatcher(window=0.01, size=15)
+        address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with self.assertRaises(RpcConnectionError):
+            batcher.submit(address, 1)
+
+
+@override_settings(PAYOUT_ASYNC_ENABLE=True)
+class PayoutQueueTests(APITestCase):
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transactions")
+    def test_queued_payout_is_sent_by_worker(self, make_transactions):
+        """A payout is queued and sent by the worker later on.
+
+        POST /transactions/
+        GET /transactions/<id>/
+        """
+
+        make_transactions.side_effect = mocked_make_transactions
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json().get("status"), Transaction.PENDING)
+        make_transactions.assert_not_called()
+
+        token = response.json().get("token")
+        response = self.client.get("/transactions/{}/".format(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json().get("status"), Transaction.PENDING)
+        # not by the sequential id
+        response = self.client.get(
+            "/transactions/{}/".format(response.json().get("id"))
+        )
+        self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(payout_queue.process_pending(), 1)
+        self.assertEqual(payout_queue.process_pending(), 0)
+        make_transactions.assert_called_once()
+
+        response = self.client.get("/transactions/{}/".format(token))
+        self.assertEqual(response.json().get("status"), Transaction.SENT)
+        self.assertEqual(
+            response.json().get("transaction_id"),
+            "c8d815f48f27d53fdaf198a74b292a91bfaf87529a9a9a9ee66079a890b3b58b",
+        )
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transactions")
+    def test_failed_payout(self, make_transactions):
+        """A payout is marked failed if the wallet could not send it.
+        """
+
+        make_transactions.side_effect = RpcConnectionError("no wallet")
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(payout_queue.process_pending(), 1)
+        self.assertEqual(Transaction.objects.get().status, Transaction.FAILED)
+
+    def test_timed_out_payouts_are_reconciled(self):
+        """Payouts of timed out transfers count towards the quotas until
+        they are found in the wallet's transfers.
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+        for _ in range(2):
+            Transaction.objects.create(
+                amount=10 ** 12,
+                destination_address=destination_address,
+                transaction_id="",
+                ip_address_hash="",
+                status=Transaction.PENDING,
+            )
+        # the second one's worker died while sending
+        interrupted = Transaction.objects.latest("id")
+        Transaction.objects.filter(pk=interrupted.pk).update(
+            status=Transaction.SENDING, claimed_at=timezone.now()
+        )
+
+        with WalletSimulator(
+            timeout_rate={"transfer_split": 1}, hang=0.5
+        ) as simulator:
+            host, port = simulator.server_address
+            with override_settings(
+                WALLET_HOST=host,
+                WALLET_PORT=port,
+                RPC_TIMEOUTS={"default": (1, 1), "transfer_split": (1, 0.1)},
+            ):
+                self.assertEqual(payout_queue.process_pending(), 1)
+                timed_out = Transaction.objects.earliest("id")
+                self.assertEqual(timed_out.status, Transaction.UNKNOWN)
+                self.assertTrue(
+                    tools.addr_withdrew_too_often(
+                        destination_address, rate_allowed=2, days=1
+                    )
+                )
+
+                # nothing to reconcile yet
+                self.assertEqual(payout_queue.reconcile(), 0)
+                # the wallet sends the transfer after all
+                time.sleep(0.6)
+                self.assertEqual(payout_queue.reconcile(timeout=0), 2)
+            transfers = simulator.wallet.transfers
+
+        timed_out.refresh_from_db()
+        self.assertEqual(timed_out.status, Transaction.SENT)
+        self.assertEqual(timed_out.transaction_id, transfers[-1]["txid"])
+        interrupted.refresh_from_db()
+        self.assertEqual(interrupted.status, Transaction.FAILED)
+
+
+class RpcClientTests(TestCase):
+    def rpc_response(self):
+        response = mock.Mock(status_code=200)
+        response.text = (
+            '{"id": 0, "jsonrpc": "2.0", "result": {"unlocked_balance": 1}}'
+        )
+        return response
+
+    @override_settings(RPC_RETRIES=2, RPC_RETRY_BACKOFF=0)
+    def test_idempotent_calls_are_retried(self):
+        """Idempotent calls are retried on connection errors.
+        """
+
+        client = RpcClient("localhost", 38083)
+        with mock.patch.object(client.session, "post") as post:
+            post.side_effect = [
+                requests.ConnectionError("down"),
+                self.rpc_response(),
+            ]
+            result = client.call("getbalance")
+
+        self.assertEqual(result, {"unlocked_balance": 1})
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(client.stats()["retries"], {"getbalance": 1})
+        self.assertEqual(client.stats()["calls"], {"getbalance": 2})
+
+    @override_settings(RPC_RETRIES=2, RPC_RETRY_BACKOFF=0)
+    def test_transfers_are_never_retried(self):
+        """Transfers are not retried, since they could have been sent.
+        """
+
+        client = RpcClient("localhost", 38083)
+        with mock.patch.object(client.session, "post") as post:
+            post.side_effect = requests.ConnectionError("down")
+            with self.assertRaises(JSONRPCException):
+                client.call("transfer_split", {"destinations": []})
+
+        self.assertEqual(post.call_count, 1)
+
+    def test_timeouts_per_method(self):
+        """Transfers get a longer read timeout than other calls.
+        """
+
+        client = RpcClient("localhost", 38083)
+        with mock.patch.object(client.session, "post") as post:
+            post.return_value = self.rpc_response()
+            client.call("getbalance")
+            client.call("transfer_split", {"destinations": []})
+
+        self.assertEqual(
+            post.call_args_list[0][1]["timeout"],
+            settings.RPC_TIMEOUTS["default"],
+        )
+        self.assertEqual(
+            post.call_args_list[1][1]["timeout"],
+            settings.RPC_TIMEOUTS["transfer_split"],
+        )
+
+
+class BalanceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @mock.patch.object(WalletRPC, "get_balance")
+    def test_balance_is_cached(self, get_balance):
+        """The wallet is only asked once within BALANCE_CACHE_TTL.
+        """
+
+        get_balance.return_value = mocked_get_balance()
+        for _ in range(3):
+            self.assertEqual(wallet_rpc.get_balance(), mocked_get_balance())
+        get_balance.assert_called_once()
+
+    @mock.patch.object(WalletRPC, "get_balance")
+    def test_stale_balance_is_served_while_refreshing(self, get_balance):
+        """A stale balance is returned and refreshed in the background.
+        """
+
+        get_balance.return_value = 2
+        cache.set(
+            wallet_rpc.BALANCE_CACHE_KEY,
+            {"balance": 1, "fetched_at": 0},
+            settings.BALANCE_CACHE_MAX_AGE,
+        )
+        with mock.patch("threading.Thread") as thread:
+            self.assertEqual(wallet_rpc.get_balance(), 1)
+            self.assertEqual(wallet_rpc.get_balance(), 1)
+        # only one refresh is started
+        thread.assert_called_once()
+        thread.call_args[1]["target"]()
+
+        self.assertEqual(wallet_rpc.get_balance(), 2)
+        get_balance.assert_called_once()
+
+    @mock.patch.object(WalletRPC, "get_balance")
+    def test_concurrent_misses_are_coalesced(self, get_balance):
+        """While another process fetches the balance, its result is used.
+        """
+
+        cache.add(wallet_rpc.BALANCE_LOCK_KEY, True, 10)
+        timer = threading.Timer(
+            0.1,
+            cache.set,
+            args=(
+                wallet_rpc.BALANCE_CACHE_KEY,
+                {"balance": 3, "fetched_at": 10 ** 10},
+            ),
+        )
+        timer.start()
+
+        self.assertEqual(wallet_rpc.get_balance(), 3)
+        get_balance.assert_not_called()
+
+
+class IndexPageTests(TestCase):
+    def setUp(self):
+        views._index_pages.clear()
+        WalletRPC.addresses.clear()
+
+    def tearDown(self):
+        views._index_pages.clear()
+        WalletRPC.addresses.clear()
+
+    @mock.patch.dict(WalletRPC.network_types, {"": "stagenet"})
+    @mock.patch.object(WalletRPC, "get_address")
+    def test_index_is_rendered_once(self, get_address):
+        """The wallet's address is requested once for many page loads.
+
+        GET /
+        """
+
+        get_address.return_value = "5ADDRESS"
+        for _ in range(3):
+            response = self.client.get("/")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"5ADDRESS", response.content)
+            self.assertIn(b"Monero stagenet faucet", response.content)
+        get_address.assert_called_once()
+
+    @mock.patch.dict(WalletRPC.network_types, {"": "stagenet"})
+    @mock.patch.object(WalletRPC, "get_address")
+    def test_index_revalidation(self, get_address):
+        """Requests with a matching ETag get 304 Not Modified.
+
+        GET /
+        """
+
+        get_address.return_value = "5ADDRESS"
+        response = self.client.get("/")
+        self.assertTrue(response.has_header("ETag"))
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+class WithdrawalLimitTests(TestCase):
+    def test_only_given_address_is_counted(self):
+        """Withdrawals to other addresses and failed payouts are ignored.
+        """
+
+        for status in (Transaction.SENT, Transaction.FAILED):
+            Transaction.objects.bulk_create(
+                Transaction(
+                    amount=1,
+                    destination_address=address,
+                    transaction_id="",
+                    ip_address_hash="",
+                    status=status,
+                )
+                for address in ("5OTHER", "5ADDRESS")
+            )
+
+        self.assertFalse(
+            tools.addr_withdrew_too_often(
+                destination_address="5ADDRESS", rate_allowed=2, days=1
+            )
+        )
+        self.assertTrue(
+            tools.addr_withdrew_too_often(
+                destination_address="5ADDRESS", rate_allowed=1, days=1
+            )
+        )
+
+    def test_only_given_ip_hash_is_counted(self):
+        """Withdrawals from other IPs and failed payouts are ignored.
+        """
+
+        ip_address_hash = tools.hash_ip("127.0.0.1")
+        for status in (Transaction.SENT, Transaction.FAILED):
+            Transaction.objects.bulk_create(
+                Transaction(
+                    amount=1,
+                    destination_address=address,
+                    ip_address_hash=ip_hash,
+                    status=status,
+                )
+                for address, ip_hash in (
+                    ("5OTHER", tools.hash_ip("127.0.0.2")),
+                    ("5ADDRESS", ip_address_hash),
+                )
+            )
+
+        self.assertFalse(
+            tools.ip_withdrew_too_often(
+                ip_address_hash, rate_allowed=2, days=1
+            )
+        )
+        self.assertTrue(
+            tools.ip_withdrew_too_often(
+                ip_address_hash, rate_allowed=1, days=1
+            )
+        )
+
+    @override_settings(IPV4_PREFIX=24)
+    def test_ip_hash_of_subnet(self):
+        self.assertEqual(
+            tools.hash_ip("2001:db8::1"), tools.hash_ip("2001:db8::2")
+        )
+        self.assertNotEqual(
+            tools.hash_ip("2001:db8::1"), tools.hash_ip("2001:db8:0:1::1")
+        )
+        self.assertEqual(tools.hash_ip("10.0.0.1"), tools.hash_ip("10.0.0.2"))
+        self.assertNotEqual(
+            tools.hash_ip("10.0.0.1"), tools.hash_ip("10.0.1.1")
+        )
+        self.assertEqual(len(tools.hash_ip("unknown")), 64)
+
+    def test_keyed_ip_hash(self):
+        self.assertNotEqual(
+            tools.hash_ip("127.0.0.1"), tools.hash_value("127.0.0.1")
+        )
+        self.assertEqual(len(tools.hash_ip("127.0.0.1")), 64)
+        ip_address_hash = tools.hash_ip("127.0.0.1")
+        with override_settings(IP_HASH_KEY="other"):
+            self.assertNotEqual(tools.hash_ip("127.0.0.1"), ip_address_hash)
+
+    @override_settings(IP_HASH_RATE_PER_DAY=2)
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    def test_rate_limitation_by_ip_hash(self):
+        """Rotating destination addresses does not bypass the IP quota.
+
+        POST /transactions/
+        """
+
+        address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+        statuses = [
+            self.client.post(
+                "/transactions/",
+                data={"destination_address": address[:-1] + character},
+            ).status_code
+            for character in "ABC"
+        ]
+        self.assertEqual(statuses, [201, 201, 403])
+
+
+@override_settings(WITHDRAWAL_LIMIT_BACKEND="cache")
+class CacheWithdrawalLimitTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    def test_rate_limitation_by_withdrawals(self):
+        """The per address quota is enforced by the cache's counters.
+
+        POST /transactions/
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        for _ in range(settings.ADDRESS_RATE_PER_DAY):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            limits.count_withdrawals("address", destination_address, 1),
+            settings.ADDRESS_RATE_PER_DAY,
+        )
+
+        with mock.patch.object(
+            tools, "addr_withdrew_too_often"
+        ) as addr_withdrew_too_often:
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+        self.assertEqual(response.status_code, 403)
+        addr_withdrew_too_often.assert_not_called()
+
+    @override_settings(IP_HASH_RATE_PER_DAY=1)
+    def test_rate_limitation_by_ip_hash(self):
+        """The per IP quota is enforced by the cache's counters.
+        """
+
+        limits.record("5ADDRESS", "iphash")
+        self.assertTrue(limits.withdrew_too_often("5OTHER", "iphash"))
+        self.assertFalse(limits.withdrew_too_often("5OTHER", "otherhash"))
+
+    def test_database_fallback(self):
+        """The database is used if the cache fails.
+        """
+
+        with mock.patch.object(
+            limits.cache, "get_many", side_effect=Exception("down")
+        ), mock.patch.object(
+            tools, "addr_withdrew_too_often", return_value=True
+        ) as addr_withdrew_too_often:
+            self.assertTrue(limits.withdrew_too_often("5ADDRESS", "iphash"))
+        addr_withdrew_too_often.assert_called_once()
+
+    def test_window_slides(self):
+        """Buckets older than the window are not counted.
+        """
+
+        now = 10 ** 9
+        keys = limits.bucket_keys("address", "5ADDRESS", 1, now=now)
+        self.assertEqual(len(keys), 24)
+        later = limits.bucket_keys(
+            "address",
+            "5ADDRESS",
+            1,
+            now=now + settings.WITHDRAWAL_BUCKET_SECONDS,
+        )
+        self.assertEqual(keys[1:], later[:-1])
+
+
+class ClientIPTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_headers_of_trusted_proxies_are_used(self):
+        """X-Real-IP is used, if set by a trusted proxy.
+        """
+
+        request = self.factory.get(
+            "/", REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.7"
+        )
+        self.assertEqual(views.get_client_ip(request), "203.0.113.7")
+
+    def test_headers_of_untrusted_peers_are_ignored(self):
+        """Clients cannot spoof their IP by sending proxy headers.
+        """
+
+        request = self.factory.get(
+            "/", REMOTE_ADDR="198.51.100.1", HTTP_X_REAL_IP="203.0.113.7"
+        )
+        self.assertEqual(views.get_client_ip(request), "198.51.100.1")
+
+    def test_forwarded_for_skips_trusted_proxies(self):
+        """The right most untrusted address of X-Forwarded-For is used.
+        """
+
+        request = self.factory.get(
+            "/",
+            REMOTE_ADDR="10.0.0.2",
+            HTTP_X_FORWARDED_FOR="1.1.1.1, 203.0.113.7, 10.0.0.3",
+        )
+        self.assertEqual(views.get_client_ip(request), "203.0.113.7")
+
+
+@override_settings(
+    RATELIMIT_ENABLE=True,
+    IP_RATELIMIT_BACKEND="token-bucket",
+    TOKEN_BUCKET_CAPACITY=2,
+)
+class TokenBucketTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    def test_burst_is_allowed(self):
+        """A burst of TOKEN_BUCKET_CAPACITY requests is allowed.
+
+        POST /transactions/
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+        for _ in range(settings.TOKEN_BUCKET_CAPACITY):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+            self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(
+            Transaction.objects.count(), settings.TOKEN_BUCKET_CAPACITY
+        )
+
+    def test_ipv6_is_limited_by_subnet(self):
+        """Addresses of the same /64 share one bucket.
+        """
+
+        self.assertFalse(throttle.is_limited("2001:db8::1"))
+        self.assertFalse(throttle.is_limited("2001:db8::2"))
+        self.assertTrue(throttle.is_limited("2001:db8::3"))
+        self.assertFalse(throttle.is_limited("2001:db8:0:1::1"))
+
+    @override_settings(IPV4_PREFIX=24)
+    def test_ipv4_is_limited_by_subnet(self):
+        """IPv4 addresses can be aggregated as well.
+        """
+
+        self.assertFalse(throttle.is_limited("203.0.113.1"))
+        self.assertFalse(throttle.is_limited("203.0.113.2"))
+        self.assertTrue(throttle.is_limited("203.0.113.3"))
+        self.assertFalse(throttle.is_limited("203.0.114.1"))
+
+
+class LedgerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_available_balance(self):
+        """Payouts in flight or sent since the balance was fetched are reserved.
+        """
+
+        now = timezone.now()
+        fetched_at = now - datetime.timedelta(seconds=10)
+        for amount, status, sent_at in (
+            (100, Transaction.PENDING, None),
+            (200, Transaction.SENDING, None),
+            (50, Transaction.SENT, now),
+            (400, Transaction.SENT, now - datetime.timedelta(seconds=20)),
+            (800, Transaction.FAILED, None),
+        ):
+            Transaction.objects.create(
+                amount=amount,
+                destination_address="5ADDRESS",
+                transaction_id="",
+                ip_address_hash="",
+                status=status,
+                sent_at=sent_at,
+            )
+
+        self.assertEqual(
+            ledger.available_balance(
+                {"balance": 1000, "fetched_at": fetched_at.timestamp()}
+            ),
+            650,
+        )
+
+    @override_settings(LEDGER_ENABLE=True, MAXIMUM_PAYOUT=10 ** 6)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    @mock.patch.object(WalletRPC, "get_balance")
+    def test_payouts_are_subtracted_locally(self, get_balance):
+        """The wallet balance is fetched once, payouts are subtracted.
+
+        POST /transactions/
+        """
+
+        get_balance.return_value = mocked_get_balance()
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        amounts = list()
+        for _ in range(2):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+            self.assertEqual(response.status_code, 201)
+            amounts.append(Transaction.objects.latest("id").amount)
+
+        get_balance.assert_called_once()
+        self.assertEqual(
+            amounts[1],
+            (mocked_get_balance() - amounts[0]) // settings.FACTOR_BALANCE,
+        )
+        self.assertEqual(
+            Transaction.objects.filter(status=Transaction.SENT).count(), 2
+        )
+
+    @override_settings(LEDGER_ENABLE=True)
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_reservation_is_released_on_error(self, make_transaction):
+        """A failed transfer does not keep its reservation.
+
+        POST /transactions/
+        """
+
+        make_transaction.side_effect = RpcConnectionError("no wallet")
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    @override_settings(LEDGER_ENABLE=True)
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_reservation_is_kept_if_sent_maybe(self, make_transaction):
+        """A timed out (or interrupted) transfer keeps its reservation.
+
+        POST /transactions/
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+        make_transaction.side_effect = TransferStateUnknownError("timeout")
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 500)
+
+        # unexpected errors
+        make_transaction.side_effect = KeyError
+        with self.assertRaises(KeyError):
+            self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+
+        self.assertEqual(
+            list(Transaction.objects.values_list("status", flat=True)),
+            [Transaction.UNKNOWN] * 2,
+        )
+        self.assertEqual(
+            ledger.reserved_amount(timezone.now()),
+            2 * Transaction.objects.first().amount,
+        )
+
+
+class PayoutLockTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_concurrent_payout_is_rejected(self, make_transaction):
+        """A second payout to an address in flight is rejected.
+
+        POST /transactions/
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with locks.address_lock(destination_address):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+        self.assertEqual(response.status_code, 409)
+        make_transaction.assert_not_called()
+
+        make_transaction.side_effect = mocked_make_transaction
+        response = self.client.post(
+            "/transactions/", data={"destination_address": destination_address}
+        )
+        self.assertEqual(response.status_code, 201)
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_concurrent_payout_to_ip_is_rejected(self, make_transaction):
+        """A second payout to an IP address in flight is rejected, so
+        concurrent requests cannot all pass the per IP quota.
+
+        POST /transactions/
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with override_settings(IP_HASH_RATE_PER_DAY=2):
+            with locks.ip_lock(tools.hash_ip("127.0.0.1")):
+                response = self.client.post(
+                    "/transactions/",
+                    data={"destination_address": destination_address},
+                )
+        self.assertEqual(response.status_code, 409)
+        make_transaction.assert_not_called()
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    def test_ip_lock_without_ip_quota(self):
+        """Without a per IP quota, payouts to the same IP address are not
+        locked.
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with override_settings(IP_HASH_RATE_PER_DAY=0):
+            with locks.ip_lock(tools.hash_ip("127.0.0.1")):
+                response = self.client.post(
+                    "/transactions/",
+                    data={"destination_address": destination_address},
+                )
+        self.assertEqual(response.status_code, 201)
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_lock_is_released_on_error(self, make_transaction):
+        """A failed payout releases the lock.
+        """
+
+        make_transaction.side_effect = RpcConnectionError("no wallet")
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        for _ in range(2):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": destination_address},
+            )
+            self.assertEqual(response.status_code, 500)
+
+    def test_expired_lock_is_kept(self):
+        """A lock, which expired and was taken by someone else, is kept.
+        """
+
+        with locks.cache_lock("test"):
+            # expired and acquired by another worker
+            cache.set("lock:test", "other", 60)
+        self.assertEqual(cache.get("lock:test"), "other")
+
+        cache.delete("lock:test")
+        with locks.cache_lock("test"):
+            pass
+        self.assertIsNone(cache.get("lock:test"))
+
+    @override_settings(NETWORKS={"stagenet": dict()})
+    def test_locks_are_per_network(self):
+        """The same address can be paid on several networks at a time.
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with locks.address_lock(destination_address):
+            with networks.using("stagenet"):
+                with locks.address_lock(destination_address):
+                    with self.assertRaises(PayoutInProgressError):
+                        with locks.address_lock(destination_address):
+                            pass
+
+
+def asgi_request(method, path, data=None, headers=()):
+    """Sends a request to the ASGI application of async_views.
+
+    :param headers: additional (name, value) headers
+    :returns: status code and decoded JSON body
+    """
+
+    body = json.dumps(data).encode("utf-8") if data is not None else b""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")]
+        + [(n.encode("latin-1"), v.encode("latin-1")) for n, v in headers],
+        "client": ("127.0.0.1", 50000),
+    }
+    messages = list()
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        messages.append(message)
+
+    application = async_views.TransactionsApplication(None)
+    async_to_sync(application.__call__)(scope, receive, send)
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+
+class ThreadedWsgiToAsgiTests(TestCase):
+    def test_concurrent_requests(self):
+        """WSGI requests are served concurrently, without blocking the thread
+        sensitive calls of the asyncio handlers.
+        """
+
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wsgi_application(environ, start_response):
+            # both requests have to be in flight at the same time
+            barrier.wait()
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [environ["PATH_INFO"].encode("utf-8")]
+
+        application = async_views.ThreadedWsgiToAsgi(wsgi_application)
+
+        async def request(path):
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": b"",
+                "http_version": "1.1",
+                "headers": [],
+            }
+            messages = list()
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            return messages[0]["status"], messages[1]["body"]
+
+        def thread_sensitive_call():
+            return "done"
+
+        async def requests():
+            return await asyncio.gather(
+                request("/first"),
+                request("/second"),
+                sync_to_async(thread_sensitive_call)(),
+            )
+
+        first, second, call = async_to_sync(requests)()
+        self.assertEqual(first, (200, b"/first"))
+        self.assertEqual(second, (200, b"/second"))
+        self.assertEqual(call, "done")
+
+
+@mock.patch.object(AsyncWalletRPC, "get_balance", mocked_async_get_balance)
+@mock.patch.object(
+    AsyncWalletRPC, "make_transaction", mocked_async_make_transaction
+)
+class AsyncTransactionsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_get_current_balance(self):
+        """GET /transactions/ served by the asyncio handler.
+        """
+
+        status_code, data = asgi_request("GET", "/transactions/")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(
+            data["balance"], int(tools.xmr_to_float(mocked_get_balance()))
+        )
+
+    def test_successful_transaction(self):
+        """POST /transactions/ served by the asyncio handler.
+        """
+
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        status_code, data = asgi_request(
+            "POST",
+            "/transactions/",
+            {"destination_address": destination_address},
+        )
+        self.assertEqual(status_code, 201)
+        self.assertEqual(data["destination_address"], destination_address)
+        self.assertEqual(
+            data["transaction_id"],
+            mocked_make_transaction(destination_address, 0)["transaction_id"],
+        )
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, Transaction.SENT)
+        self.assertEqual(
+            transaction.ip_address_hash, tools.hash_ip("127.0.0.1")
+        )
+
+    def test_invalid_address(self):
+        status_code, data = asgi_request(
+            "POST", "/transactions/", {"destination_address": "5"}
+        )
+        self.assertEqual(status_code, 400)
+        self.assertIn("destination_address", data)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_rate_limitation_by_withdrawals(self):
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        for i in range(settings.ADDRESS_RATE_PER_DAY):
+            status_code, _ = asgi_request(
+                "POST",
+                "/transactions/",
+                {"destination_address": destination_address},
+            )
+            self.assertEqual(status_code, 201)
+
+        status_code, _ = asgi_request(
+            "POST",
+            "/transactions/",
+            {"destination_address": destination_address},
+        )
+        self.assertEqual(status_code, 403)
+        self.assertEqual(
+            Transaction.objects.count(), settings.ADDRESS_RATE_PER_DAY
+        )
+
+    def test_concurrent_payout_is_rejected(self):
+        destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+        with locks.address_lock(destination_address):
+            status_code, _ = asgi_request(
+                "POST",
+                "/transactions/",
+                {"destination_address": destination_address},
+            )
+        self.assertEqual(status_code, 409)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+def json_rpc_handler(connections, answers=None):
+    """Returns an asyncio server callback answering every RPC call.
+
+    :param connections: list the tasks of the connections are added to
+    :param answers: number of calls answered per connection, the connection
+        is closed on receiving the next one (unlimited by default)
+    """
+
+    async def handle(reader, writer):
+        connections.append(asyncio.Task.current_task())
+        answered = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            length = 0
+            while line not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+                line = await reader.readline()
+            request = json.loads((await reader.readexactly(length)))
+            if answers is not None and answered >= answers:
+                break
+            body = json.dumps(
+                {
+                    "id": request["id"],
+                    "jsonrpc": "2.0",
+                    "result": {"unlocked_balance": 1},
+                }
+            ).encode("utf-8")
+            writer.write(
+                "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n".format(
+                    len(body)
+                ).encode("ascii")
+                + body
+            )
+            answered += 1
+        writer.close()
+
+    return handle
+
+
+class AsyncRpcClientTests(TestCase):
+    def calls(self, methods, answers=None):
+        """Calls the methods on a JSON-RPC server.
+
+        :returns: results (or raised exceptions) and number of connections
+        """
+
+        connections = list()
+
+        async def run():
+            server = await asyncio.start_server(
+                json_rpc_handler(connections, answers), "127.0.0.1", 0
+            )
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncRpcClient("127.0.0.1", port)
+            results = list()
+            for method in methods:
+                try:
+                    results.append(await client.call(method))
+                except JSONRPCException as e:
+                    results.append(e)
+            client.close()
+            await asyncio.wait(connections)
+            server.close()
+            return results
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        return results, len(connections)
+
+    def test_connections_are_reused(self):
+        """Keep-alive connections are reused for subsequent calls.
+        """
+
+        results, connections = self.calls(["getbalance"] * 3)
+        self.assertEqual(results, [{"unlocked_balance": 1}] * 3)
+        self.assertEqual(connections, 1)
+
+    @mock.patch.object(async_rpc_client, "IDLE_TIMEOUT", -1)
+    def test_idle_connections_expire(self):
+        """Connections idle for too long are not reused.
+        """
+
+        results, connections = self.calls(["getbalance"] * 3)
+        self.assertEqual(results, [{"unlocked_balance": 1}] * 3)
+        self.assertEqual(connections, 3)
+
+    @override_settings(RPC_RETRIES=0)
+    def test_closed_connections(self):
+        """Idempotent calls are sent again, if a reused connection was closed.
+        """
+
+        results, connections = self.calls(["getbalance"] * 2, answers=1)
+        self.assertEqual(results, [{"unlocked_balance": 1}] * 2)
+        self.assertEqual(connections, 2)
+
+        # transfers may have been received by the server
+        results, connections = self.calls(
+            ["getbalance", "transfer_split"], answers=1
+        )
+        self.assertEqual(results[1].code, -342)
+        self.assertFalse(rpc_client.was_not_sent(results[1]))
+        self.assertEqual(connections, 1)
+
+    def test_refused_connections(self):
+        """Calls are not sent, if no connection could be established.
+        """
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+        async def call():
+            return await AsyncRpcClient("127.0.0.1", port).call(
+                "transfer_split"
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            with self.assertRaises(JSONRPCException) as cm:
+                loop.run_until_complete(call())
+        finally:
+            loop.close()
+        self.assertEqual(cm.exception.code, -341)
+        self.assertTrue(rpc_client.was_not_sent(cm.exception))
+
+
+class LoadTestTests(TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(
+            loadtest.parse_mix("index=1,withdraw=2.5"),
+            {"index": 1.0, "withdraw": 2.5},
+        )
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix("unknown=1")
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix("index=0")
+
+    def test_summary(self):
+        recorder = loadtest.Recorder()
+        for i in range(1, 101):
+            recorder.add("balance", 200, i / 1000.0)
+        recorder.add("withdraw", 201, 0.5)
+        recorder.add("withdraw", "ConnectionError", 1.0)
+
+        summary = recorder.summary(duration=2)
+        balance = summary["endpoints"]["balance"]
+        self.assertEqual(balance["requests"], 100)
+        self.assertEqual(balance["throughput"], 50)
+        self.assertAlmostEqual(balance["latency_ms"]["p50"], 50)
+        self.assertAlmostEqual(balance["latency_ms"]["p99"], 99)
+        self.assertEqual(summary["endpoints"]["withdraw"]["error_rate"], 0.5)
+        self.assertNotIn("index", summary["endpoints"])
+        self.assertEqual(summary["total"]["errors"], 1)
+
+
+class WalletSimulatorTests(APITestCase):
+    """Requests to the wallet are sent to the simulator via HTTP.
+    """
+
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def simulate(self, simulator):
+        host, port = simulator.server_address
+        return override_settings(
+            WALLET_HOST=host,
+            WALLET_PORT=port,
+            DAEMON_HOST=host,
+            DAEMON_PORT=port,
+            RPC_RETRY_BACKOFF=0,
+        )
+
+    def test_successful_transaction(self):
+        wallet = SimulatedWallet(balance=10 * 10 ** 12, outputs=2)
+        with WalletSimulator(wallet=wallet) as simulator, self.simulate(
+            simulator
+        ):
+            response = self.client.post(
+                "/transactions/",
+                data={"destination_address": self.destination_address},
+            )
+            self.assertEqual(response.status_code, 201)
+            transaction_id = response.json()["transaction_id"]
+            transfer = get_wallet_client().call(
+                "get_transfer_by_txid", {"txid": transaction_id}
+            )["transfer"]
+            balance = get_wallet_client().call("getbalance")
+
+        self.assertEqual(
+            Transaction.objects.get().transaction_id, transaction_id
+        )
+        self.assertEqual(transfer["type"], "pending")
+        self.assertEqual(
+            transfer["destinations"][0]["address"], self.destination_address
+        )
+        # the change of the spent output is locked
+        self.assertEqual(balance["unlocked_balance"], 5 * 10 ** 12)
+        self.assertEqual(
+            balance["balance"],
+            10 * 10 ** 12 - transfer["amount"] - transfer["fee"],
+        )
+
+    def test_locked_outputs(self):
+        """Payouts fail while the wallet's outputs are locked.
+        """
+
+        wallet = SimulatedWallet(balance=10 * 10 ** 12, outputs=1)
+        with WalletSimulator(wallet=wallet) as simulator, self.simulate(
+            simulator
+        ):
+            for status_code in (201, 500):
+                response = self.client.post(
+                    "/transactions/",
+                    data={"destination_address": self.destination_address},
+                )
+                self.assertEqual(response.status_code, status_code)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_errors_are_retried(self):
+        with WalletSimulator(error_rate={"getbalance": 1}) as simulator:
+            with self.simulate(simulator):
+                response = self.client.get("/transactions/")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(
+            simulator.calls["getbalance"], 1 + settings.RPC_RETRIES
+        )
+
+    def test_timeouts(self):
+        with WalletSimulator(
+            timeout_rate={"transfer_split": 1}, hang=1
+        ) as simulator, self.simulate(simulator):
+            port = simulator.server_address[1]
+            with override_settings(
+                RPC_TIMEOUTS={"default": (1, 1), "transfer_split": (1, 0.1)}
+            ):
+                with self.assertRaises(TransferStateUnknownError):
+                    WalletRPC.make_transaction(self.destination_address, 1)
+        # transfers are never retried
+        self.assertEqual(simulator.calls["transfer_split"], 1)
+
+        # the wallet is not running, nothing was sent
+        with override_settings(WALLET_PORT=port), self.assertRaises(
+            RpcConnectionError
+        ) as context:
+            WalletRPC.make_transaction(self.destination_address, 1)
+        self.assertNotIsInstance(context.exception, TransferStateUnknownError)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+@mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+class MetricsTests(APITestCase):
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        self.client.get("/transactions/")
+        with override_settings(METRICS_ENABLE=True):
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn("faucet_request_duration_seconds_bucket", content)
+        self.assertIn(
+            'faucet_cached_balance_xmr{{network="default"}} {}'.format(
+                float(tools.xmr_to_float(mocked_get_balance()))
+            ),
+            content,
+        )
+
+    @override_settings(NETWORKS={"stagenet": dict(), "testnet": dict()})
+    def test_balance_per_network(self):
+        """The cached balance of every network is reported.
+        """
+
+        with networks.using("stagenet"):
+            cache.set(
+                networks.cache_key(wallet_rpc.BALANCE_CACHE_KEY),
+                {"balance": 2 * 10 ** 12, "fetched_at": time.time()},
+            )
+        samples = {
+            sample.labels["network"]: sample.value
+            for metric in metrics.BalanceCollector().collect()
+            if metric.name == "faucet_cached_balance_xmr"
+            for sample in metric.samples
+        }
+        # nothing cached for the other networks
+        self.assertEqual(samples, {"stagenet": 2.0})
+
+    def test_payouts_are_counted(self):
+        sent = sample("faucet_payouts_total", status=Transaction.SENT)
+        requests = sample(
+            "faucet_request_duration_seconds_count",
+            view="transactions:transactions",
+            method="POST",
+            status="201",
+        )
+        checks = sample(
+            "faucet_withdrawal_check_duration_seconds_count",
+            backend="database",
+        )
+
+        response = self.client.post(
+            "/transactions/",
+            data={"destination_address": self.destination_address},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sample("faucet_payouts_total", status=Transaction.SENT), sent + 1
+        )
+        self.assertEqual(
+            sample(
+                "faucet_request_duration_seconds_count",
+                view="transactions:transactions",
+                method="POST",
+                status="201",
+            ),
+            requests + 1,
+        )
+        self.assertEqual(
+            sample(
+                "faucet_withdrawal_check_duration_seconds_count",
+                backend="database",
+            ),
+            checks + 1,
+        )
+
+    @override_settings(RATELIMIT_ENABLE=True)
+    def test_rejections_are_counted_by_reason(self):
+        before = dict(
+            (reason, sample("faucet_rejections_total", reason=reason))
+            for reason in ("validation", "ratelimit")
+        )
+
+        response = self.client.post(
+            "/transactions/", data={"destination_address": "5"}
+        )
+        self.assertEqual(response.status_code, 400)
+        # the IP's request has been used already
+        response = self.client.post(
+            "/transactions/",
+            data={"destination_address": self.destination_address},
+        )
+        self.assertEqual(response.status_code, 403)
+
+        self.assertEqual(
+            sample("faucet_rejections_total", reason="validation"),
+            before["validation"] + 1,
+        )
+        self.assertEqual(
+            sample("faucet_rejections_total", reason="ratelimit"),
+            before["ratelimit"] + 1,
+        )
+
+
+class ServerTimingTests(APITestCase):
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def phases(self, response):
+        return [
+            metric.split(";")[0].strip()
+            for metric in response["Server-Timing"].split(",")
+        ]
+
+    @mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+    @mock.patch.object(WalletRPC, "make_transaction", mocked_make_transaction)
+    def test_payout_phases(self):
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=0):
+            response = self.client.get("/transactions/")
+        self.assertNotIn("Server-Timing", response)
+
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=1):
+            with self.assertLogs("transactions.middleware", "INFO") as logs:
+                response = self.client.post(
+                    "/transactions/",
+                    data={"destination_address": self.destination_address},
+                )
+        self.assertEqual(response.status_code, 201)
+        for phase in (
+            "withdrawal_check",
+            "db",
+            "amount",
+            "transfer",
+            "store",
+            "serialize",
+            "total",
+        ):
+            self.assertIn(phase, self.phases(response))
+
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line["view"], "transactions:transactions")
+        self.assertEqual(line["status"], 201)
+        self.assertGreaterEqual(line["phases"]["db"]["count"], 2)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_rpc_phases(self):
+        with WalletSimulator() as simulator:
+            host, port = simulator.server_address
+            with override_settings(WALLET_HOST=host, WALLET_PORT=port):
+                response = self.client.get("/transactions/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("rpc_getbalance", self.phases(response))
+
+
+class TransactionHistoryTests(APITestCase):
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+    other_address = "5" + "B" * 94
+
+    def setUp(self):
+        cache.clear()
+        self.start = timezone.now().replace(microsecond=0)
+        for i in range(5):
+            transaction = Transaction.objects.create(
+                amount=(i + 1) * 10 ** 12,
+                destination_address=self.destination_address,
+                transaction_id=str(i) * 64,
+                ip_address_hash=tools.hash_value("127.0.0.1"),
+            )
+            # two transactions per second, to page through equal timestamps
+            timestamp = self.start + datetime.timedelta(seconds=i // 2)
+            Transaction.objects.filter(pk=transaction.pk).update(
+                timestamp=timestamp
+            )
+        transaction = Transaction.objects.create(
+            amount=10 ** 12,
+            destination_address=self.other_address,
+            transaction_id="f" * 64,
+            ip_address_hash=tools.hash_value("127.0.0.1"),
+        )
+        Transaction.objects.filter(pk=transaction.pk).update(
+            timestamp=self.start + datetime.timedelta(seconds=10)
+        )
+        self.admin = User.objects.create_superuser(
+            "admin", "admin@localhost", "password"
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_admins_only(self):
+        response = self.client.get("/transactions/history/")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/transactions/history.csv")
+        self.assertEqual(response.status_code, 403)
+
+    def test_keyset_pagination(self):
+        self.client.force_authenticate(self.admin)
+        url = "/transactions/history/?limit=2&address={}".format(
+            self.destination_address
+        )
+        ids = list()
+        # the page and its tx hashes
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [result["id"] for result in response.data["results"]]
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+        expected = list(
+            Transaction.objects.filter(
+                destination_address=self.destination_address
+            )
+            .order_by("-timestamp", "-id")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 5)
+
+    def test_filters(self):
+        self.client.force_authenticate(self.admin)
+        since = (self.start + datetime.timedelta(seconds=1)).isoformat()
+        until = (self.start + datetime.timedelta(seconds=2)).isoformat()
+        response = self.client.get(
+            "/transactions/history/", {"since": since, "until": until}
+        )
+        self.assertEqual(
+            [result["transaction_id"] for result in response.data["results"]],
+            ["3" * 64, "2" * 64],
+        )
+        self.assertEqual(response.data["results"][0]["amount"], 4.0)
+
+        response = self.client.get("/transactions/history/", {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/transactions/history/", {"cursor": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(
+            "/transactions/history.csv", {"address": self.destination_address}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(history.FIELDS))
+        self.assertEqual(len(lines), 6)
+        self.assertIn("1.000000000000", lines[1])
+
+        response = self.client.get("/transactions/history.ndjson")
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]["destination_address"], self.other_address)
+
+        response = self.client.get("/transactions/history.xml")
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command(
+            "export_transactions",
+            "--format=ndjson",
+            "--address={}".format(self.other_address),
+            stdout=out,
+        )
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row["transaction_id"] for row in rows], ["f" * 64])
+
+        with self.assertRaises(CommandError):
+            call_command("export_transactions", "--since=yesterday")
+
+
+class ArchiveTests(TestCase):
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        now = timezone.now()
+        self.timestamps = [
+            now - datetime.timedelta(days=days) for days in (100, 70, 40, 1)
+        ]
+        for i, timestamp in enumerate(self.timestamps):
+            transaction = Transaction.objects.create(
+                amount=10 ** 12,
+                destination_address=self.destination_address,
+                transaction_id=str(i) * 64,
+                ip_address_hash=tools.hash_value("127.0.0.1"),
+                sent_at=timestamp,
+                claimed_at=timestamp,
+                wallet_backend="127.0.0.1:18083",
+            )
+            Transaction.objects.filter(pk=transaction.pk).update(
+                timestamp=timestamp
+            )
+        # queued payouts are kept
+        transaction = Transaction.objects.create(
+            amount=10 ** 12,
+            destination_address=self.destination_address,
+            transaction_id="",
+            ip_address_hash=tools.hash_value("127.0.0.1"),
+            status=Transaction.PENDING,
+        )
+        Transaction.objects.filter(pk=transaction.pk).update(
+            timestamp=self.timestamps[0]
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive_and_restore(self):
+        before = [
+            {field: getattr(t, field) for field in archive.FIELDS}
+            for t in Transaction.objects.order_by("id")[:3]
+        ]
+
+        out = io.StringIO()
+        call_command(
+            "archive_transactions",
+            "--days=30",
+            "--batch-size=2",
+            "--directory={}".format(self.directory),
+            stdout=out,
+        )
+        self.assertIn("Archived 3 transactions", out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(
+            len(os.listdir(self.directory)),
+            len({"{:%Y-%m}".format(t) for t in self.timestamps[:3]}),
+        )
+        self.assertEqual(list(archive.read(self.directory)), before)
+
+        # a batch archived twice (the process died before deleting it)
+        archive.append(self.directory, before[:1])
+        self.assertEqual(len(list(archive.read(self.directory))), 3)
+
+        since = self.timestamps[1] - datetime.timedelta(seconds=1)
+        out = io.StringIO()
+        call_command(
+            "restore_archived_transactions",
+            "--directory={}".format(self.directory),
+            "--since={}".format(since.isoformat()),
+            "--print",
+            stdout=out,
+        )
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            [row["transaction_id"] for row in rows], ["1" * 64, "2" * 64]
+        )
+
+        call_command(
+            "restore_archived_transactions",
+            "--directory={}".format(self.directory),
+            stdout=io.StringIO(),
+        )
+        restored = Transaction.objects.filter(id__in=[r["id"] for r in before])
+        self.assertEqual(
+            [
+                {field: getattr(t, field) for field in archive.FIELDS}
+                for t in restored.order_by("id")
+            ],
+            before,
+        )
+        self.assertEqual(archive.restore(archive.read(self.directory)), 0)
+        self.assertTrue(restored.filter(token=before[0]["token"]).exists())
+
+    def test_retention(self):
+        with self.assertRaises(CommandError):
+            call_command("archive_transactions", "--days=0")
+        out = io.StringIO()
+        call_command("archive_transactions", "--dry-run", stdout=out)
+        self.assertIn("1 transactions to archive", out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 5)
+
+
+class PayoutStatsTests(APITestCase):
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+    other_address = "5" + "B" * 94
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def create(self, address, ip_address, days_ago=0, **kwargs):
+        transaction = Transaction.objects.create(
+            amount=10 ** 12,
+            destination_address=address,
+            transaction_id="a" * 64,
+            ip_address_hash=tools.hash_value(ip_address),
+            **kwargs
+        )
+        Transaction.objects.filter(pk=transaction.pk).update(
+            timestamp=timezone.now() - datetime.timedelta(days=days_ago)
+        )
+        return transaction
+
+    def test_incremental_update(self):
+        self.create(self.destination_address, "1.1.1.1", days_ago=1)
+        self.create(self.destination_address, "1.1.1.1")
+        self.create(self.other_address, "1.1.1.1")
+        queued = self.create(
+            self.other_address, "2.2.2.2", status=Transaction.PENDING
+        )
+        self.create(self.other_address, "2.2.2.2", status=Transaction.FAILED)
+
+        self.assertEqual(stats.update(), 2)
+        today = DailyPayoutStats.objects.get(day=timezone.now().date())
+        self.assertEqual(today.payouts, 2)
+        self.assertEqual(today.failed, 1)
+        self.assertEqual(today.amount, 2 * 10 ** 12)
+        self.assertEqual(today.unique_addresses, 2)
+        self.assertEqual(today.unique_ip_hashes, 1)
+        # counted once it is sent
+        self.assertEqual(stats.cursor(), queued.pk - 1)
+
+        queued.status = Transaction.SENT
+        queued.save()
+        self.assertEqual(stats.update(), 1)
+        today.refresh_from_db()
+        self.assertEqual(today.payouts, 3)
+        self.assertEqual(today.unique_ip_hashes, 2)
+        self.assertEqual(stats.update(), 0)
+
+        DailyPayoutStats.objects.all().delete()
+        call_command("backfill_stats", stdout=io.StringIO())
+        self.assertEqual(DailyPayoutStats.objects.count(), 2)
+        today = DailyPayoutStats.objects.get(day=timezone.now().date())
+        self.assertEqual(today.payouts, 3)
+
+    def test_stats_endpoint(self):
+        self.create(self.destination_address, "1.1.1.1", days_ago=1)
+        # only read, the rollup is updated by the workers
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["days"], [])
+        self.assertFalse(DailyPayoutStats.objects.exists())
+
+        cache.clear()
+        call_command("reconcile_payouts", "--once", stdout=io.StringIO())
+        response = self.client.get("/stats")
+        self.assertEqual(len(response.data["days"]), 1)
+        self.assertEqual(response.data["days"][0]["amount"], Decimal("1"))
+
+        # cached, the transactions are not queried
+        self.create(self.destination_address, "1.1.1.1")
+        with self.assertNumQueries(0):
+            response = self.client.get("/stats")
+        self.assertEqual(len(response.data["days"]), 1)
+
+        stats.update()
+        response = self.client.get("/stats", {"days": 1})
+        self.assertEqual(len(response.data["days"]), 1)
+        self.assertEqual(
+            response.data["days"][0]["day"], str(timezone.now().date())
+        )
+
+    @override_settings(NETWORKS={"stagenet": dict()})
+    def test_stats_per_network(self):
+        """The statistics are kept and served per network.
+        """
+
+        self.create(self.destination_address, "1.1.1.1")
+        self.create(self.destination_address, "1.1.1.1", network="stagenet")
+        self.create(self.other_address, "2.2.2.2", network="stagenet")
+
+        self.assertEqual(stats.update(), 2)
+        self.assertEqual(
+            DailyPayoutStats.objects.get(network="stagenet").payouts, 2
+        )
+
+        response = self.client.get("/stats")
+        self.assertEqual(response.data["days"][0]["payouts"], 1)
+        response = self.client.get("/stagenet/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["days"][0]["payouts"], 2)
+
+
+class NetworkTests(APITestCase):
+    """Several networks are served by one faucet at /<network>/.
+    """
+
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def networks(self, stagenet, testnet):
+        config = dict()
+        for name, simulator in (("stagenet", stagenet), ("testnet", testnet)):
+            host, port = simulator.server_address
+            config[name] = {
+                "WALLET_HOST": host,
+                "WALLET_PORT": port,
+                "WALLET_BACKENDS": [],
+                "DAEMON_HOST": host,
+                "DAEMON_PORT": port,
+            }
+        return override_settings(NETWORKS=config, RATELIMIT_ENABLE=True)
+
+    def test_payouts_per_network(self):
+        stagenet = WalletSimulator(
+            wallet=SimulatedWallet(balance=10 * 10 ** 12, nettype="stagenet")
+        )
+        testnet = WalletSimulator(
+            wallet=SimulatedWallet(balance=20 * 10 ** 12, nettype="testnet")
+        )
+        with stagenet, testnet, self.networks(stagenet, testnet):
+            response = self.client.get("/stagenet/transactions/")
+            self.assertEqual(response.json()["balance"], 10)
+            response = self.client.get("/testnet/transactions/")
+            self.assertEqual(response.json()["balance"], 20)
+
+            for network in ("stagenet", "testnet"):
+                response = self.client.post(
+                    "/{}/transactions/".format(network),
+                    data={"destination_address": self.destination_address},
+                )
+                self.assertEqual(response.status_code, 201)
+            # the rate limits are separate per network
+            response = self.client.post(
+                "/testnet/transactions/",
+                data={"destination_address": self.destination_address},
+            )
+            self.assertEqual(response.status_code, 403)
+
+            response = self.client.get("/testnet/")
+            self.assertIn(b"Monero testnet faucet", response.content)
+            self.assertIn(b'url: "/testnet/transactions/"', response.content)
+            response = self.client.get("/mainnet/transactions/")
+            self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(stagenet.calls["transfer_split"], 1)
+        self.assertEqual(testnet.calls["transfer_split"], 1)
+        self.assertEqual(
+            sorted(Transaction.objects.values_list("network", flat=True)),
+            ["stagenet", "testnet"],
+        )
+        self.assertEqual(networks.active(), networks.DEFAULT)
+
+    def test_payout_queue(self):
+        stagenet = WalletSimulator()
+        testnet = WalletSimulator()
+        with stagenet, testnet, self.networks(stagenet, testnet):
+            for network in ("stagenet", "testnet", "stagenet"):
+                Transaction.objects.create(
+                    amount=10 ** 12,
+                    destination_address=self.destination_address,
+                    transaction_id="",
+                    ip_address_hash="",
+                    status=Transaction.PENDING,
+                    network=network,
+                )
+            with override_settings(PAYOUT_BATCH_ENABLE=True):
+                self.assertEqual(payout_queue.process_pending(), 3)
+
+        self.assertEqual(stagenet.calls["transfer_split"], 1)
+        self.assertEqual(testnet.calls["transfer_split"], 1)
+        self.assertFalse(
+            Transaction.objects.exclude(status=Transaction.SENT).exists()
+        )
+
+
+class WalletBackendTests(APITestCase):
+    """Payouts are spread over several wallets.
+    """
+
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def backends(self, *simulators):
+        names = [
+            "{0}:{1}".format(*simulator.server_address)
+            for simulator in simulators
+        ]
+        # nothing listens on this one
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            down = "127.0.0.1:{}".format(s.getsockname()[1])
+        return (
+            [down] + names,
+            override_settings(
+                WALLET_BACKENDS=[down] + names,
+                RPC_RETRY_BACKOFF=0,
+                BALANCE_CACHE_TTL=0,
+            ),
+        )
+
+    def test_balance_aware_routing(self):
+        rich = WalletSimulator(
+            wallet=SimulatedWallet(balance=10 * 10 ** 12, outputs=1)
+        )
+        poor = WalletSimulator(
+            wallet=SimulatedWallet(balance=5 * 10 ** 12, outputs=1)
+        )
+        with rich, poor:
+            names, config = self.backends(rich, poor)
+            with config:
+                # the total of the reachable wallets
+                response = self.client.get("/transactions/")
+                self.assertEqual(response.json()["balance"], 15)
+                self.assertTrue(backends.is_down(names[0]))
+
+                for _ in range(2):
+                    response = self.client.post(
+                        "/transactions/",
+                        data={"destination_address": self.destination_address},
+                    )
+                    self.assertEqual(response.status_code, 201)
+
+        # the wallet with the most balance first, then the other one, as the
+        # first one's outputs are locked
+        self.assertEqual(
+            list(
+                Transaction.objects.order_by("id").values_list(
+                    "wallet_backend", flat=True
+                )
+            ),
+            names[1:],
+        )
+        # the amount is calculated from the balance of the paying wallet
+        self.assertEqual(
+            list(
+                Transaction.objects.order_by("id").values_list(
+                    "amount", flat=True
+                )
+            ),
+            [10 ** 12, 5 * 10 ** 11],
+        )
+        self.assertEqual(rich.calls["transfer_split"], 1)
+        self.assertEqual(poor.calls["transfer_split"], 1)
+
+    def test_all_backends_down(self):
+        """The balance fails with an RPC error, if no backend answers.
+        """
+
+        names, config = self.backends()
+        with config, override_settings(WALLET_BACKENDS=names * 2):
+            with self.assertRaises(RpcConnectionError):
+                WalletRPC.get_balance()
+            self.assertTrue(backends.is_down(names[0]))
+            with mock.patch.object(
+                backends, "healthy_backends", return_value=[]
+            ):
+                with self.assertRaises(RpcConnectionError):
+                    WalletRPC.get_balance()
+
+    def test_busy_backends_are_skipped(self):
+        first = WalletSimulator()
+        second = WalletSimulator()
+        with first, second:
+            names, config = self.backends(first, second)
+            with config:
+                WalletRPC.get_balance()
+                with backends.acquire(10 ** 12) as backend:
+                    self.assertEqual(backend, names[1])
+                    with backends.acquire(10 ** 12) as other:
+                        self.assertEqual(other, names[2])
+                        with self.assertRaises(WalletBusyError):
+                            with backends.acquire(10 ** 12):
+                                pass
+                        response = self.client.post(
+                            "/transactions/",
+                            data={
+                                "destination_address": self.destination_address
+                            },
+                        )
+                        self.assertEqual(response.status_code, 503)
+                # released
+                with backends.acquire(10 ** 12) as backend:
+                    self.assertEqual(backend, names[1])
+        self.assertEqual(first.calls["transfer_split"], 0)
+        self.assertEqual(second.calls["transfer_split"], 0)
+
+
+class OutputSplitTests(TestCase):
+    """Large outputs are split into payout sized ones.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_plan(self):
+        size = 10 ** 12
+        locked = {"amount": 2 * size, "unlocked": False}
+        large = {"amount": 5 * size, "unlocked": True}
+        small = {"amount": size // 2, "unlocked": True}
+        # locked outputs count, but do not pay for new ones
+        self.assertEqual(outputs.plan([locked, small], size, 10), 0)
+        self.assertEqual(outputs.plan([locked, large], size, 10), 4)
+        self.assertEqual(outputs.plan([locked, large], size, 4), 2)
+        self.assertEqual(outputs.plan([locked, large], size, 2), 0)
+        self.assertEqual(outputs.plan([large], 0, 2), 0)
+
+    def test_split_outputs(self):
+        wallet = SimulatedWallet(balance=10 * 10 ** 12, outputs=1)
+        with WalletSimulator(wallet=wallet) as simulator:
+            backend = "{0}:{1}".format(*simulator.server_address)
+            with override_settings(WALLET_BACKENDS=[backend]):
+                out = io.StringIO()
+                call_command(
+                    "split_outputs", "--target", "5", "--dry-run", stdout=out
+                )
+                self.assertIn(
+                    "4 outputs of 1.100000000000 XMR planned", out.getvalue()
+                )
+                self.assertEqual(simulator.calls["transfer_split"], 0)
+
+                # a wallet busy with a payout is skipped
+                with backends.acquire(10 ** 12):
+                    reports = outputs.split_outputs(5)
+                self.assertEqual(reports[backend]["error"], "busy")
+                self.assertEqual(simulator.calls["transfer_split"], 0)
+
+                call_command(
+                    "split_outputs",
+                    "--target",
+                    "5",
+                    "--once",
+                    stdout=io.StringIO(),
+                )
+                amounts = [o["amount"] for o in outputs.get_outputs(backend)]
+                self.assertEqual(amounts.count(11 * 10 ** 11), 4)
+                self.assertEqual(sum(amounts), 10 * 10 ** 12 - wallet.fee)
+                self.assertFalse(
+                    cache.get(backends.state_key(backend, "busy"))
+                )
+
+                # the new (locked) outputs count
+                reports = outputs.split_outputs(5)
+                self.assertEqual(reports[backend]["planned"], 0)
+        self.assertEqual(simulator.calls["transfer_split"], 1)
+
+    def test_busy_flag(self):
+        """The busy flag lasts for all transfers and is only removed if it
+        is still owned.
+        """
+
+        transfer = sum(settings.RPC_TIMEOUTS["transfer_split"])
+        self.assertLess(outputs.busy_timeout(15), 2 * transfer)
+        self.assertGreater(outputs.busy_timeout(16), 2 * transfer)
+
+        wallet = SimulatedWallet(balance=10 * 10 ** 12, outputs=1)
+        with WalletSimulator(wallet=wallet) as simulator:
+            backend = "{0}:{1}".format(*simulator.server_address)
+            busy = backends.state_key(backend, "busy")
+
+            def split(backend, count, size):
+                # expired and taken by a payout
+                cache.set(busy, "payout", 60)
+                return 0
+
+            with override_settings(WALLET_BACKENDS=[backend]):
+                with mock.patch.object(outputs, "split", split):
+                    outputs.split_outputs(5)
+                self.assertEqual(cache.get(busy), "payout")
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(CommandError):
+            call_command("split_outputs", "--target", "0", "--once")
+        with self.assertRaises(CommandError):
+            call_command("split_outputs", "--network", "nope", "--once")
+
+
+@mock.patch.object(WalletRPC, "get_balance", mocked_get_balance)
+class IdempotencyTests(APITestCase):
+    """Requests with an Idempotency-Key are only processed once.
+    """
+
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def post(self, key, destination_address=None):
+        return self.client.post(
+            "/transactions/",
+            data={
+                "destination_address": destination_address
+                or self.destination_address
+            },
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    @override_settings(RATELIMIT_ENABLE=True)
+    @mock.patch.object(limits, "withdrew_too_often", return_value=False)
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_retry_is_replayed(self, make_transaction, withdrew_too_often):
+        make_transaction.side_effect = mocked_make_transaction
+
+        response = self.post("first")
+        self.assertEqual(response.status_code, 201)
+        # not rate limited, no limit query and no payout
+        retry = self.post("first")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(make_transaction.call_count, 1)
+        self.assertEqual(withdrew_too_often.call_count, 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # another key is a new request
+        response = self.post("second")
+        self.assertEqual(response.status_code, 403)
+
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_in_progress_and_reused_keys(self, make_transaction):
+        fingerprint = idempotency.fingerprint(
+            {"destination_address": self.destination_address}
+        )
+        self.assertIsNone(idempotency.begin("key", fingerprint))
+
+        self.assertEqual(self.post("key").status_code, 409)
+        other_address = self.destination_address[:-1] + "A"
+        self.assertEqual(self.post("key", other_address).status_code, 422)
+        self.assertEqual(self.post("k" * 256).status_code, 400)
+        make_transaction.assert_not_called()
+
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_failed_request_is_not_stored(self, make_transaction):
+        make_transaction.side_effect = RpcConnectionError("no wallet")
+        self.assertEqual(self.post("key").status_code, 500)
+
+        make_transaction.side_effect = mocked_make_transaction
+        self.assertEqual(self.post("key").status_code, 201)
+        self.assertEqual(self.post("key").status_code, 201)
+        self.assertEqual(make_transaction.call_count, 2)
+
+    @mock.patch.object(WalletRPC, "make_transaction")
+    def test_retry_after_unknown_state(self, make_transaction):
+        """The key of a payout, which may have been sent, is kept until it
+        is resolved.
+        """
+
+        make_transaction.side_effect = TransferStateUnknownError("timeout")
+        self.assertEqual(self.post("sent").status_code, 500)
+        self.assertEqual(self.post("failed").status_code, 500)
+        first, second = Transaction.objects.order_by("id")
+        self.assertEqual(first.status, Transaction.UNKNOWN)
+
+        make_transaction.side_effect = mocked_make_transaction
+        self.assertEqual(self.post("sent").status_code, 409)
+        self.assertEqual(make_transaction.call_count, 2)
+
+        # resolved by payout_queue.reconcile()
+        Transaction.objects.filter(pk=first.pk).update(status=Transaction.SENT)
+        Transaction.objects.filter(pk=second.pk).update(
+            status=Transaction.FAILED
+        )
+        response = self.post("sent")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["status"], Transaction.SENT)
+        self.assertEqual(self.post("sent").json(), response.json())
+        self.assertEqual(make_transaction.call_count, 2)
+        # not sent, so the retry is processed
+        self.assertEqual(self.post("failed").status_code, 201)
+        self.assertEqual(make_transaction.call_count, 3)
+
+    @mock.patch.object(AsyncWalletRPC, "get_balance", mocked_async_get_balance)
+    @mock.patch.object(AsyncWalletRPC, "make_transaction")
+    def test_asyncio_retry_after_unknown_state(self, make_transaction):
+        make_transaction.side_effect = TransferStateUnknownError("timeout")
+        data = {"destination_address": self.destination_address}
+        headers = [("Idempotency-Key", "key")]
+
+        self.assertEqual(
+            asgi_request("POST", "/transactions/", data, headers)[0], 500
+        )
+        make_transaction.side_effect = mocked_async_make_transaction
+        self.assertEqual(
+            asgi_request("POST", "/transactions/", data, headers)[0], 409
+        )
+        self.assertEqual(make_transaction.call_count, 1)
+
+    @mock.patch.object(AsyncWalletRPC, "get_balance", mocked_async_get_balance)
+    @mock.patch.object(AsyncWalletRPC, "make_transaction")
+    def test_asyncio_handler(self, make_transaction):
+        make_transaction.side_effect = mocked_async_make_transaction
+        data = {"destination_address": self.destination_address}
+        headers = [("Idempotency-Key", "key")]
+
+        first = asgi_request("POST", "/transactions/", data, headers)
+        retry = asgi_request("POST", "/transactions/", data, headers)
+        self.assertEqual(first[0], 201)
+        self.assertEqual(retry, first)
+        self.assertEqual(make_transaction.call_count, 1)
+
+
+@override_settings(HEALTH_CHECK_INTERVAL=3600, RPC_RETRY_BACKOFF=0)
+class HealthTests(TestCase):
+    """Workers are prewarmed and report their dependencies.
+    """
+
+    def setUp(self):
+        cache.clear()
+        WalletRPC.network_types.clear()
+        WalletRPC.addresses.clear()
+        health._state.update(warm=False, checks=dict(), checked_at=None)
+
+    def tearDown(self):
+        self.setUp()
+
+    def simulate(self, simulator, daemon=None):
+        host, port = simulator.server_address
+        return override_settings(
+            WALLET_HOST=host,
+            WALLET_PORT=port,
+            DAEMON_HOST=host,
+            DAEMON_PORT=port if daemon is None else daemon,
+        )
+
+    def test_prewarm(self):
+        with WalletSimulator() as simulator, self.simulate(simulator):
+            # not ready before it is prewarmed
+            response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(response.json()["warm"])
+
+            health.prewarm()
+            calls = dict(simulator.calls)
+            self.assertEqual(WalletRPC.get_network_type(), "stagenet")
+            self.assertEqual(
+                WalletRPC.get_cached_address(), simulator.wallet.address
+            )
+            self.assertEqual(wallet_rpc.get_cached_balance(), 100 * 10 ** 12)
+
+            response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 200)
+            state = response.json()
+            self.assertTrue(state["ready"])
+            self.assertEqual(
+                set(state["checks"]), {"database", "cache", "wallet", "daemon"}
+            )
+            self.assertEqual(self.client.get("/healthz").status_code, 200)
+            # answered from the prewarmed and cached state
+            self.assertEqual(dict(simulator.calls), calls)
+
+    def test_unreachable_daemon(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            down = s.getsockname()[1]
+        with WalletSimulator() as simulator, self.simulate(simulator, down):
+            health.prewarm()
+
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        state = response.json()
+        self.assertTrue(state["warm"])
+        self.assertFalse(state["checks"]["daemon"]["ok"])
+        self.assertTrue(state["checks"]["wallet"]["ok"])
+        # the worker is alive anyway
+        self.assertEqual(self.client.get("/healthz").status_code, 200)
+
+    def test_wallet_check_is_cheap(self):
+        """The wallet is checked without fetching its balance.
+        """
+
+        with WalletSimulator() as simulator, self.simulate(simulator):
+            health.check()
+        self.assertEqual(simulator.calls["get_version"], 1)
+        self.assertEqual(simulator.calls["getbalance"], 0)
+
+    def test_readiness_per_network(self):
+        """An unreachable wallet only takes its own network out of rotation.
+        """
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            down = s.getsockname()[1]
+        config = {
+            "stagenet": {
+                "WALLET_HOST": "127.0.0.1",
+                "WALLET_PORT": down,
+                "WALLET_BACKENDS": [],
+                "DAEMON_HOST": "127.0.0.1",
+                "DAEMON_PORT": down,
+            }
+        }
+        with WalletSimulator() as simulator, self.simulate(simulator):
+            with override_settings(NETWORKS=config, RPC_RETRY_BACKOFF=0):
+                health.prewarm()
+                response = self.client.get("/readyz")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response.json()["networks"],
+                    {"default": True, "stagenet": False},
+                )
+                response = self.client.get("/stagenet/readyz")
+                self.assertEqual(response.status_code, 503)
+                self.assertFalse(response.json()["ready"])
+
+    def test_readiness_of_wallet_backends(self):
+        """Every wallet backend is checked, the network is ready while one
+        of them can send.
+        """
+
+        down = list()
+        for _ in range(2):
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                down.append("127.0.0.1:{}".format(s.getsockname()[1]))
+        with WalletSimulator() as simulator, self.simulate(simulator):
+            up = "{0}:{1}".format(*simulator.server_address)
+            with override_settings(
+                WALLET_BACKENDS=[up, down[0]], RPC_RETRY_BACKOFF=0
+            ):
+                health.prewarm()
+                response = self.client.get("/readyz")
+                self.assertEqual(response.status_code, 200)
+                checks = response.json()["checks"]
+                self.assertTrue(checks["wallet:" + up]["ok"])
+                self.assertFalse(checks["wallet:" + down[0]]["ok"])
+                self.assertNotIn("wallet", checks)
+
+            with override_settings(WALLET_BACKENDS=down, RPC_RETRY_BACKOFF=0):
+                health.check()
+                response = self.client.get("/readyz")
+                self.assertEqual(response.status_code, 503)
+
+    def test_prewarm_once_per_process(self):
+        with mock.patch.object(health, "prewarm") as prewarm:
+            with mock.patch.object(health, "_prewarm_pid", None):
+                health.start_prewarm().join()
+                self.assertIsNone(health.start_prewarm())
+        prewarm.assert_called_once_with()
+
+
+class CompactStorageTests(APITestCase):
+    """Hashes are stored in binary form, tx hashes one per row.
+    """
+
+    destination_address = "55YjCnmQ6NgM52yccJk23cR55h6wmuzw1fEHfeNVbdtPJ2v8GoByB9XDDi89dqhC4pTYRdssorqGWiXWeVywKVjtA8m5MZT"
+    transaction_id = "a" * 64 + "," + "b" * 64
+
+    def setUp(self):
+        self.transaction = Transaction.objects.create(
+            amount=10 ** 12,
+            destination_address=self.destination_address,
+            transaction_id=self.transaction_id,
+            ip_address_hash=tools.hash_value("127.0.0.1"),
+        )
+        self.admin = User.objects.create_superuser(
+            "admin", "admin@localhost", "password"
+        )
+
+    def test_binary_columns(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT ip_address_hash FROM transactions_transaction"
+            )
+            self.assertEqual(len(bytes(cursor.fetchone()[0])), 32)
+        self.assertEqual(
+            list(
+                TransactionHash.objects.filter(
+                    transaction=self.transaction
+                ).values_list("tx_hash", flat=True)
+            ),
+            ["a" * 64, "b" * 64],
+        )
+
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.transaction_id, self.transaction_id)
+        self.assertEqual(
+            transaction.ip_address_hash, tools.hash_value("127.0.0.1")
+        )
+        self.assertEqual(
+            Transaction.objects.filter(
+                ip_address_hash=tools.hash_value("127.0.0.1")
+            ).count(),
+            1,
+        )
+
+        # replaced on update
+        transaction.transaction_id = "c" * 64
+        transaction.save(update_fields=["transaction_id"])
+        self.assertEqual(Transaction.objects.get().transaction_id, "c" * 64)
+        self.assertEqual(TransactionHash.objects.count(), 1)
+
+    def test_api_output(self):
+        # the payout and its tx hashes
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/transactions/{}/".format(self.transaction.token)
+            )
+        self.assertEqual(
+            response.json()["transaction_id"], self.transaction_id
+        )
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(
+            "/transactions/history/?tx_hash={}".format("b" * 64)
+        )
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["transaction_id"], self.transaction_id)
+        response = self.client.get(
+            "/transactions/history/?tx_hash={}".format("c" * 64)
+        )
+        self.assertEqual(response.json()["results"], [])
+        response = self.client.get("/transactions/history/?tx_hash=x")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/transactions/history.csv")
+        self.assertIn(
+            '"{}"'.format(self.transaction_id),
+            b"".join(response.streaming_content).decode(),
+        )
+
+
+class CompactStorageMigrationTests(TransactionTestCase):
+    """Existing transactions are migrated to the compact columns.
+    """
+
+    before = [("transactions", "0008_transaction_wallet_backend")]
+    after = [("transactions", "0011_compact_transaction")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # back to the latest migrations
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_migration(self):
+        apps = self.migrate(self.before)
+        OldTransaction = apps.get_model("transactions", "Transaction")
+        ip_address_hash = tools.hash_value("127.0.0.1")
+        OldTransaction.objects.create(
+            amount=1,
+            destination_address="a",
+            transaction_id="a" * 64 + "," + "b" * 64,
+            ip_address_hash=ip_address_hash,
+        )
+        OldTransaction.objects.create(
+            amount=1,
+            destination_address="b",
+            transaction_id="",
+            ip_address_hash="",
+        )
+
+        apps = self.migrate(self.after)
+        NewTransaction = apps.get_model("transactions", "Transaction")
+        TransactionHash = apps.get_model("transactions", "TransactionHash")
+        self.assertEqual(
+            list(
+                NewTransaction.objects.order_by("id").values_list(
+                    "ip_address_hash", flat=True
+                )
+            ),
+            [ip_address_hash, ""],
+        )
+        self.assertEqual(
+            list(
+                TransactionHash.objects.order_by("position").values_list(
+                    "transaction__destination_address", "tx_hash"
+                )
+            ),
+            [("a", "a" * 64), ("a", "b" * 64)],
+        )
+
+        # and back
+        apps = self.migrate(self.before)
+        OldTransaction = apps.get_model("transactions", "Transaction")
+        self.assertEqual(
+            list(
+                OldTransaction.objects.order_by("id").values_list(
+                    "transaction_id", "ip_address_hash"
+                )
+            ),
+            [("a" * 64 + "," + "b" * 64, ip_address_hash), ("", "")],
+        )
@@ -1,19 +1,51 @@
-from django.urls import path
+from django.urls import path, include, register_converter
 from django.views.generic.base import RedirectView
 from django.conf import settings
 
 from . import views
+from .utils.networks import NetworkConverter
 
+register_converter(NetworkConverter, "network")
 app_name = "transactions"
-urlpatterns = [
+
+# served per network, too (at /<network>/)
+network_urlpatterns = [
     path(
         "transactions/",
         views.TransactionsApiView.as_view(),
         name="transactions",
     ),
+    path(
+        "transactions/<uuid:token>/",
+        views.TransactionStatusApiView.as_view(),
+        name="transaction-status",
+    ),
+    path(
+        "transactions/history/",
+        views.TransactionHistoryApiView.as_view(),
+        name="transaction-history",
+    ),
+    path(
+        "transactions/history.<str:export_format>",
+        views.TransactionExportView.as_view(),
+        name="transaction-export",
+    ),
+    path("stats", views.PayoutStatsApiView.as_view(), name="stats"),
+    path("readyz", views.readyz, name="readyz"),
     path("", views.index, name="index"),
+]
+
+urlpatterns = network_urlpatterns + [
+    path("metrics", views.metrics_view, name="metrics"),
+    path("healthz", views.healthz, name="healthz"),
     path(
         "favicon.ico",
         RedirectView.as_view(url=settings.STATIC_URL + "favicon.ico"),
     ),
 ]
+urlpatterns.append(
+    path(
+        "<network:network>/",
+        include((network_urlpatterns, "network"), "network"),
+    )
+)
@@ -0,0 +1,227 @@
+"""Archive of old transactions.
+
+Transactions are appended to gzipped NDJSON files, one per month
+(transactions-YYYY-MM.ndjson.gz). Every batch is appended as a gzip member
+of its own, so files are never rewritten and a batch is on disk before its
+rows are deleted from the database.
+"""
+
+import datetime
+import glob
+import gzip
+import json
+import os
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from ..models import Transaction, TransactionHash
+from . import history
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# columns of the archive, every field of a transaction, so it is restored
+# as it was (transaction_id joins the tx hashes, see
+# history.with_transaction_ids())
+FIELDS = tuple(
+    field.attname for field in Transaction._meta.concrete_fields
+) + ("transaction_id",)
+# columns stored in ISO 8601
+TIME_FIELDS = ("timestamp", "sent_at", "claimed_at")
+# queued payouts are never archived
+ARCHIVED_STATUSES = (Transaction.SENT, Transaction.FAILED)
+FILE_PATTERN = "transactions-*.ndjson.gz"
+
+
+def cutoff(days=None):
+    """Returns the time before which transactions are archived.
+
+    :param days: retention period, defaults to TRANSACTION_RETENTION_DAYS
+    """
+
+    if days is None:
+        days = settings.TRANSACTION_RETENTION_DAYS
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archive_path(directory, timestamp):
+    """Returns the file a transaction of the given time is archived in.
+    """
+
+    return os.path.join(
+        directory,
+        "transactions-{:%Y-%m}.ndjson.gz".format(
+            timestamp.astimezone(timezone.utc)
+        ),
+    )
+
+
+def to_line(row):
+    """Returns a transaction (dict of FIELDS) as JSON line.
+    """
+
+    row = dict(row)
+    for field in TIME_FIELDS:
+        if row[field] is not None:
+            row[field] = row[field].isoformat()
+    if row["token"] is not None:
+        row["token"] = str(row["token"])
+    return json.dumps(row, sort_keys=True) + "\n"
+
+
+def from_line(line):
+    """Returns a transaction (dict of FIELDS) of a JSON line.
+
+    Fields missing in lines of older archives are left out, so they get
+    their defaults when restored.
+    """
+
+    row = json.loads(line)
+    for field in TIME_FIELDS:
+        if row.get(field) is not None:
+            row[field] = history.parse_time(row[field])
+    if row.get("token") is not None:
+        row["token"] = uuid.UUID(row["token"])
+    return row
+
+
+def append(directory, rows):
+    """Appends transactions to the files of their months.
+
+    The files are synced to disk before returning.
+
+    :param directory: archive directory
+    :param rows: list of dicts of FIELDS
+    """
+
+    files = dict()
+    for row in rows:
+        files.setdefault(archive_path(directory, row["timestamp"]), []).append(
+            to_line(row)
+        )
+    for path, lines in files.items():
+        with open(path, "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb") as member:
+                member.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def archive(before, directory=None, batch_size=1000, dry_run=False):
+    """Moves the transactions older than before into the archive.
+
+    Batches are written to the archive, then deleted from the database by
+    their ids, so no lock is held for long. If the process dies in between, a
+    batch may be archived twice; reading the archive skips duplicates.
+
+    :param before: aware datetime
+    :param directory: archive directory, defaults to ARCHIVE_DIR
+    :param batch_size: transactions per batch
+    :param dry_run: count only
+    :returns: number of archived transactions
+    """
+
+    directory = directory or settings.ARCHIVE_DIR
+    queryset = Transaction.objects.filter(
+        timestamp__lt=before, status__in=ARCHIVED_STATUSES
+    )
+    if dry_run:
+        return queryset.count()
+
+    os.makedirs(directory, exist_ok=True)
+    columns = [field for field in FIELDS if field != "transaction_id"]
+    archived = 0
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .values(*columns)[:batch_size]
+        )
+        if not rows:
+            break
+        append(directory, history.with_transaction_ids(rows))
+        ids = [row["id"] for row in rows]
+        Transaction.objects.filter(id__in=ids).delete()
+        archived += len(rows)
+        last_id = ids[-1]
+        logger.info("Archived {} transactions".format(archived))
+    return archived
+
+
+def read(directory=None, address=None, since=None, until=None):
+    """Iterates over the archived transactions, oldest month first.
+
+    :param directory: archive directory, defaults to ARCHIVE_DIR
+    :param address: destination address
+    :param since: aware datetime, including
+    :param until: aware datetime, excluding
+    :returns: iterator of dicts of FIELDS
+    """
+
+    directory = directory or settings.ARCHIVE_DIR
+    for path in sorted(glob.glob(os.path.join(directory, FILE_PATTERN))):
+        # a batch archived twice is archived in the same file
+        seen = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = from_line(line)
+                if row["id"] in seen:
+                    continue
+                seen.add(row["id"])
+                if address and row["destination_address"] != address:
+                    continue
+                if since is not None and row["timestamp"] < since:
+                    continue
+                if until is not None and row["timestamp"] >= until:
+                    continue
+                yield row
+
+
+def restore(rows, batch_size=1000):
+    """Inserts archived transactions into the database again.
+
+    Transactions which exist already are skipped. Each batch is inserted
+    in a transaction (with its tx hashes), the timestamps (auto_now_add) are
+    set afterwards.
+
+    :param rows: iterable of dicts of FIELDS
+    :param batch_size: transactions per insert
+    :returns: number of restored transactions
+    """
+
+    restored = 0
+    batch = list()
+
+    def insert(batch):
+        existing = set(
+            Transaction.objects.filter(
+                id__in=[row["id"] for row in batch]
+            ).values_list("id", flat=True)
+        )
+        new = [row for row in batch if row["id"] not in existing]
+        instances = [Transaction(**row) for row in new]
+        with db_transaction.atomic():
+            Transaction.objects.bulk_create(instances)
+            TransactionHash.objects.bulk_create(
+                [h for i in instances for h in i.tx_hash_objects()]
+            )
+            for row in new:
+                Transaction.objects.filter(id=row["id"]).update(
+                    timestamp=row["timestamp"]
+                )
+        return len(new)
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            restored += insert(batch)
+            batch = list()
+    if batch:
+        restored += insert(batch)
+    return restored
@@ -0,0 +1,238 @@
+import asyncio
+import decimal
+import json
+import random
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from monerorpc.authproxy import JSONRPCException, EncodeDecimal
+
+from . import metrics, backends
+from .rpc_client import IDEMPOTENT_METHODS, is_transient, get_timeout
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# seconds after which idle connections are not reused, shorter than the
+# keep-alive timeout of the RPC servers
+IDLE_TIMEOUT = 10.0
+
+
+def connection_error(message):
+    # same error code AuthServiceProxy uses for connection problems
+    return JSONRPCException({"code": -341, "message": message})
+
+
+def response_error(message):
+    # the request was sent, but no (valid) response was received
+    return JSONRPCException({"code": -342, "message": message})
+
+
+class AsyncRpcClient:
+    """asyncio JSON-RPC client to monero-wallet-rpc or monerod.
+
+    The asyncio counterpart of rpc_client.RpcClient: keeps idle keep-alive
+    connections (HTTP/1.1) for reuse, applies the same per method timeouts
+    and retries idempotent calls on connection errors.
+
+    Connections idle for more than IDLE_TIMEOUT seconds are closed instead
+    of reused. An idempotent call is sent again on a new connection, if a
+    reused one was closed by the server.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.errors = Counter()
+        self.retries = Counter()
+        self._idle = list()
+        self._id = 0
+
+    async def call(self, method, params=None):
+        """Calls an RPC method.
+
+        :param method: RPC method name
+        :param params: optional dict of parameters
+        :returns: the RPC's result
+        :raises JSONRPCException: the RPC returned an error, no connection
+            could be established (-341) or no response was received (-342)
+        :raises asyncio.TimeoutError: the RPC did not answer in time
+        """
+
+        with metrics.RPC_DURATION.labels(method=method).time():
+            return await self._call_with_retries(method, params)
+
+    async def _call_with_retries(self, method, params):
+        attempts = 1
+        if method in IDEMPOTENT_METHODS:
+            attempts += settings.RPC_RETRIES
+
+        for attempt in range(attempts):
+            self.calls[method] += 1
+            try:
+                return await self._call(method, params)
+            except (JSONRPCException, asyncio.TimeoutError) as e:
+                self.errors[method] += 1
+                metrics.RPC_ERRORS.labels(method=method).inc()
+                transient = isinstance(
+                    e, asyncio.TimeoutError
+                ) or is_transient(e)
+                if attempt + 1 >= attempts or not transient:
+                    raise
+                self.retries[method] += 1
+                backoff = settings.RPC_RETRY_BACKOFF * (2 ** attempt)
+                logger.warning(
+                    "Retrying {0} in up to {1}s: {2}".format(
+                        method, backoff, str(e)
+                    )
+                )
+                await asyncio.sleep(random.uniform(0, backoff))
+
+    def close(self):
+        """Closes the idle connections.
+        """
+
+        while self._idle:
+            reader, writer, idle_since = self._idle.pop()
+            writer.close()
+
+    async def _call(self, method, params, reuse=True):
+        connect_timeout, read_timeout = get_timeout(method)
+        self._id += 1
+        body = json.dumps(
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params if params is not None else [],
+                "id": self._id,
+            },
+            default=EncodeDecimal,
+        ).encode("utf-8")
+
+        reader, writer, reused = await self._connect(connect_timeout, reuse)
+        try:
+            status, keep_alive, data = await asyncio.wait_for(
+                self._request(reader, writer, body), read_timeout
+            )
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            writer.close()
+            if reused and method in IDEMPOTENT_METHODS:
+                # the server closed the idle connection
+                return await self._call(method, params, reuse=False)
+            raise response_error(
+                "no response, original error: {}".format(str(e))
+            )
+        except asyncio.TimeoutError:
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+        if status != 200:
+            raise JSONRPCException(
+                {
+                    "code": -344,
+                    "message": "received HTTP status code {}".format(status),
+                }
+            )
+        response = json.loads(
+            data.decode("utf-8"), parse_float=decimal.Decimal
+        )
+        if response.get("error", None) is not None:
+            raise JSONRPCException(response["error"])
+        elif "result" not in response:
+            raise JSONRPCException(
+                {"code": -343, "message": "missing JSON-RPC result"}
+            )
+        return response["result"]
+
+    async def _connect(self, timeout, reuse=True):
+        """Returns an idle or a new connection.
+
+        :returns: reader, writer and whether the connection is reused
+        """
+
+        while reuse and self._idle:
+            reader, writer, idle_since = self._idle.pop()
+            idle = time.monotonic() - idle_since
+            if idle <= IDLE_TIMEOUT and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise connection_error(
+                "could not establish a connection, original error: {}".format(
+                    str(e)
+                )
+            )
+        return reader, writer, False
+
+    async def _request(self, reader, writer, body):
+        writer.write(
+            (
+                "POST /json_rpc HTTP/1.1\r\n"
+                "Host: {0}:{1}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {2}\r\n"
+                "\r\n"
+            )
+            .format(self.host, self.port, len(body))
+            .encode("ascii")
+            + body
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        status = int(status_line.split()[1])
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return status, keep_alive, data
+
+
+_clients = dict()
+
+
+def get_async_client(host, port):
+    """Returns the client for the given RPC server and current event loop.
+
+    :param host: RPC host
+    :param port: RPC port
+    :returns: AsyncRpcClient
+    """
+
+    key = (id(asyncio.get_event_loop()), host, port)
+    if key not in _clients:
+        _clients[key] = AsyncRpcClient(host, port)
+    return _clients[key]
+
+
+def get_async_wallet_client():
+    """Returns the asyncio client to the (first) monero-wallet-rpc.
+    """
+
+    return get_async_client(*backends.address(backends.wallet_backends()[0]))
@@ -0,0 +1,189 @@
+import asyncio
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from asgiref.sync import sync_to_async
+from monerorpc.authproxy import JSONRPCException
+
+from ..exceptions import (
+    RpcConnectionError,
+    GetBalanceError,
+    TransferStateUnknownError,
+)
+from .async_rpc_client import get_async_wallet_client
+from .backends import wallet_backends
+from .rpc_client import was_not_sent
+from . import ledger, networks
+from .wallet_rpc import (
+    WalletRPC,
+    payout_amount,
+    BALANCE_CACHE_KEY,
+    BALANCE_LOCK_KEY,
+    BALANCE_POLL_INTERVAL,
+)
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class AsyncWalletRPC:
+    """asyncio interface to monero-wallet-rpc.
+
+    The counterpart of WalletRPC for the ASGI application.
+    """
+
+    @staticmethod
+    async def get_balance():
+        """Returns the current balance of the wallet.
+
+        :returns: unlocked_balance if successful in XMR format
+        :raises RpcConnectionError: no connection could be established
+        :raises ValueError: retrieved data could not be processed
+        """
+
+        if len(wallet_backends()) > 1:
+            # the total of all backends, tracking their health
+            return await sync_to_async(
+                WalletRPC.get_balance, thread_sensitive=False
+            )()
+        try:
+            result = await get_async_wallet_client().call("getbalance")
+        except (JSONRPCException, asyncio.TimeoutError) as e:
+            logger.error("RPC Error on getting balance" + str(e))
+            raise RpcConnectionError(str(e))
+        balance = result.get("unlocked_balance", None)
+        # check unlocked_balance key
+        # balance can be 0, therefore check for None
+        if balance is None:
+            raise ValueError("Error with: {0}".format(result))
+
+        return balance
+
+    @staticmethod
+    async def make_transaction(destination_address, amount):
+        """Makes a transaction to the given address.
+
+        :param destination_address: the wallet address to send XMR to
+        :param amount: the amount of XMR to send
+        :returns: the transaction object
+        :raises RpcConnectionError: in case of a connection error to the rpc
+        :raises TransferStateUnknownError: if the transfer may have been sent
+        :raises ValueError: in case  the JSON returned is bad
+        """
+
+        params = WalletRPC.transfer_params(
+            [{"address": destination_address, "amount": amount}]
+        )
+        try:
+            result = await get_async_wallet_client().call(
+                "transfer_split", params
+            )
+        except (JSONRPCException, asyncio.TimeoutError) as e:
+            logger.error("RPC Error on making transaction" + str(e))
+            if not was_not_sent(e):
+                raise TransferStateUnknownError(str(e))
+            raise RpcConnectionError(str(e))
+
+        return WalletRPC.transfer_result(params, result, wallet_backends()[0])[
+            0
+        ]
+
+
+async def fetch_balance():
+    """Gets the balance from the wallet and stores it in the cache.
+    """
+
+    entry = {
+        "balance": await AsyncWalletRPC.get_balance(),
+        "fetched_at": time.time(),
+    }
+    await sync_to_async(cache.set)(
+        networks.cache_key(BALANCE_CACHE_KEY),
+        entry,
+        settings.BALANCE_CACHE_MAX_AGE,
+    )
+    return entry
+
+
+async def refresh_balance():
+    """Refreshes the cached balance in the background.
+    """
+
+    try:
+        await fetch_balance()
+    except (ValueError, RpcConnectionError) as e:
+        logger.error("Could not refresh balance: " + str(e))
+    finally:
+        await sync_to_async(cache.delete)(networks.cache_key(BALANCE_LOCK_KEY))
+
+
+async def get_cached_balance_entry():
+    """Returns the wallet's cached balance.
+
+    Same caching as wallet_rpc.get_cached_balance_entry(), waiting on the
+    event loop instead of blocking a thread.
+    """
+
+    if settings.BALANCE_CACHE_TTL <= 0:
+        return {
+            "balance": await AsyncWalletRPC.get_balance(),
+            "fetched_at": time.time(),
+        }
+
+    cache_key = networks.cache_key(BALANCE_CACHE_KEY)
+    lock_key = networks.cache_key(BALANCE_LOCK_KEY)
+    lock_timeout = sum(settings.RPC_TIMEOUTS["default"])
+    entry = await sync_to_async(cache.get)(cache_key)
+    if entry is not None:
+        age = time.time() - entry["fetched_at"]
+        if age > settings.BALANCE_CACHE_TTL and await sync_to_async(cache.add)(
+            lock_key, True, lock_timeout
+        ):
+            asyncio.ensure_future(refresh_balance())
+        return entry
+
+    if await sync_to_async(cache.add)(lock_key, True, lock_timeout):
+        try:
+            return await fetch_balance()
+        finally:
+            await sync_to_async(cache.delete)(lock_key)
+
+    # another process is asking the wallet already
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        await asyncio.sleep(BALANCE_POLL_INTERVAL)
+        entry = await sync_to_async(cache.get)(cache_key)
+        if entry is not None:
+            return entry
+    return await fetch_balance()
+
+
+async def get_balance():
+    try:
+        return (await get_cached_balance_entry())["balance"]
+    except (ValueError, RpcConnectionError) as e:
+        raise GetBalanceError("Could not get balance.")
+
+
+async def get_current_amount(factor):
+    """Returns the calculated amount to transfer.
+
+    See wallet_rpc.get_current_amount().
+
+    :param factor: the factor to consider when paying out XMR
+    :returns: the XMR to pay out (factored unlocked_balance)
+    """
+
+    if settings.LEDGER_ENABLE:
+        try:
+            entry = await get_cached_balance_entry()
+        except (ValueError, RpcConnectionError) as e:
+            raise GetBalanceError("Could not get balance.")
+        balance = await sync_to_async(ledger.available_balance)(entry)
+    else:
+        balance = await get_balance()
+    return payout_amount(balance, factor)
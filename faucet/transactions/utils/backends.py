@@ -0,0 +1,164 @@
+"""Routing of payouts across several monero-wallet-rpc instances.
+
+monero-wallet-rpc sends one transfer at a time and the outputs it spends
+stay locked for 10 blocks, so payouts are spread over settings.WALLET_BACKENDS
+(of the active network). Each payout goes to the healthy backend, which is
+not busy with another transfer and has the most unlocked balance. If all of
+them are busy, the payout is rejected (503).
+
+The state of the backends is kept in the cache, so it is shared by all
+workers:
+  - the unlocked balance of every backend (refreshed with the balance)
+  - "busy" while a transfer is in flight
+  - "down" for settings.WALLET_BACKEND_RETRY_INTERVAL seconds after a
+    connection error
+"""
+
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ..exceptions import WalletBusyError
+from . import locks, networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def wallet_backends():
+    """Returns the wallet backends of the active network.
+
+    :returns: list of "host:port", WALLET_HOST:WALLET_PORT if none are set
+    """
+
+    backends = networks.setting("WALLET_BACKENDS")
+    if backends:
+        return list(backends)
+    return [
+        "{0}:{1}".format(
+            networks.setting("WALLET_HOST"), networks.setting("WALLET_PORT")
+        )
+    ]
+
+
+def address(backend):
+    """Returns the (host, port) of a backend.
+    """
+
+    host, _, port = backend.rpartition(":")
+    return host, int(port)
+
+
+def state_key(backend, state):
+    return networks.cache_key("wallet:{0}:{1}".format(backend, state))
+
+
+def is_down(backend):
+    return bool(cache.get(state_key(backend, "down")))
+
+
+def mark_down(backend):
+    """Skips a backend for settings.WALLET_BACKEND_RETRY_INTERVAL seconds.
+    """
+
+    logger.warning("Wallet backend {} is down".format(backend))
+    cache.set(
+        state_key(backend, "down"),
+        True,
+        settings.WALLET_BACKEND_RETRY_INTERVAL,
+    )
+
+
+def set_balance(backend, balance):
+    cache.set(
+        state_key(backend, "balance"), balance, settings.BALANCE_CACHE_MAX_AGE
+    )
+
+
+def get_balance(backend):
+    """Returns the cached unlocked balance of a backend.
+
+    :returns: the balance in XMR format, None if not cached
+    """
+
+    return cache.get(state_key(backend, "balance"))
+
+
+def is_routed():
+    """Checks whether payouts are routed across several wallet backends.
+    """
+
+    return len(wallet_backends()) > 1
+
+
+def healthy_backends():
+    """Returns the backends which are not down.
+
+    If all are down, all are returned, so payouts are still tried.
+    """
+
+    backends = wallet_backends()
+    healthy = [b for b in backends if not is_down(b)]
+    return healthy or backends
+
+
+def candidates(amount):
+    """Returns the healthy backends in the order to try them for a payout.
+
+    Backends, which can afford the amount, come first (most unlocked balance
+    first), then the ones with unknown balance (e.g. just used), then the
+    rest.
+
+    :param amount: the amount to send in XMR format
+    :returns: list of backends
+    """
+
+    backends = healthy_backends()
+    balances = cache.get_many([state_key(b, "balance") for b in backends])
+
+    def order(backend):
+        balance = balances.get(state_key(backend, "balance"))
+        if balance is None:
+            return (1, 0)
+        if balance < amount:
+            return (2, -balance)
+        return (0, -balance)
+
+    return sorted(backends, key=order)
+
+
+@contextmanager
+def acquire(amount=0):
+    """Reserves a backend for a transfer.
+
+    The first candidate, which is not busy, is used. A single backend is
+    used even if it is busy (monero-wallet-rpc queues the transfer).
+
+    :param amount: the amount to send in XMR format
+    :returns: the backend ("host:port")
+    :raises WalletBusyError: if several backends are configured and all
+        of them are busy
+    """
+
+    ordered = candidates(amount)
+    timeout = sum(settings.RPC_TIMEOUTS["transfer_split"])
+    backend = token = None
+    for candidate in ordered:
+        token = locks.acquire(state_key(candidate, "busy"), timeout)
+        if token is not None:
+            backend = candidate
+            break
+    if backend is None:
+        if is_routed():
+            raise WalletBusyError
+        backend = ordered[0]
+    try:
+        yield backend
+    finally:
+        # its outputs are locked now, use others until it is refreshed
+        cache.delete(state_key(backend, "balance"))
+        if token is not None:
+            locks.release(state_key(backend, "busy"), token)
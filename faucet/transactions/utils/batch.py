@@ -0,0 +1,171 @@
+import threading
+import logging
+
+from django.conf import settings
+
+from .wallet_rpc import WalletRPC
+from . import networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def is_integrated_address(address):
+    """Integrated addresses carry their own payment id.
+
+    :param address: the address to check
+    :returns: True if the address is an integrated address
+    """
+
+    return len(address) == 106
+
+
+class PendingPayout:
+    """A single payout waiting to be sent within a batch.
+    """
+
+    def __init__(self, destination_address, amount):
+        self.destination_address = destination_address
+        self.amount = amount
+        self.transaction = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class PayoutBatcher:
+    """Aggregates payouts into multi-destination transfer_split calls.
+
+    Payouts are collected until either `window` seconds passed since the
+    first payout of a batch arrived, or `size` destinations are collected.
+    Then all of them are sent with one transfer_split call and every caller
+    gets the shared transaction hashes.
+
+    A monero transaction can only contain a single payment id, so a batch
+    never contains more than one integrated address.
+    """
+
+    def __init__(self, window, size):
+        self.window = window
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._pending = list()
+        self._timer = None
+
+    def submit(self, destination_address, amount):
+        """Adds a payout to the current batch and waits until it was sent.
+
+        :param destination_address: the wallet address to send XMR to
+        :param amount: the amount of XMR to send
+        :returns: the transaction object of this payout
+        :raises RpcConnectionError: in case of a connection error to the rpc
+        :raises ValueError: in case  the JSON returned is bad
+        """
+
+        payout = PendingPayout(destination_address, amount)
+        batches = list()
+        with self._lock:
+            if is_integrated_address(destination_address) and any(
+                is_integrated_address(p.destination_address)
+                for p in self._pending
+            ):
+                batches.append(self._take())
+            self._pending.append(payout)
+            if len(self._pending) >= self.size:
+                batches.append(self._take())
+            elif self._timer is None:
+                # the batcher's network, see get_batcher()
+                self._timer = threading.Timer(
+                    self.window, networks.bind(self.flush)
+                )
+                self._timer.daemon = True
+                self._timer.start()
+
+        for batch in batches:
+            self._send(batch)
+
+        payout.done.wait()
+        if payout.error is not None:
+            raise payout.error
+        return payout.transaction
+
+    def flush(self):
+        """Sends all currently collected payouts.
+        """
+
+        with self._lock:
+            batch = self._take()
+        self._send(batch)
+
+    def _take(self):
+        """Removes and returns the current batch.
+
+        Must be called holding the lock.
+        """
+
+        batch, self._pending = self._pending, list()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _send(self, batch):
+        if not batch:
+            return
+        logger.info("Sending batch of {} payouts".format(len(batch)))
+        try:
+            transactions = WalletRPC.make_transactions(
+                [
+                    {"address": p.destination_address, "amount": p.amount}
+                    for p in batch
+                ]
+            )
+            for payout, transaction in zip(batch, transactions):
+                payout.transaction = transaction
+        except Exception as e:
+            for payout in batch:
+                payout.error = e
+        finally:
+            for payout in batch:
+                payout.done.set()
+
+
+_batchers = dict()
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Returns the process wide payout batcher of the active network.
+    """
+
+    network = networks.active()
+    with _batcher_lock:
+        if network not in _batchers:
+            _batchers[network] = PayoutBatcher(
+                window=settings.PAYOUT_BATCH_WINDOW,
+                size=settings.PAYOUT_BATCH_SIZE,
+            )
+        return _batchers[network]
+
+
+def make_transaction(destination_address, amount, backend=None):
+    """Makes a transaction, batched with others if batching is enabled.
+
+    :param destination_address: the wallet address to send XMR to
+    :param amount: the amount of XMR to send
+    :param backend: the acquired wallet backend to send from (the payout
+        is not batched then)
+    :returns: the transaction object of this payout
+    :raises RpcConnectionError: in case of a connection error to the rpc
+    :raises ValueError: in case  the JSON returned is bad
+    """
+
+    if backend is not None or not settings.PAYOUT_BATCH_ENABLE:
+        return WalletRPC.make_transaction(
+            destination_address=destination_address,
+            amount=amount,
+            backend=backend,
+        )
+    return get_batcher().submit(
+        destination_address=destination_address, amount=amount
+    )
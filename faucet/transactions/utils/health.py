@@ -0,0 +1,277 @@
+"""Worker prewarming and dependency health checks.
+
+A freshly started worker fetches the network type, the wallet's address and
+its balance (of every network) in the background, so its first requests do
+not pay the RPC round trips. The dependencies (database, cache, wallets and
+daemons) are checked by the worker every settings.HEALTH_CHECK_INTERVAL
+seconds in the background, /healthz and /readyz answer with the last
+results. A network is ready, if the shared dependencies (database and cache)
+and its own daemon are and at least one of its wallet backends can send, so
+one unreachable wallet does not take the other networks out of rotation.
+
+Under uWSGI, every worker is prewarmed after it is forked (see
+TransactionsConfig.ready()), other servers start prewarming on loading the
+application (see faucet/wsgi.py and faucet/asgi.py).
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from ..exceptions import RpcConnectionError
+from . import backends, networks, wallet_rpc
+from .rpc_client import get_client, get_daemon_client
+from .wallet_rpc import WalletRPC
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+HEALTH_CACHE_KEY = "health:check"
+
+# state of this worker
+_state = {
+    "warm": False,
+    "checks": dict(),
+    "networks": dict(),
+    "checked_at": None,
+}
+_lock = threading.Lock()
+_prewarm_pid = None
+_check_running = False
+
+
+def check_database():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def check_cache():
+    value = str(time.time())
+    cache.set(HEALTH_CACHE_KEY, value, 60)
+    if cache.get(HEALTH_CACHE_KEY) != value:
+        raise ValueError("Cache does not store values.")
+
+
+def check_wallet(backend):
+    # answered without scanning the wallet (unlike getbalance)
+    get_client(*backends.address(backend)).call("get_version")
+
+
+def check_daemon():
+    get_daemon_client().call("get_info")
+
+
+def dependency_checks():
+    """Returns the checks of all dependencies.
+
+    :returns: list of (name, network, function, is_wallet); the network of
+        the shared dependencies is None, the wallet and daemon of other
+        networks are named "<network>:wallet" and "<network>:daemon", every
+        wallet backend is checked as "wallet:<host:port>" if there are
+        several
+    """
+
+    checks = [
+        ("database", None, check_database, False),
+        ("cache", None, check_cache, False),
+    ]
+    for network in networks.served():
+        with networks.using(network):
+            wallets = backends.wallet_backends()
+            for backend in wallets:
+                name = "wallet" if len(wallets) == 1 else "wallet:" + backend
+                checks.append(
+                    (
+                        networks.cache_key(name),
+                        network,
+                        functools.partial(check_wallet, backend),
+                        True,
+                    )
+                )
+            checks.append(
+                (networks.cache_key("daemon"), network, check_daemon, False)
+            )
+    return checks
+
+
+def check():
+    """Checks all dependencies and stores the results.
+
+    The RPCs are bounded by settings.RPC_TIMEOUTS.
+
+    :returns: dict of name and result ("ok", "error" if failed)
+    """
+
+    results = dict()
+    failed = set()
+    # networks with a wallet backend, which can send
+    sending = set()
+    for name, network, function, is_wallet in dependency_checks():
+        try:
+            with networks.using(network or networks.DEFAULT):
+                function()
+        except Exception as e:
+            logger.warning("Health check {0} failed: {1}".format(name, e))
+            results[name] = {"ok": False, "error": str(e)}
+            if not is_wallet:
+                failed.add(network)
+        else:
+            results[name] = {"ok": True}
+            if is_wallet:
+                sending.add(network)
+    ready = {
+        network: None not in failed
+        and network not in failed
+        and network in sending
+        for network in networks.served()
+    }
+    with _lock:
+        _state["checks"] = results
+        _state["networks"] = ready
+        _state["checked_at"] = time.time()
+    return results
+
+
+def run_in_thread(function):
+    """Runs a function in a daemon thread with its own database connection.
+    """
+
+    def target():
+        try:
+            function()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def refresh_checks():
+    global _check_running
+
+    try:
+        check()
+    finally:
+        with _lock:
+            _check_running = False
+
+
+def status():
+    """Returns the last results of this worker's checks.
+
+    Results older than settings.HEALTH_CHECK_INTERVAL seconds are refreshed
+    in the background (by a single thread).
+
+    :returns: dict of "warm", "ready" (of the active network), "networks"
+        (readiness per network, the DEFAULT network as "default"), "checks"
+        and their "age" in seconds
+    """
+
+    global _check_running
+
+    now = time.time()
+    with _lock:
+        checked_at = _state["checked_at"]
+        stale = (
+            checked_at is None
+            or now - checked_at > settings.HEALTH_CHECK_INTERVAL
+        )
+        refresh = stale and _state["warm"] and not _check_running
+        if refresh:
+            _check_running = True
+        checks = dict(_state["checks"])
+        warm = _state["warm"]
+        ready = {
+            network: warm and ok for network, ok in _state["networks"].items()
+        }
+    if refresh:
+        run_in_thread(refresh_checks)
+    return {
+        "warm": warm,
+        "ready": ready.get(networks.active(), False),
+        "networks": {
+            network or "default": ok for network, ok in ready.items()
+        },
+        "checks": checks,
+        "age": None if checked_at is None else round(now - checked_at, 3),
+    }
+
+
+def prewarm():
+    """Fetches the wallet metadata and balance (of every wallet backend) of
+    all networks and checks the dependencies.
+
+    Failures are logged, the worker is warm afterwards anyway (it is only
+    ready, if the checks succeeded).
+    """
+
+    start = time.perf_counter()
+    for network in networks.served():
+        with networks.using(network):
+            try:
+                WalletRPC.get_network_type()
+                WalletRPC.get_cached_address()
+                wallet_rpc.get_cached_balance_entry()
+            except (ValueError, RpcConnectionError) as e:
+                logger.error(
+                    "Could not prewarm network {0!r}: {1}".format(network, e)
+                )
+    check()
+    with _lock:
+        _state["warm"] = True
+    logger.info(
+        "Prewarmed worker {0} in {1:.3f}s".format(
+            os.getpid(), time.perf_counter() - start
+        )
+    )
+
+
+def start_prewarm():
+    """Prewarms this worker in the background (once per process).
+    """
+
+    global _prewarm_pid
+
+    with _lock:
+        if _prewarm_pid == os.getpid():
+            return None
+        _prewarm_pid = os.getpid()
+    return run_in_thread(prewarm)
+
+
+def is_uwsgi():
+    try:
+        import uwsgi  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def schedule_prewarm():
+    """Prewarms every uWSGI worker after it is forked.
+
+    The application may be loaded by the uWSGI master, whose threads and
+    connections are not inherited by the workers.
+
+    :returns: True if running under uWSGI
+    """
+
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+    except ImportError:
+        return False
+    if uwsgi.worker_id() > 0:
+        # loaded by the worker itself (lazy-apps)
+        start_prewarm()
+    else:
+        postfork(start_prewarm)
+    return True
@@ -0,0 +1,215 @@
+"""Filtering, keyset pagination and exports of the payout history.
+
+Pages are sliced by (timestamp, id) instead of offsets, so a page is found
+through the transaction_time_id_idx index, no matter how far back it is.
+"""
+
+import base64
+import csv
+import json
+import datetime
+import itertools
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+from ..models import TransactionHash
+from . import tools
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# columns of the exports (and the history API)
+FIELDS = (
+    "id",
+    "timestamp",
+    "sent_at",
+    "status",
+    "amount",
+    "transaction_id",
+    "destination_address",
+)
+
+# rows fetched per round trip of the server-side cursor
+CHUNK_SIZE = 2000
+
+
+def parse_time(value):
+    """Parses an ISO 8601 date or datetime (UTC if no offset is given).
+
+    :param value: e.g. "2019-03-01" or "2019-03-01T12:00:00+01:00"
+    :returns: aware datetime
+    :raises ValueError: if the value is not a date or datetime
+    """
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        try:
+            parsed = datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("Invalid date/time: {}".format(value))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def filter_transactions(
+    queryset, address=None, since=None, until=None, tx_hash=None
+):
+    """Filters transactions by destination address, time range and tx hash.
+
+    :param queryset: Transaction queryset
+    :param address: destination address
+    :param since: aware datetime, including
+    :param until: aware datetime, excluding
+    :param tx_hash: hash of one of the transfer's transactions
+    :returns: filtered queryset
+    """
+
+    if address:
+        queryset = queryset.filter(destination_address=address)
+    if tx_hash:
+        queryset = queryset.filter(hashes__tx_hash=tx_hash)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset
+
+
+def encode_cursor(timestamp, pk):
+    """Returns the opaque cursor of a position.
+
+    :param timestamp: timestamp of the last transaction of a page
+    :param pk: id of the last transaction of a page
+    """
+
+    position = "{0}|{1}".format(timestamp.isoformat(), pk)
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns the position of a cursor.
+
+    :param cursor: cursor returned by encode_cursor()
+    :returns: (timestamp, pk)
+    :raises ValueError: if the cursor is invalid
+    """
+
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        timestamp, pk = position.decode("utf-8").split("|")
+        return parse_time(timestamp), int(pk)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor: {}".format(e))
+
+
+def before(queryset, timestamp, pk):
+    """Returns the transactions older than the given position.
+
+    :param queryset: Transaction queryset
+    :param timestamp: timestamp of the position
+    :param pk: id of the position (for equal timestamps)
+    """
+
+    return queryset.filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+    )
+
+
+def transaction_ids(pks):
+    """Returns the transaction_id (joined tx hashes) of transactions.
+
+    :param pks: ids of transactions
+    :returns: dict of id and transaction_id (missing if it has no hashes)
+    """
+
+    hashes = dict()
+    for pk, tx_hash in (
+        TransactionHash.objects.filter(transaction__in=pks)
+        .order_by("transaction", "position")
+        .values_list("transaction", "tx_hash")
+    ):
+        hashes.setdefault(pk, list()).append(tx_hash)
+    return {pk: ",".join(tx_hashes) for pk, tx_hashes in hashes.items()}
+
+
+def with_transaction_ids(rows):
+    """Adds the transaction_id to dicts of transaction columns.
+
+    :param rows: list of dicts including "id"
+    :returns: the rows
+    """
+
+    ids = transaction_ids([row["id"] for row in rows])
+    for row in rows:
+        row["transaction_id"] = ids.get(row["id"], "")
+    return rows
+
+
+def export_rows(queryset):
+    """Iterates over the transactions in chronological order.
+
+    Rows are fetched in chunks (using a server-side cursor on PostgreSQL),
+    so memory usage does not grow with the number of transactions. The tx
+    hashes are fetched per chunk.
+
+    :param queryset: Transaction queryset
+    :returns: iterator of dicts of FIELDS
+    """
+
+    columns = [field for field in FIELDS if field != "transaction_id"]
+    rows = (
+        queryset.order_by("timestamp", "id")
+        .values_list(*columns)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    while True:
+        chunk = [
+            dict(zip(columns, row))
+            for row in itertools.islice(rows, CHUNK_SIZE)
+        ]
+        if not chunk:
+            break
+        for row in with_transaction_ids(chunk):
+            row["amount"] = tools.xmr_to_float(row["amount"])
+            yield {field: row[field] for field in FIELDS}
+
+
+class Echo:
+    """File-like object returning what is written to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Iterates over the CSV lines (including a header) of the rows.
+    """
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(
+            ["" if row[field] is None else row[field] for field in FIELDS]
+        )
+
+
+def ndjson_lines(rows):
+    """Iterates over the rows as JSON objects, one per line.
+    """
+
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder) + "\n"
+
+
+# format -> (content type, lines)
+FORMATS = {
+    "csv": ("text/csv", csv_lines),
+    "ndjson": ("application/x-ndjson", ndjson_lines),
+}
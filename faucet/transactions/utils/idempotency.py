@@ -0,0 +1,217 @@
+"""Idempotency keys of POST /transactions/.
+
+A client sending an Idempotency-Key header can retry a payout request (e.g.
+after a timeout) without being paid twice. The key is stored in the cache
+(per network) while its payout is in progress, then with the response,
+which is returned to retries for settings.IDEMPOTENCY_KEY_TTL seconds
+without checking the limits or calling the wallet again.
+
+Failed requests, which certainly sent nothing, are not stored, so they can
+be retried. If the payout may have been sent (e.g. the transfer timed out),
+the key is kept with the payout of unknown state. Retries are answered with
+409 Conflict, until payout_queue.reconcile() finds out whether it was sent:
+with its response if so, by processing the retry otherwise.
+"""
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status as http_status
+from rest_framework.exceptions import APIException, ValidationError
+
+from ..exceptions import (
+    IdempotencyKeyInUseError,
+    IdempotencyKeyMismatchError,
+    MakeTransactionError,
+    RpcConnectionError,
+    TransferStateUnknownError,
+)
+from ..models import Transaction
+from ..serializers import TransactionSerializer
+from . import networks, tools
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+MAX_LENGTH = 255
+
+IN_PROGRESS = "in-progress"
+DONE = "done"
+UNKNOWN = "unknown"
+
+
+def get_key(request):
+    """Returns the Idempotency-Key of a request.
+
+    :returns: the key, None if the request has none
+    :raises ValidationError: if the key is too long
+    """
+
+    key = request.META.get(HEADER)
+    if not key:
+        return None
+    if len(key) > MAX_LENGTH:
+        raise ValidationError(
+            {
+                "Idempotency-Key": "Ensure this header has no more than "
+                "{} characters.".format(MAX_LENGTH)
+            }
+        )
+    return key
+
+
+def cache_key(key):
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return networks.cache_key("idempotency:" + digest)
+
+
+def fingerprint(data):
+    """Returns what a retry has to repeat (the destination address).
+
+    :param data: the request's data
+    """
+
+    return tools.hash_value(str(data.get("destination_address", "")))
+
+
+def is_known(request):
+    """Checks if a request's key is in progress or done.
+
+    Such requests are not counted by the IP rate limits.
+    """
+
+    key = request.META.get(HEADER)
+    if not key or len(key) > MAX_LENGTH:
+        return False
+    return cache.get(cache_key(key)) is not None
+
+
+def begin(key, request_fingerprint):
+    """Marks a key in progress or returns its stored response.
+
+    :param key: the Idempotency-Key
+    :param request_fingerprint: see fingerprint()
+    :returns: None if the request is to be processed, else the stored
+        (status code, data)
+    :raises IdempotencyKeyInUseError: if the key's request is in progress
+    :raises IdempotencyKeyMismatchError: if the key was used for another
+        request
+    """
+
+    entry = {"state": IN_PROGRESS, "fingerprint": request_fingerprint}
+    if cache.add(cache_key(key), entry, settings.PAYOUT_LOCK_TIMEOUT):
+        return None
+    stored = cache.get(cache_key(key))
+    if stored is None:
+        # expired meanwhile
+        if cache.add(cache_key(key), entry, settings.PAYOUT_LOCK_TIMEOUT):
+            return None
+        raise IdempotencyKeyInUseError
+    if stored["fingerprint"] != request_fingerprint:
+        raise IdempotencyKeyMismatchError
+    if stored["state"] == IN_PROGRESS:
+        raise IdempotencyKeyInUseError
+    if stored["state"] == UNKNOWN:
+        return settle(key, stored)
+    logger.info("Replaying response of idempotency key")
+    return stored["status"], stored["data"]
+
+
+def finish(key, request_fingerprint, status, data):
+    """Stores the response of a key's request.
+
+    :param status: the response's status code
+    :param data: the response's data
+    """
+
+    cache.set(
+        cache_key(key),
+        {
+            "state": DONE,
+            "fingerprint": request_fingerprint,
+            "status": status,
+            "data": dict(data),
+        },
+        settings.IDEMPOTENCY_KEY_TTL,
+    )
+
+
+def release(key):
+    """Forgets a key, whose request failed, so it can be retried.
+    """
+
+    cache.delete(cache_key(key))
+
+
+def was_not_sent(error):
+    """Checks whether a failed payout request certainly sent nothing.
+
+    That is, if it was rejected (e.g. by validation or the limits) or its
+    transfer failed before it was sent (see rpc_client.was_not_sent()).
+    Anything else (e.g. a timed out transfer or a failure after it was
+    sent) may have sent the payout.
+
+    :param error: the exception raised by the request
+    """
+
+    if isinstance(error, MakeTransactionError):
+        error = error.__context__
+        return isinstance(
+            error, (ValueError, RpcConnectionError)
+        ) and not isinstance(error, TransferStateUnknownError)
+    return isinstance(error, APIException)
+
+
+def fail(key, request_fingerprint, error, instance=None):
+    """Handles a key, whose request failed.
+
+    The key is released, if nothing was sent. Otherwise, it is kept with
+    the payout of unknown state for settings.IDEMPOTENCY_KEY_TTL seconds.
+
+    :param error: the exception raised by the request
+    :param instance: the stored payout of the request (if any)
+    """
+
+    if was_not_sent(error):
+        release(key)
+        return
+    logger.warning("Keeping idempotency key of a payout of unknown state")
+    cache.set(
+        cache_key(key),
+        {
+            "state": UNKNOWN,
+            "fingerprint": request_fingerprint,
+            "transaction": None if instance is None else instance.pk,
+        },
+        settings.IDEMPOTENCY_KEY_TTL,
+    )
+
+
+def settle(key, stored):
+    """Answers a retry of a key, whose payout is of unknown state.
+
+    :param stored: the key's entry (see fail())
+    :returns: None if the payout was not sent (the retry is processed),
+        else its (status code, data)
+    :raises IdempotencyKeyInUseError: if the payout is still unresolved
+    """
+
+    transaction = Transaction.objects.filter(pk=stored["transaction"]).first()
+    if transaction is None or transaction.status in (
+        Transaction.SENDING,
+        Transaction.UNKNOWN,
+    ):
+        # kept until the payout is resolved
+        cache.set(cache_key(key), stored, settings.IDEMPOTENCY_KEY_TTL)
+        raise IdempotencyKeyInUseError
+    if transaction.status == Transaction.FAILED:
+        entry = {"state": IN_PROGRESS, "fingerprint": stored["fingerprint"]}
+        cache.set(cache_key(key), entry, settings.PAYOUT_LOCK_TIMEOUT)
+        return None
+    data = TransactionSerializer(transaction).data
+    finish(key, stored["fingerprint"], http_status.HTTP_201_CREATED, data)
+    return http_status.HTTP_201_CREATED, dict(data)
@@ -0,0 +1,51 @@
+import datetime
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from ..models import Transaction
+from . import networks
+
+
+def reserved_amount(since):
+    """Returns the amount of payouts a wallet balance does not reflect yet.
+
+    These are payouts that are queued, being sent or may have been sent,
+    and payouts that were sent after the wallet balance was fetched.
+
+    :param since: the time the wallet balance was fetched at
+    :returns: the reserved amount in XMR format
+    """
+
+    reserved = (
+        Transaction.objects.filter(network=networks.active())
+        .filter(
+            Q(
+                status__in=(
+                    Transaction.PENDING,
+                    Transaction.SENDING,
+                    Transaction.UNKNOWN,
+                )
+            )
+            | Q(status=Transaction.SENT, sent_at__gt=since)
+        )
+        .aggregate(total=Sum("amount"))
+    )
+    return reserved["total"] or 0
+
+
+def available_balance(entry):
+    """Returns the balance which is available for new payouts.
+
+    The last wallet balance is only re-synced every
+    settings.BALANCE_CACHE_TTL seconds. In between, reserved and sent
+    payouts are subtracted locally.
+
+    :param entry: the cached wallet balance ("balance", "fetched_at")
+    :returns: the available balance in XMR format
+    """
+
+    since = datetime.datetime.fromtimestamp(
+        entry["fetched_at"], tz=timezone.utc
+    )
+    return max(0, entry["balance"] - reserved_amount(since))
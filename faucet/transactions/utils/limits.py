@@ -0,0 +1,146 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import tools, metrics, networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DAY = 24 * 60 * 60
+
+
+def bucket_keys(kind, value, days, now=None):
+    """Returns the cache keys of all buckets within the sliding window.
+
+    :param kind: what is counted ("address", "ip")
+    :param value: the counted value (address, IP address hash)
+    :param days: range of days to consider
+    :param now: timestamp the window ends at, defaults to the current time
+    :returns: list of cache keys, the current bucket's key last
+    """
+
+    if now is None:
+        now = time.time()
+    size = settings.WITHDRAWAL_BUCKET_SECONDS
+    current = int(now // size)
+    first = current - (days * DAY) // size + 1
+    digest = tools.hash_value(value)
+    return [
+        networks.cache_key(
+            "withdrawals:{0}:{1}:{2}".format(kind, digest, bucket)
+        )
+        for bucket in range(first, current + 1)
+    ]
+
+
+def count_withdrawals(kind, value, days):
+    """Counts the withdrawals within the sliding window using the cache.
+
+    :param kind: what is counted ("address", "ip")
+    :param value: the counted value (address, IP address hash)
+    :param days: range of days to consider
+    :returns: number of withdrawals
+    """
+
+    return sum(cache.get_many(bucket_keys(kind, value, days)).values())
+
+
+def record_withdrawal(kind, value, days):
+    """Increments the counter of the current bucket.
+
+    :param kind: what is counted ("address", "ip")
+    :param value: the counted value (address, IP address hash)
+    :param days: range of days the counter is needed for
+    """
+
+    key = bucket_keys(kind, value, days)[-1]
+    timeout = days * DAY + settings.WITHDRAWAL_BUCKET_SECONDS
+    # add does nothing if the bucket exists already
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired in between
+        cache.add(key, 1, timeout)
+
+
+def cache_withdrew_too_often(destination_address, ip_address_hash, days):
+    """Checks the withdrawal quotas using the cache's counters.
+
+    :returns: True if payout is blocked, False otherwise
+    """
+
+    if (
+        count_withdrawals("address", destination_address, days)
+        >= settings.ADDRESS_RATE_PER_DAY
+    ):
+        return True
+    if settings.IP_HASH_RATE_PER_DAY and ip_address_hash:
+        return (
+            count_withdrawals("ip", ip_address_hash, days)
+            >= settings.IP_HASH_RATE_PER_DAY
+        )
+    return False
+
+
+def withdrew_too_often(destination_address, ip_address_hash, days=1):
+    """Block destination addresses (and IPs) which withdraw too often.
+
+    The IP address hashes are only checked if settings.IP_HASH_RATE_PER_DAY
+    is set.
+    Uses the counters in the cache, if settings.WITHDRAWAL_LIMIT_BACKEND is
+    "cache". The database is used otherwise and if the cache fails.
+
+    :param destination_address: the address to pay to
+    :param ip_address_hash: the hashed IP address of the user
+    :param days: range of days to consider
+    :returns: True if payout is blocked, False otherwise
+    """
+
+    if settings.WITHDRAWAL_LIMIT_BACKEND == "cache":
+        try:
+            with metrics.WITHDRAWAL_CHECK_DURATION.labels("cache").time():
+                return cache_withdrew_too_often(
+                    destination_address, ip_address_hash, days
+                )
+        except Exception as e:
+            logger.error(
+                "Checking withdrawals in cache failed, "
+                "falling back to database: " + str(e)
+            )
+    with metrics.WITHDRAWAL_CHECK_DURATION.labels("database").time():
+        if tools.addr_withdrew_too_often(
+            destination_address=destination_address,
+            rate_allowed=settings.ADDRESS_RATE_PER_DAY,
+            days=days,
+        ):
+            return True
+        if settings.IP_HASH_RATE_PER_DAY and ip_address_hash:
+            return tools.ip_withdrew_too_often(
+                ip_address_hash=ip_address_hash,
+                rate_allowed=settings.IP_HASH_RATE_PER_DAY,
+                days=days,
+            )
+        return False
+
+
+def record(destination_address, ip_address_hash, days=1):
+    """Counts a withdrawal, if the cache is used to check the quotas.
+
+    :param destination_address: the address paid to
+    :param ip_address_hash: the hashed IP address of the user
+    :param days: range of days to consider
+    """
+
+    if settings.WITHDRAWAL_LIMIT_BACKEND != "cache":
+        return
+    try:
+        record_withdrawal("address", destination_address, days)
+        if ip_address_hash:
+            record_withdrawal("ip", ip_address_hash, days)
+    except Exception as e:
+        logger.error("Counting withdrawal in cache failed: " + str(e))
@@ -0,0 +1,199 @@
+import math
+import os
+import binascii
+import random
+import threading
+import time
+import logging
+from collections import Counter
+
+import requests
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# endpoint name -> (HTTP method, path)
+ENDPOINTS = {
+    "index": ("GET", "/"),
+    "balance": ("GET", "/transactions/"),
+    "withdraw": ("POST", "/transactions/"),
+}
+PERCENTILES = (50, 95, 99)
+
+
+def random_address():
+    return "5" + binascii.hexlify(os.urandom(47)).decode()[:94]
+
+
+def parse_mix(mix):
+    """Parses a traffic mix like "index=1,balance=8,withdraw=1".
+
+    :param mix: comma separated endpoint=weight pairs
+    :returns: dict of endpoint name and weight
+    :raises ValueError: if an endpoint or weight is invalid
+    """
+
+    weights = dict()
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError("Unknown endpoint: {}".format(name))
+        weights[name] = float(weight or 1)
+        if weights[name] < 0:
+            raise ValueError("Negative weight: {}".format(part))
+    if not sum(weights.values()):
+        raise ValueError("No traffic: {}".format(mix))
+    return weights
+
+
+def percentile(values, p):
+    """Returns the p-th percentile (nearest rank) of sorted values.
+    """
+
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+class Recorder:
+    """Collects the latencies and status codes per endpoint.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = dict((name, list()) for name in ENDPOINTS)
+        self.statuses = dict((name, Counter()) for name in ENDPOINTS)
+
+    def add(self, name, status, latency):
+        """
+        :param name: endpoint name
+        :param status: HTTP status code or the name of the raised exception
+        :param latency: seconds until the response was received
+        """
+
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.statuses[name][str(status)] += 1
+
+    def summary(self, duration):
+        """Returns the results of a run.
+
+        Every response besides 2xx is counted as error.
+
+        :param duration: seconds the run took
+        :returns: dict of results per endpoint and in total
+        """
+
+        endpoints = dict()
+        total = {"requests": 0, "errors": 0}
+        for name in ENDPOINTS:
+            latencies = sorted(self.latencies[name])
+            if not latencies:
+                continue
+            statuses = self.statuses[name]
+            errors = sum(
+                count
+                for status, count in statuses.items()
+                if not status.startswith("2")
+            )
+            endpoints[name] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "throughput": len(latencies) / duration,
+                "statuses": dict(statuses),
+                "latency_ms": dict(
+                    [
+                        ("p{}".format(p), percentile(latencies, p) * 1000)
+                        for p in PERCENTILES
+                    ]
+                    + [
+                        ("mean", sum(latencies) / len(latencies) * 1000),
+                        ("max", latencies[-1] * 1000),
+                    ]
+                ),
+            }
+            total["requests"] += len(latencies)
+            total["errors"] += errors
+
+        total["error_rate"] = (
+            total["errors"] / total["requests"] if total["requests"] else 0
+        )
+        total["throughput"] = total["requests"] / duration
+        return {"duration": duration, "endpoints": endpoints, "total": total}
+
+
+class LoadGenerator:
+    """Sends mixed traffic to the faucet from concurrent clients.
+    """
+
+    def __init__(self, url, mix, concurrency, timeout=30):
+        """
+        :param url: base URL of the faucet, e.g. "http://127.0.0.1:8000"
+        :param mix: dict of endpoint name and weight
+        :param concurrency: number of concurrent clients
+        :param timeout: seconds to wait for a response
+        """
+
+        self.url = url.rstrip("/")
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.recorder = Recorder()
+
+    def request(self, session, name):
+        method, path = ENDPOINTS[name]
+        data = None
+        if method == "POST":
+            # a new address every time, so the per address limit is not hit
+            data = {"destination_address": random_address()}
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                method, self.url + path, data=data, timeout=self.timeout
+            )
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        self.recorder.add(name, status, time.perf_counter() - start)
+
+    def client(self, deadline, budget):
+        session = requests.Session()
+        rng = random.Random()
+        while time.time() < deadline and budget():
+            name = rng.choices(self.names, self.weights)[0]
+            self.request(session, name)
+
+    def run(self, duration, requests_limit=None):
+        """Runs the load test.
+
+        :param duration: seconds to send requests for
+        :param requests_limit: stop after this many requests (optional)
+        :returns: summary of Recorder
+        """
+
+        lock = threading.Lock()
+        sent = [0]
+
+        def budget():
+            with lock:
+                if requests_limit is not None and sent[0] >= requests_limit:
+                    return False
+                sent[0] += 1
+                return True
+
+        start = time.time()
+        deadline = start + duration
+        clients = [
+            threading.Thread(target=self.client, args=(deadline, budget))
+            for _ in range(self.concurrency)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return self.recorder.summary(time.time() - start)
@@ -0,0 +1,178 @@
+import hashlib
+import struct
+import logging
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from ..exceptions import PayoutInProgressError
+from . import networks, tools
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def advisory_lock_id(value):
+    """Maps a value to a (signed 64 bit) postgres advisory lock id.
+    """
+
+    digest = hashlib.sha256(value.encode("utf-8")).digest()
+    return struct.unpack("!q", digest[:8])[0]
+
+
+@contextmanager
+def database_lock(name):
+    """Holds a postgres session level advisory lock.
+
+    The lock is not bound to a database transaction, so no transaction is
+    kept open while the payout is made.
+
+    :raises PayoutInProgressError: if the lock is held by someone else
+    """
+
+    lock_id = advisory_lock_id(name)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [lock_id])
+        locked = cursor.fetchone()[0]
+    if not locked:
+        raise PayoutInProgressError
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+def acquire(key, timeout):
+    """Adds a key owned by a random token to the cache.
+
+    :returns: the token, None if the key is held by someone else
+    """
+
+    token = uuid.uuid4().hex
+    if not cache.add(key, token, timeout):
+        return None
+    return token
+
+
+def release(key, token):
+    """Deletes a key of acquire(), if it is still owned by the token.
+
+    Once the key expired, it may have been acquired by someone else, whose
+    key must be kept.
+    """
+
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def lock_timeout():
+    """Returns the seconds until a cache lock expires.
+
+    A lock is held while the payout is made, so it outlives the transfer.
+    """
+
+    return max(
+        settings.PAYOUT_LOCK_TIMEOUT,
+        sum(settings.RPC_TIMEOUTS["transfer_split"]),
+    )
+
+
+@contextmanager
+def cache_lock(name):
+    """Holds a lock in the cache.
+
+    cache.add is atomic, the lock expires after lock_timeout() in case the
+    process dies while holding it.
+
+    :raises PayoutInProgressError: if the lock is held by someone else
+    """
+
+    key = "lock:" + name
+    token = acquire(key, lock_timeout())
+    if token is None:
+        raise PayoutInProgressError
+    try:
+        yield
+    finally:
+        release(key, token)
+
+
+@contextmanager
+def payout_lock(name):
+    """Holds a lock of settings.PAYOUT_LOCK_BACKEND.
+
+    Uses postgres advisory locks if settings.PAYOUT_LOCK_BACKEND is
+    "database" (and postgres is used), the cache otherwise.
+    No lock is taken, if settings.PAYOUT_LOCK_BACKEND is empty.
+
+    :param name: name of the lock
+    :raises PayoutInProgressError: if the lock is held by someone else
+    """
+
+    backend = settings.PAYOUT_LOCK_BACKEND
+    if not backend:
+        yield
+    elif backend == "database" and connection.vendor == "postgresql":
+        with database_lock(name):
+            yield
+    else:
+        with cache_lock(name):
+            yield
+
+
+@contextmanager
+def address_lock(destination_address):
+    """Makes sure only one payout to an address is in flight at a time.
+
+    The lock is held per network.
+
+    :param destination_address: the address to pay to
+    :raises PayoutInProgressError: if a payout to the address is in flight
+    """
+
+    name = networks.cache_key(
+        "payout:" + tools.hash_value(destination_address)
+    )
+    with payout_lock(name):
+        yield
+
+
+@contextmanager
+def ip_lock(ip_address_hash):
+    """Makes sure only one payout to an IP address (hash) is in flight at a
+    time, so concurrent requests cannot all pass the per IP quota.
+
+    The lock is held per network. No lock is taken without a hash or if the
+    quota is disabled (settings.IP_HASH_RATE_PER_DAY is 0), so clients
+    behind the same proxy are not rejected for no reason.
+
+    :param ip_address_hash: the client's IP address hash (see tools.hash_ip)
+    :raises PayoutInProgressError: if a payout to the IP address is in flight
+    """
+
+    if not settings.IP_HASH_RATE_PER_DAY or not ip_address_hash:
+        yield
+        return
+    with payout_lock(networks.cache_key("ip:" + ip_address_hash)):
+        yield
+
+
+@contextmanager
+def withdrawal_lock(destination_address, ip_address_hash):
+    """Holds the address_lock() and the ip_lock() of a withdrawal.
+
+    Both quotas are checked and the transaction is inserted while holding
+    them. The locks are always taken in this order.
+
+    :raises PayoutInProgressError: if a payout to the address or the IP
+        address is in flight
+    """
+
+    with address_lock(destination_address):
+        with ip_lock(ip_address_hash):
+            yield
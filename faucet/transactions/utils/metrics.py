@@ -0,0 +1,160 @@
+"""Prometheus metrics of the faucet.
+
+In order to aggregate the metrics of all uWSGI workers, the environment
+variable prometheus_multiproc_dir has to point to an empty directory
+before the workers are started.
+"""
+
+import os
+import time
+import logging
+
+from django.core.cache import cache
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import multiprocess
+
+from ratelimit.exceptions import Ratelimited
+from rest_framework.exceptions import ValidationError
+
+from ..exceptions import (
+    RatelimitedByIPError,
+    RatelimitedByWithdrawalsError,
+    PayoutInProgressError,
+    MakeTransactionError,
+    GetBalanceError,
+    GetAmountError,
+    RpcConnectionError,
+)
+from . import networks, tools
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# transfers may take minutes
+RPC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+RPC_DURATION = Histogram(
+    "faucet_rpc_duration_seconds",
+    "Duration of wallet/daemon RPC calls (including retries).",
+    ["method"],
+    buckets=RPC_BUCKETS,
+)
+RPC_ERRORS = Counter(
+    "faucet_rpc_errors_total", "Failed wallet/daemon RPC attempts.", ["method"]
+)
+REQUEST_DURATION = Histogram(
+    "faucet_request_duration_seconds",
+    "Duration of HTTP requests.",
+    ["view", "method", "status"],
+    buckets=RPC_BUCKETS,
+)
+PAYOUTS = Counter(
+    "faucet_payouts_total", "Payouts by their status.", ["status"]
+)
+PAYOUT_AMOUNT = Counter("faucet_payout_amount_xmr_total", "XMR sent to users.")
+REJECTIONS = Counter(
+    "faucet_rejections_total", "Rejected withdrawals by reason.", ["reason"]
+)
+WITHDRAWAL_CHECK_DURATION = Histogram(
+    "faucet_withdrawal_check_duration_seconds",
+    "Duration of the withdrawal quota checks.",
+    ["backend"],
+)
+
+# exception -> reason of REJECTIONS
+REJECTION_REASONS = (
+    ((Ratelimited, RatelimitedByIPError), "ratelimit"),
+    ((RatelimitedByWithdrawalsError,), "withdrawals"),
+    ((ValidationError,), "validation"),
+    ((PayoutInProgressError,), "in_progress"),
+    (
+        (
+            MakeTransactionError,
+            GetBalanceError,
+            GetAmountError,
+            RpcConnectionError,
+        ),
+        "rpc",
+    ),
+)
+
+
+def reject(exception):
+    """Counts a rejected request by the reason of the given exception.
+
+    :param exception: the exception raised by the view
+    """
+
+    for exceptions, reason in REJECTION_REASONS:
+        if isinstance(exception, exceptions):
+            REJECTIONS.labels(reason=reason).inc()
+            return
+
+
+def payout(status, amount=0):
+    """Counts a payout.
+
+    :param status: Transaction status (pending, sent, failed)
+    :param amount: the amount sent in XMR format
+    """
+
+    PAYOUTS.labels(status=status).inc()
+    if amount:
+        PAYOUT_AMOUNT.inc(float(tools.xmr_to_float(amount)))
+
+
+class BalanceCollector:
+    """Reports the cached wallet balance of every network at scrape time.
+
+    The DEFAULT network is labeled "default".
+    """
+
+    def collect(self):
+        # avoid a circular import (wallet_rpc uses the RPC metrics)
+        from .wallet_rpc import BALANCE_CACHE_KEY
+
+        balance = GaugeMetricFamily(
+            "faucet_cached_balance_xmr",
+            "Cached unlocked wallet balance.",
+            labels=["network"],
+        )
+        age = GaugeMetricFamily(
+            "faucet_cached_balance_age_seconds",
+            "Age of the cached balance.",
+            labels=["network"],
+        )
+        for network in networks.served():
+            with networks.using(network):
+                entry = cache.get(networks.cache_key(BALANCE_CACHE_KEY))
+            if entry is None:
+                continue
+            label = [network or "default"]
+            balance.add_metric(
+                label, float(tools.xmr_to_float(entry["balance"]))
+            )
+            age.add_metric(label, time.time() - entry["fetched_at"])
+        yield balance
+        yield age
+
+
+def generate():
+    """Returns the metrics of all workers in the text format.
+    """
+
+    if os.environ.get("prometheus_multiproc_dir"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    balance = CollectorRegistry()
+    balance.register(BalanceCollector())
+    return generate_latest(registry) + generate_latest(balance)
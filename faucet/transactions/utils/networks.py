@@ -0,0 +1,128 @@
+"""Monero networks served by the faucet.
+
+Every network in settings.NETWORKS is served at /<network>/ with its own
+wallet and daemon. The network of the current request is active in its
+thread; wallet clients, cache keys, rate limits and the stored transactions
+follow it. The routes without a network prefix serve the wallet and daemon
+of settings.WALLET_HOST/DAEMON_HOST (the DEFAULT network).
+"""
+
+import functools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT = ""
+
+# settings which are configured per network
+NETWORK_SETTINGS = (
+    "WALLET_HOST",
+    "WALLET_PORT",
+    "WALLET_BACKENDS",
+    "DAEMON_HOST",
+    "DAEMON_PORT",
+)
+
+_local = threading.local()
+
+
+def served():
+    """Returns the DEFAULT network and the networks of settings.NETWORKS.
+    """
+
+    return [DEFAULT] + list(settings.NETWORKS)
+
+
+def active():
+    """Returns the network of this thread's request.
+    """
+
+    return getattr(_local, "network", DEFAULT)
+
+
+def activate(network):
+    if network != DEFAULT and network not in settings.NETWORKS:
+        raise ValueError("Unknown network: {}".format(network))
+    _local.network = network
+
+
+def deactivate():
+    _local.network = DEFAULT
+
+
+@contextmanager
+def using(network):
+    """Activates a network within this block.
+
+    :param network: name of the network
+    """
+
+    previous = active()
+    activate(network)
+    try:
+        yield
+    finally:
+        _local.network = previous
+
+
+def bind(function):
+    """Returns a function calling function within the active network.
+
+    For functions running in other threads (e.g. background refreshes).
+    """
+
+    network = active()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with using(network):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def setting(name):
+    """Returns a setting (of NETWORK_SETTINGS) of the active network.
+    """
+
+    network = active()
+    if network == DEFAULT:
+        return getattr(settings, name)
+    return settings.NETWORKS[network][name]
+
+
+def cache_key(key):
+    """Returns the cache key of a value kept per network.
+    """
+
+    network = active()
+    if network == DEFAULT:
+        return key
+    return "{0}:{1}".format(network, key)
+
+
+class NetworkConverter:
+    """Path converter matching the names of settings.NETWORKS.
+    """
+
+    regex = "[a-z0-9_-]+"
+
+    def to_python(self, value):
+        if value not in settings.NETWORKS:
+            # no match
+            raise ValueError(value)
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+def endpoint():
+    """Returns the URL prefix of the active network's API.
+    """
+
+    network = active()
+    if network == DEFAULT:
+        return settings.MONERO_ENDPOINT
+    return "{0}/{1}/".format(settings.MONERO_ENDPOINT.rstrip("/"), network)
@@ -0,0 +1,201 @@
+"""Splitting of a wallet's outputs into payout sized ones.
+
+Every payout spends at least one output and the change is locked for 10
+blocks. With a few large outputs, most of the balance is locked after a
+few payouts. Outputs of about the size of a payout are created in advance
+with transfers to the wallet's own address, so that every payout spends one
+of them and the change is negligible.
+"""
+
+import logging
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from monerorpc.authproxy import JSONRPCException
+
+from ..exceptions import RpcConnectionError
+from . import backends, locks, tools
+from .rpc_client import get_client
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# a transaction has at most 16 outputs, one of them is the change
+MAX_DESTINATIONS = 15
+# outputs are a bit larger than a payout, to cover its fee
+SIZE_HEADROOM = 1.1
+
+
+def call(backend, method, params=None):
+    """Calls an RPC method of a wallet backend.
+
+    :raises RpcConnectionError: in case of a connection or RPC error
+    """
+
+    try:
+        return get_client(*backends.address(backend)).call(method, params)
+    except (
+        requests.HTTPError,
+        requests.ConnectionError,
+        requests.Timeout,
+        JSONRPCException,
+    ) as e:
+        logger.error("RPC Error on {0}: {1}".format(method, str(e)))
+        raise RpcConnectionError(str(e))
+
+
+def get_outputs(backend):
+    """Returns the unspent outputs of a wallet backend.
+
+    :param backend: "host:port" of the wallet
+    :returns: list of dicts with "amount" and "unlocked"
+    :raises RpcConnectionError: in case of a connection or RPC error
+    """
+
+    result = call(
+        backend, "incoming_transfers", {"transfer_type": "available"}
+    )
+    return [
+        {"amount": t["amount"], "unlocked": t.get("unlocked", True)}
+        for t in result.get("transfers", list())
+        if not t.get("spent", False)
+    ]
+
+
+def output_size(balance):
+    """Returns the size of the outputs to create.
+
+    :param balance: the available balance in XMR format
+    :returns: the size of a payout (see wallet_rpc.payout_amount()) with
+        some headroom, in XMR format
+    """
+
+    payout = min(
+        tools.float_to_xmr(settings.MAXIMUM_PAYOUT),
+        balance // settings.FACTOR_BALANCE,
+    )
+    return int(payout * SIZE_HEADROOM)
+
+
+def plan(outputs, size, target):
+    """Returns the number of outputs to create.
+
+    Outputs of at least size count as spendable, even if they are still
+    locked (they are unlocked within 10 blocks). New outputs are paid by
+    unlocked outputs of at least twice the size.
+
+    :param outputs: list of dicts with "amount" and "unlocked"
+    :param size: size of the outputs to create in XMR format
+    :param target: number of spendable outputs to aim for
+    :returns: number of outputs of the given size to create
+    """
+
+    if size <= 0:
+        return 0
+    spendable = sum(1 for o in outputs if o["amount"] >= size)
+    missing = target - spendable
+    # splitting an output replaces it with amount // size outputs
+    affordable = sum(
+        o["amount"] // size - 1
+        for o in outputs
+        if o["unlocked"] and o["amount"] >= 2 * size
+    )
+    return max(0, min(missing, affordable))
+
+
+def split(backend, count, size):
+    """Creates outputs by transfers to the wallet's own address.
+
+    Stops at the first failed transfer (e.g. if the remaining unlocked
+    outputs are too small).
+
+    :param backend: "host:port" of the wallet
+    :param count: number of outputs to create
+    :param size: size of the outputs in XMR format
+    :returns: number of created outputs
+    """
+
+    address = call(backend, "get_address")["address"]
+    created = 0
+    while created < count:
+        destinations = min(MAX_DESTINATIONS, count - created)
+        params = {
+            "destinations": [{"address": address, "amount": size}]
+            * destinations,
+            "mixin": settings.DEFAULT_MIXIN,
+        }
+        try:
+            result = call(backend, "transfer_split", params)
+        except RpcConnectionError as e:
+            logger.warning(
+                "Splitting outputs of {0} stopped: {1}".format(backend, e)
+            )
+            break
+        logger.info(
+            "Created {0} outputs on {1}: {2}".format(
+                destinations, backend, result.get("tx_hash_list")
+            )
+        )
+        created += destinations
+    return created
+
+
+def busy_timeout(count):
+    """Returns the seconds a backend is marked busy while outputs are split.
+
+    :param count: number of outputs to create
+    :returns: the timeout of all transfers (and getting the address)
+    """
+
+    transfers = -(-count // MAX_DESTINATIONS)
+    return transfers * sum(settings.RPC_TIMEOUTS["transfer_split"]) + sum(
+        settings.RPC_TIMEOUTS["default"]
+    )
+
+
+def split_outputs(target, size=None, dry_run=False):
+    """Splits the outputs of all wallet backends of the active network.
+
+    Backends, which are busy sending a payout, are skipped. While outputs
+    are split, a backend is marked busy, so payouts go to other backends.
+
+    :param target: number of spendable outputs to aim for per backend
+    :param size: size of the outputs in XMR format (default: output_size())
+    :param dry_run: only report the plan
+    :returns: dict of backend and report ("outputs", "unlocked", "size",
+        "planned", "created", or "error")
+    """
+
+    reports = dict()
+    for backend in backends.wallet_backends():
+        try:
+            outputs = get_outputs(backend)
+        except RpcConnectionError as e:
+            reports[backend] = {"error": str(e)}
+            continue
+        unlocked = sum(o["amount"] for o in outputs if o["unlocked"])
+        backend_size = size or output_size(unlocked)
+        report = {
+            "outputs": len(outputs),
+            "unlocked": unlocked,
+            "size": backend_size,
+            "planned": plan(outputs, backend_size, target),
+            "created": 0,
+        }
+        reports[backend] = report
+        if dry_run or not report["planned"]:
+            continue
+
+        busy = backends.state_key(backend, "busy")
+        token = locks.acquire(busy, busy_timeout(report["planned"]))
+        if token is None:
+            report["error"] = "busy"
+            continue
+        try:
+            report["created"] = split(backend, report["planned"], backend_size)
+        finally:
+            cache.delete(backends.state_key(backend, "balance"))
+            locks.release(busy, token)
+    return reports
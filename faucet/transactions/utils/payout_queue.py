@@ -0,0 +1,250 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Transaction, TransactionHash
+from ..exceptions import RpcConnectionError, TransferStateUnknownError
+from . import backends, metrics, networks
+from .batch import is_integrated_address
+from .wallet_rpc import WalletRPC
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# seconds the wallet's clock may be behind
+CLOCK_SKEW = 300
+
+
+def claim_pending(limit):
+    """Claims pending payouts for this worker.
+
+    A payout is claimed by switching its status from pending to sending.
+    The conditional update makes sure, that only one worker claims it.
+    Payouts, which are still sending after settings.PAYOUT_SENDING_TIMEOUT
+    (e.g. the worker died), are reconciled by reconcile().
+
+    :param limit: maximum number of payouts to claim
+    :returns: list of claimed transactions (oldest first)
+    """
+
+    candidates = (
+        Transaction.objects.filter(status=Transaction.PENDING)
+        .order_by("id")
+        .values_list("id", flat=True)[:limit]
+    )
+    claimed = [
+        pk
+        for pk in candidates
+        if Transaction.objects.filter(
+            pk=pk, status=Transaction.PENDING
+        ).update(status=Transaction.SENDING, claimed_at=timezone.now())
+    ]
+    return list(Transaction.objects.filter(pk__in=claimed).order_by("id"))
+
+
+def group_payouts(payouts):
+    """Splits payouts into groups that can be sent within one transfer.
+
+    A transaction can only contain one payment id, so every group
+    contains at most one integrated address. Payouts of different networks
+    are never grouped.
+
+    :param payouts: list of transactions
+    :returns: list of lists of transactions
+    """
+
+    groups = list()
+    group = list()
+    for payout in sorted(payouts, key=lambda p: (p.network, p.id)):
+        if group and group[0].network != payout.network:
+            groups.append(group)
+            group = list()
+        if is_integrated_address(payout.destination_address) and any(
+            is_integrated_address(p.destination_address) for p in group
+        ):
+            groups.append(group)
+            group = list()
+        group.append(payout)
+    if group:
+        groups.append(group)
+    return groups
+
+
+def send_payouts(payouts):
+    """Sends the given claimed payouts within one transfer.
+
+    Payouts, which may have been sent although the transfer failed (e.g. it
+    timed out), are marked unknown, so they still count towards the
+    withdrawal quotas and the ledger until reconcile() resolved them.
+
+    :param payouts: list of transactions (of one network) in state sending
+    :returns: True if the payouts were sent, False otherwise
+    """
+
+    try:
+        with networks.using(payouts[0].network):
+            transactions = WalletRPC.make_transactions(
+                [
+                    {"address": p.destination_address, "amount": p.amount}
+                    for p in payouts
+                ]
+            )
+    except TransferStateUnknownError as e:
+        logger.error("Payout state unknown: {}".format(str(e)))
+        mark(payouts, Transaction.UNKNOWN)
+        return False
+    except (ValueError, RpcConnectionError) as e:
+        logger.error("Payout failed: {}".format(str(e)))
+        mark(payouts, Transaction.FAILED)
+        return False
+
+    for payout, transaction in zip(payouts, transactions):
+        mark_sent(
+            payout,
+            transaction["transaction_id"],
+            transaction.get("wallet_backend", ""),
+        )
+        logger.info("store tx {}".format(transaction))
+    return True
+
+
+def mark(payouts, status):
+    """Sets the status of payouts, which were not sent.
+    """
+
+    Transaction.objects.filter(pk__in=[p.pk for p in payouts]).update(
+        status=status
+    )
+    for _ in payouts:
+        metrics.payout(status)
+
+
+def mark_sent(payout, transaction_id, wallet_backend):
+    payout.transaction_id = transaction_id
+    payout.wallet_backend = wallet_backend
+    payout.status = Transaction.SENT
+    payout.sent_at = timezone.now()
+    payout.save(
+        update_fields=["transaction_id", "wallet_backend", "status", "sent_at"]
+    )
+    metrics.payout(Transaction.SENT, payout.amount)
+
+
+def find_transfer(payout, transfers, used):
+    """Returns the wallet's transfer, that paid a payout.
+
+    :param payout: the transaction
+    :param transfers: dict of backend and its outgoing transfers
+    :param used: set of (tx hash, address), which belong to other payouts
+    :returns: (backend, tx hash) or None if not found
+    """
+
+    started = payout.claimed_at or payout.timestamp
+    since = started.timestamp() - CLOCK_SKEW
+    for backend, backend_transfers in transfers.items():
+        for transfer in backend_transfers:
+            key = (transfer["txid"], payout.destination_address)
+            if transfer.get("timestamp", 0) < since or key in used:
+                continue
+            for destination in transfer.get("destinations", list()):
+                if (
+                    destination["address"] == payout.destination_address
+                    and destination["amount"] == payout.amount
+                ):
+                    return backend, transfer["txid"]
+    return None
+
+
+def resolve(payouts, transfers):
+    """Marks payouts of unknown state as sent or failed.
+
+    :param payouts: list of transactions (of one network)
+    :param transfers: dict of backend and its outgoing transfers
+    """
+
+    tx_hashes = set(
+        transfer["txid"]
+        for backend_transfers in transfers.values()
+        for transfer in backend_transfers
+    )
+    # transfers of payouts, which are known already
+    used = set(
+        TransactionHash.objects.filter(tx_hash__in=tx_hashes)
+        .exclude(transaction__status=Transaction.UNKNOWN)
+        .values_list("tx_hash", "transaction__destination_address")
+    )
+    for payout in payouts:
+        found = find_transfer(payout, transfers, used)
+        if found is None:
+            logger.warning("Payout {} was not sent".format(payout.pk))
+            mark([payout], Transaction.FAILED)
+            continue
+        backend, tx_hash = found
+        used.add((tx_hash, payout.destination_address))
+        logger.info("Payout {0} was sent: {1}".format(payout.pk, tx_hash))
+        mark_sent(payout, tx_hash, backend)
+
+
+def reconcile(timeout=None):
+    """Resolves payouts, whose transfers were interrupted.
+
+    Payouts, which are still sending after timeout seconds (their worker
+    died), are marked unknown. Payouts of unknown state are looked up in
+    the outgoing transfers of their network's wallets, once their transfer
+    was started timeout seconds ago (so the wallet finished it): they are
+    marked sent if found, failed otherwise.
+
+    :param timeout: seconds, defaults to settings.PAYOUT_SENDING_TIMEOUT
+    :returns: number of resolved payouts
+    """
+
+    if timeout is None:
+        timeout = settings.PAYOUT_SENDING_TIMEOUT
+    deadline = timezone.now() - datetime.timedelta(seconds=timeout)
+    started_before = Q(claimed_at__lt=deadline) | Q(
+        claimed_at=None, timestamp__lt=deadline
+    )
+    interrupted = Transaction.objects.filter(
+        started_before, status=Transaction.SENDING
+    ).update(status=Transaction.UNKNOWN)
+    if interrupted:
+        logger.warning("{} payouts were interrupted".format(interrupted))
+
+    payouts = list(
+        Transaction.objects.filter(
+            started_before, status=Transaction.UNKNOWN
+        ).order_by("id")
+    )
+    for network in sorted(set(p.network for p in payouts)):
+        with networks.using(network):
+            try:
+                transfers = {
+                    backend: WalletRPC.get_outgoing_transfers(backend)
+                    for backend in backends.wallet_backends()
+                }
+            except (ValueError, RpcConnectionError) as e:
+                logger.error("Could not reconcile payouts: " + str(e))
+                payouts = [p for p in payouts if p.network != network]
+                continue
+        resolve([p for p in payouts if p.network == network], transfers)
+    return len(payouts)
+
+
+def process_pending():
+    """Sends one round of pending payouts.
+
+    If batching is enabled, up to settings.PAYOUT_BATCH_SIZE payouts
+    are sent within a single transfer.
+
+    :returns: number of processed payouts
+    """
+
+    limit = settings.PAYOUT_BATCH_SIZE if settings.PAYOUT_BATCH_ENABLE else 1
+    payouts = claim_pending(limit)
+    for group in group_payouts(payouts):
+        send_payouts(group)
+    return len(payouts)
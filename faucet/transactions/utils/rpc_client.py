@@ -0,0 +1,221 @@
+import os
+import random
+import threading
+import time
+import logging
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from django.conf import settings
+
+from monerorpc.authproxy import AuthServiceProxy, JSONRPCException
+
+from . import metrics, timing, networks, backends
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# RPC methods that can safely be sent again
+# Never add methods which spend funds (transfer, transfer_split, ...)
+IDEMPOTENT_METHODS = frozenset(
+    [
+        "getbalance",
+        "get_address",
+        "get_info",
+        "get_version",
+        "get_height",
+        "get_transfers",
+        "get_transfer_by_txid",
+        "incoming_transfers",
+    ]
+)
+
+# error codes AuthServiceProxy uses for connection problems
+# -341: no connection, -342: no HTTP response, -344: bad HTTP status code
+TRANSIENT_ERROR_CODES = (-341, -342, -344)
+
+
+def is_transient(error):
+    """Checks whether an RPC error is worth another attempt.
+
+    :param error: the exception raised by the RPC call
+    :returns: True if the error is a connection problem, False otherwise
+    """
+
+    if isinstance(error, JSONRPCException):
+        return error.code in TRANSIENT_ERROR_CODES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def was_not_sent(error):
+    """Checks whether a failed RPC call was certainly not executed.
+
+    That is, if no connection could be established or the RPC server
+    answered with an error. Timeouts and connections lost after sending the
+    request are ambiguous, the server may still execute the call.
+
+    :param error: the exception raised by the RPC call
+    :returns: True if the call was not executed, False if it may have been
+    """
+
+    if isinstance(error, JSONRPCException):
+        if error.code == -341:
+            if not isinstance(error.__context__, requests.ConnectionError):
+                # AsyncRpcClient could not connect
+                return True
+            # AuthServiceProxy wraps the requests.ConnectionError
+            error = error.__context__
+        elif error.code in TRANSIENT_ERROR_CODES or error.code == -343:
+            return False
+        else:
+            # answered by the RPC server
+            return True
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0] if error.args else None, "reason", None)
+        # also covers refused connections (NewConnectionError)
+        return isinstance(reason, ConnectTimeoutError)
+    return False
+
+
+def get_timeout(method):
+    """Returns the (connect, read) timeout to use for an RPC method.
+
+    :param method: RPC method name
+    :returns: tuple of connect and read timeout in seconds
+    """
+
+    return settings.RPC_TIMEOUTS.get(method, settings.RPC_TIMEOUTS["default"])
+
+
+class RpcClient:
+    """JSON-RPC client to monero-wallet-rpc or monerod.
+
+    Keeps a pooled keep-alive HTTP session, applies per method timeouts,
+    retries idempotent calls on connection errors and counts calls.
+    """
+
+    def __init__(self, host, port):
+        self.url = "http://{0}:{1}/json_rpc".format(host, port)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.RPC_POOL_SIZE
+        )
+        self.session.mount("http://", adapter)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.retries = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, method, params=None):
+        """Calls an RPC method.
+
+        Idempotent methods are retried settings.RPC_RETRIES times on
+        connection errors, waiting a random (jittered) exponential backoff.
+
+        :param method: RPC method name
+        :param params: optional dict of parameters
+        :returns: the RPC's result
+        :raises JSONRPCException: the RPC returned an error
+        :raises requests.RequestException: in case of a connection error
+        """
+
+        with metrics.RPC_DURATION.labels(method=method).time():
+            with timing.phase("rpc_" + method):
+                return self._call(method, params)
+
+    def _call(self, method, params):
+        attempts = 1
+        if method in IDEMPOTENT_METHODS:
+            attempts += settings.RPC_RETRIES
+
+        for attempt in range(attempts):
+            self._count(self.calls, method)
+            proxy = AuthServiceProxy(
+                self.url,
+                service_name=method,
+                timeout=get_timeout(method),
+                connection=self.session,
+            )
+            try:
+                if params is None:
+                    return proxy()
+                return proxy(params)
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                JSONRPCException,
+            ) as e:
+                self._count(self.errors, method)
+                metrics.RPC_ERRORS.labels(method=method).inc()
+                if attempt + 1 >= attempts or not is_transient(e):
+                    raise
+                self._count(self.retries, method)
+                backoff = settings.RPC_RETRY_BACKOFF * (2 ** attempt)
+                logger.warning(
+                    "Retrying {0} in up to {1}s: {2}".format(
+                        method, backoff, str(e)
+                    )
+                )
+                time.sleep(random.uniform(0, backoff))
+
+    def stats(self):
+        """Returns the counters of this client.
+        """
+
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "retries": dict(self.retries),
+            }
+
+    def _count(self, counter, method):
+        with self._lock:
+            counter[method] += 1
+
+
+_clients = dict()
+_clients_lock = threading.Lock()
+_clients_pid = None
+
+
+def get_client(host, port):
+    """Returns the process wide client for the given RPC server.
+
+    Clients are not shared between forked processes (uWSGI workers),
+    since they would share the same sockets.
+
+    :param host: RPC host
+    :param port: RPC port
+    :returns: RpcClient
+    """
+
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        key = (host, port)
+        if key not in _clients:
+            _clients[key] = RpcClient(host, port)
+        return _clients[key]
+
+
+def get_wallet_client():
+    """Returns the client to the active network's (first) monero-wallet-rpc.
+    """
+
+    return get_client(*backends.address(backends.wallet_backends()[0]))
+
+
+def get_daemon_client():
+    """Returns the client to the active network's monerod.
+    """
+
+    return get_client(
+        networks.setting("DAEMON_HOST"), networks.setting("DAEMON_PORT")
+    )
@@ -0,0 +1,168 @@
+"""Daily payout statistics.
+
+The rollup (DailyPayoutStats) is kept per day and network and updated
+incrementally: only the days of the transactions added since the last
+update are recomputed, each from the transactions of its day and network
+(using the timestamp index).
+
+It is updated by the process_payouts and reconcile_payouts workers after
+every round (and filled by the backfill_stats command), /stats only reads
+it.
+"""
+
+import datetime
+import logging
+
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from ..models import DailyPayoutStats, Transaction
+from . import networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# statuses which may still change
+OPEN_STATUSES = (Transaction.PENDING, Transaction.SENDING, Transaction.UNKNOWN)
+
+
+def day_range(day):
+    """Returns the (start, end) of a day in UTC.
+    """
+
+    start = datetime.datetime.combine(day, datetime.time(tzinfo=timezone.utc))
+    return start, start + datetime.timedelta(days=1)
+
+
+def compute(day, network):
+    """Aggregates the transactions of a day.
+
+    :param day: date
+    :param network: network of the transactions
+    :returns: dict of the DailyPayoutStats fields
+    """
+
+    start, end = day_range(day)
+    sent = Q(status=Transaction.SENT)
+    values = Transaction.objects.filter(
+        timestamp__gte=start, timestamp__lt=end, network=network
+    ).aggregate(
+        payouts=Count("id", filter=sent),
+        failed=Count("id", filter=Q(status=Transaction.FAILED)),
+        amount=Sum("amount", filter=sent),
+        unique_addresses=Count(
+            "destination_address", distinct=True, filter=sent
+        ),
+        unique_ip_hashes=Count("ip_address_hash", distinct=True, filter=sent),
+    )
+    values["amount"] = values["amount"] or 0
+    return values
+
+
+def cursor():
+    """Returns the id up to which all transactions are in the rollup.
+    """
+
+    return (
+        DailyPayoutStats.objects.aggregate(last=Max("last_transaction_id"))[
+            "last"
+        ]
+        or 0
+    )
+
+
+def next_cursor(transactions):
+    """Returns the id up to which the given transactions are final.
+
+    Queued payouts are counted again once they are sent (or failed).
+
+    :param transactions: Transaction queryset
+    """
+
+    values = transactions.aggregate(
+        last=Max("id"),
+        first_open=Min("id", filter=Q(status__in=OPEN_STATUSES)),
+    )
+    if values["first_open"] is not None:
+        return values["first_open"] - 1
+    return values["last"]
+
+
+def refresh(transactions, last_transaction_id):
+    """Recomputes the rollup of the days and networks of the transactions.
+
+    :param transactions: Transaction queryset
+    :param last_transaction_id: cursor stored with the days
+    :returns: number of recomputed days (per network)
+    """
+
+    count = 0
+    for network in (
+        transactions.order_by("network")
+        .values_list("network", flat=True)
+        .distinct()
+    ):
+        for day in days_of(transactions.filter(network=network)):
+            values = compute(day, network)
+            values["last_transaction_id"] = last_transaction_id
+            DailyPayoutStats.objects.update_or_create(
+                day=day, network=network, defaults=values
+            )
+            count += 1
+    return count
+
+
+def days_of(transactions):
+    return [
+        timestamp.date()
+        for timestamp in transactions.datetimes(
+            "timestamp", "day", tzinfo=timezone.utc
+        )
+    ]
+
+
+def update():
+    """Recomputes the days of the transactions added since the last update.
+
+    :returns: number of recomputed days (per network)
+    """
+
+    new = Transaction.objects.filter(id__gt=cursor())
+    last_transaction_id = next_cursor(new)
+    if last_transaction_id is None:
+        return 0
+    return refresh(new, last_transaction_id)
+
+
+def backfill(since=None):
+    """Recomputes all days (with transactions) since the given day.
+
+    :param since: date, defaults to the first transaction's day
+    :returns: number of recomputed days (per network)
+    """
+
+    transactions = Transaction.objects.all()
+    last_transaction_id = next_cursor(transactions)
+    if last_transaction_id is None:
+        return 0
+    if since is not None:
+        transactions = transactions.filter(timestamp__gte=day_range(since)[0])
+    days = refresh(transactions, last_transaction_id)
+    logger.info("Recomputed {} days".format(days))
+    return days
+
+
+def daily(days):
+    """Returns the rollup of the active network's last days, newest first.
+
+    :param days: number of days
+    :returns: list of DailyPayoutStats
+    """
+
+    first = timezone.now().date() - datetime.timedelta(days=days - 1)
+    return list(
+        DailyPayoutStats.objects.filter(
+            day__gte=first, network=networks.active()
+        ).order_by("-day")
+    )
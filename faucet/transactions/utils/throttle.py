@@ -0,0 +1,108 @@
+import ipaddress
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import networks
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# seconds to wait for a bucket's lock, before using it unlocked
+LOCK_WAIT = 0.2
+LOCK_POLL_INTERVAL = 0.01
+
+
+def is_trusted_proxy(ip_address):
+    """Checks whether the given IP address belongs to a trusted proxy.
+
+    :param ip_address: IP address of the peer
+    :returns: True if it is part of settings.TRUSTED_PROXIES
+    """
+
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return False
+    return any(
+        ip in ipaddress.ip_network(network, strict=False)
+        for network in settings.TRUSTED_PROXIES
+    )
+
+
+def subnet(ip_address):
+    """Returns the subnet the given IP address is limited as part of.
+
+    IPv6 addresses are aggregated by settings.IPV6_PREFIX (a /64 is usually
+    given to a single customer), IPv4 addresses by settings.IPV4_PREFIX.
+
+    :param ip_address: the client's IP address
+    :returns: the subnet in CIDR notation
+    """
+
+    ip = ipaddress.ip_address(ip_address)
+    prefix = settings.IPV6_PREFIX if ip.version == 6 else settings.IPV4_PREFIX
+    return str(
+        ipaddress.ip_network("{0}/{1}".format(ip, prefix), strict=False)
+    )
+
+
+def take_token(key, capacity, rate):
+    """Takes a token from the bucket stored in the cache under key.
+
+    :param key: cache key of the bucket
+    :param capacity: maximum number of tokens (burst)
+    :param rate: tokens added per second
+    :returns: True if a token was taken, False if the bucket is empty
+    """
+
+    lock_key = key + ":lock"
+    deadline = time.time() + LOCK_WAIT
+    locked = cache.add(lock_key, True, 5)
+    while not locked and time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        locked = cache.add(lock_key, True, 5)
+    if not locked:
+        logger.warning("Using bucket {} without lock".format(key))
+
+    try:
+        now = time.time()
+        bucket = cache.get(key) or {"tokens": capacity, "updated": now}
+        tokens = min(
+            capacity, bucket["tokens"] + (now - bucket["updated"]) * rate
+        )
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # a full bucket does not need to be stored
+        timeout = int((capacity - tokens) / rate) + 1
+        cache.set(key, {"tokens": tokens, "updated": now}, timeout)
+        return allowed
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def is_limited(ip_address):
+    """Checks the token bucket of the client's subnet.
+
+    Every settings.ONCE_EVERY_N_MINUTE minutes a token is added, up to
+    settings.TOKEN_BUCKET_CAPACITY tokens. Each request takes one.
+
+    :param ip_address: the client's IP address
+    :returns: True if the request is to be blocked, False otherwise
+    """
+
+    try:
+        key = networks.cache_key("throttle:" + subnet(ip_address))
+    except ValueError:
+        logger.warning("Invalid client IP: {}".format(ip_address))
+        return True
+    return not take_token(
+        key,
+        capacity=settings.TOKEN_BUCKET_CAPACITY,
+        rate=1.0 / (settings.ONCE_EVERY_N_MINUTE * 60),
+    )
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+_local = threading.local()
+
+
+class Timer:
+    """Durations of the phases of a request.
+
+    Phases may be nested (e.g. "db" within "withdrawal_check"), a phase
+    entered several times is summed up.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = OrderedDict()
+
+    def add(self, name, duration):
+        entry = self.phases.setdefault(name, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Returns the phases' durations (ms) and counts.
+        """
+
+        return OrderedDict(
+            (name, {"ms": round(duration * 1000, 3), "count": count})
+            for name, (duration, count) in self.phases.items()
+        )
+
+    def header(self):
+        """Returns the value of the Server-Timing header.
+        """
+
+        metrics = [
+            '{0};dur={1:.3f};desc="{2}x"'.format(name, duration * 1000, count)
+            for name, (duration, count) in self.phases.items()
+        ]
+        metrics.append("total;dur={0:.3f}".format(self.total() * 1000))
+        return ", ".join(metrics)
+
+
+def sampled():
+    """Decides whether the current request is to be timed.
+
+    :returns: True for a share of settings.SERVER_TIMING_SAMPLE_RATE
+    """
+
+    rate = settings.SERVER_TIMING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def start():
+    """Starts timing the phases of this thread's request.
+
+    :returns: Timer
+    """
+
+    _local.timer = Timer()
+    return _local.timer
+
+
+def stop():
+    _local.timer = None
+
+
+def current():
+    """Returns the Timer of this thread's request, None if not timed.
+    """
+
+    return getattr(_local, "timer", None)
+
+
+@contextmanager
+def phase(name):
+    """Measures a phase of the current request (if it is timed).
+
+    Can be used as decorator, too.
+
+    :param name: name of the phase (a token, e.g. "rpc_getbalance")
+    """
+
+    timer = current()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def database_wrapper(execute, sql, params, many, context):
+    """Execute wrapper measuring the database queries.
+    """
+
+    with phase("db"):
+        return execute(sql, params, many, context)
@@ -1,13 +1,15 @@
 import os
 import binascii
 import hashlib
+import hmac
 from decimal import Decimal
 import datetime
 import logging
 
 from django.conf import settings
-from django.db.models import Count
+from django.utils import timezone
 from ..models import Transaction
+from . import networks, throttle
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -59,30 +61,84 @@ def hash_value(value):
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
 
 
+def hash_ip(ip_address):
+    """Returns the keyed hash of an IP address.
+
+    The subnet of the address (see throttle.subnet()) is hashed, so clients
+    sharing an IPv6 /64 share one per IP quota, like their token bucket.
+    HMAC-SHA256 with settings.IP_HASH_KEY, so the hashes cannot be reversed
+    by hashing all (IPv4) addresses.
+    """
+
+    try:
+        key = throttle.subnet(ip_address)
+    except ValueError:
+        key = ip_address
+    return hmac.new(
+        settings.IP_HASH_KEY.encode("utf-8"),
+        key.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def is_hash(value):
+    """Checks if a value is a hex encoded 32 byte hash.
+    """
+
+    try:
+        return len(bytes.fromhex(value)) == 32
+    except ValueError:
+        return False
+
+
 def addr_withdrew_too_often(destination_address, rate_allowed, days):
     """Block destination addresses which withdraw too often.
 
     Look back a number of days and check the allowed number of withdrawals for
     a destination address.
+    Only the given address' withdrawals are counted, using the
+    (destination_address, timestamp) index.
 
     :param rate_allowed: number of allowed withdrawals within the given days
     :param days: range of days to consider
     :returns: True if payout is blocked (number of payouts for address is above limits), false otherwise
     """
 
-    suspicious_withdrawals = (
+    withdrawals = (
+        Transaction.objects.filter(
+            destination_address=destination_address,
+            timestamp__gt=timezone.now() - datetime.timedelta(days=days),
+            network=networks.active(),
+        )
+        .exclude(status=Transaction.FAILED)
+        .count()
+    )
+
+    return withdrawals >= rate_allowed
+
+
+def ip_withdrew_too_often(ip_address_hash, rate_allowed, days):
+    """Block IP addresses which withdraw too often.
+
+    Look back a number of days and check the allowed number of withdrawals
+    from an IP address (to any destination address).
+    Only the given IP address hash' withdrawals are counted, using the
+    (ip_address_hash, timestamp) index.
+
+    :param ip_address_hash: the hashed IP address (see hash_ip())
+    :param rate_allowed: number of allowed withdrawals within the given days
+    :param days: range of days to consider
+    :returns: True if payout is blocked, False otherwise
+    """
+
+    withdrawals = (
         Transaction.objects.filter(
-            timestamp__lte=datetime.datetime.today(),
-            timestamp__gt=datetime.datetime.today()
-            - datetime.timedelta(days=days),
+            ip_address_hash=ip_address_hash,
+            timestamp__gt=timezone.now() - datetime.timedelta(days=days),
+            network=networks.active(),
         )
-        .values("destination_address")
-        .annotate(count=Count("destination_address"))
+        .exclude(status=Transaction.FAILED)
+        .count()
     )
-    suspicious_addresses = [
-        addr["destination_address"]
-        for addr in suspicious_withdrawals
-        if addr["count"] >= rate_allowed
-    ]
 
-    return destination_address in suspicious_addresses
+    return withdrawals >= rate_allowed
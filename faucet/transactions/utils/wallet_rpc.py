@@ -1,47 +1,97 @@
 from django.conf import settings
+from django.core.cache import cache
 
 import requests
 import logging
-
-from . import tools
-from ..exceptions import RpcConnectionError, GetBalanceError, GetAmountError
+import threading
+import time
+
+from . import tools, ledger, networks, backends
+from ..exceptions import (
+    RpcConnectionError,
+    TransferStateUnknownError,
+    GetBalanceError,
+    GetAmountError,
+)
+from .rpc_client import (
+    get_client,
+    get_wallet_client,
+    get_daemon_client,
+    is_transient,
+    was_not_sent,
+)
 from monerorpc.authproxy import AuthServiceProxy, JSONRPCException
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# prefixed by networks.cache_key()
+BALANCE_CACHE_KEY = "wallet:balance"
+BALANCE_LOCK_KEY = "wallet:balance:lock"
+# seconds between cache lookups while waiting for another process
+BALANCE_POLL_INTERVAL = 0.05
+
 
 class WalletRPC:
     """Interface to monero-wallet-rpc.
 
     Uses on python-monerorpc as backend.
+    Connections are shared by the process wide clients of rpc_client.
+    Calls go to the wallet (and daemon) of the active network. If it has
+    several wallet backends, payouts are routed by utils.backends and the
+    balance is their total.
     """
 
-    network_type = None
+    # per network
+    network_types = dict()
+    addresses = dict()
 
     @staticmethod
     def get_balance():
-        """Returns the current balance of the wallet.
+        """Returns the current balance of the wallet(s).
 
-        :returns: unlocked_balance if successful in XMR format
+        Wallet backends, which cannot be reached, are marked as down and
+        not counted.
+
+        :returns: total unlocked_balance if successful in XMR format
         :raises RpcConnectionError: no connection could be established
         :raises ValueError: retrieved data could not be processed
         """
 
-        # get the current balance
-        rpc_connection = AuthServiceProxy(
-            "http://{0}:{1}/json_rpc".format(
-                settings.WALLET_HOST, settings.WALLET_PORT
-            )
-        )
+        total = None
+        # raised if no backend was queried
+        error = RpcConnectionError("No wallet backend is available.")
+        for backend in backends.healthy_backends():
+            try:
+                balance = WalletRPC.get_backend_balance(backend)
+            except RpcConnectionError as e:
+                backends.mark_down(backend)
+                error = e
+                continue
+            backends.set_balance(backend, balance)
+            total = (total or 0) + balance
+        if total is None:
+            raise error
+        return total
+
+    @staticmethod
+    def get_backend_balance(backend):
+        """Returns the current balance of a wallet backend.
+
+        :param backend: "host:port" of the wallet
+        :returns: unlocked_balance if successful in XMR format
+        :raises RpcConnectionError: no connection could be established
+        :raises ValueError: retrieved data could not be processed
+        """
 
         result = None
         try:
-            result = rpc_connection.getbalance()
+            result = get_client(*backends.address(backend)).call("getbalance")
         except (
             requests.HTTPError,
             requests.ConnectionError,
+            requests.Timeout,
             JSONRPCException,
         ) as e:
             logger.error("RPC Error on getting balance" + str(e))
@@ -54,6 +104,36 @@ class WalletRPC:
 
         return balance
 
+    @staticmethod
+    def get_outgoing_transfers(backend):
+        """Returns the outgoing transfers of a wallet backend.
+
+        Including the transfers, which are not mined yet.
+
+        :param backend: "host:port" of the wallet
+        :returns: list of transfers ("txid", "timestamp", "destinations")
+        :raises RpcConnectionError: no connection could be established
+        """
+
+        params = {"out": True, "pending": True, "pool": True}
+        try:
+            result = get_client(*backends.address(backend)).call(
+                "get_transfers", params
+            )
+        except (
+            requests.HTTPError,
+            requests.ConnectionError,
+            requests.Timeout,
+            JSONRPCException,
+        ) as e:
+            logger.error("RPC Error on getting transfers" + str(e))
+            raise RpcConnectionError(str(e))
+        return [
+            transfer
+            for kind in ("out", "pending", "pool")
+            for transfer in result.get(kind, list())
+        ]
+
     @staticmethod
     def get_address():
         """Returns the current wallet's address.
@@ -63,19 +143,13 @@ class WalletRPC:
         :raises ValueError: retrieved data could not be processed
         """
 
-        # get the wallet's address
-        rpc_connection = AuthServiceProxy(
-            "http://{0}:{1}/json_rpc".format(
-                settings.WALLET_HOST, settings.WALLET_PORT
-            )
-        )
-
         result = None
         try:
-            result = rpc_connection.get_address()
+            result = get_wallet_client().call("get_address")
         except (
             requests.HTTPError,
             requests.ConnectionError,
+            requests.Timeout,
             JSONRPCException,
         ) as e:
             logger.error("RPC Error on getting address" + str(e))
@@ -89,44 +163,117 @@ class WalletRPC:
         return address
 
     @staticmethod
-    def make_transaction(destination_address, amount):
+    def make_transaction(destination_address, amount, backend=None):
         """Makes a transaction to the given address.
 
         :param destination_address: the wallet address to send XMR to
         :param amount: the amount of XMR to send
+        :param backend: the wallet backend to send from, if it is acquired
+            already (see backends.acquire())
         :returns: the complete transaction object including user's IP address
+        :raises TransferStateUnknownError: if the transfer failed, but may
+            have been sent (e.g. timed out)
         :raises RpcConnectionError: in case of a connection error to the rpc
         :raises ValueError: in case  the JSON returned is bad
         """
 
-        # send xmr to given destination_address
-        recipients = [{"address": destination_address, "amount": amount}]
+        return WalletRPC.make_transactions(
+            [{"address": destination_address, "amount": amount}], backend
+        )[0]
 
-        # transfer parameters
-        params = {"destinations": recipients, "mixin": settings.DEFAULT_MIXIN}
+    @staticmethod
+    def make_transactions(destinations, backend=None):
+        """Makes one transaction paying all the given destinations.
+
+        All destinations are sent within a single transfer_split call,
+        so they share one fee and the same list of transaction hashes.
+        At most one integrated address may be part of the destinations.
+
+        :param destinations: list of dicts with "address" and "amount"
+        :param backend: the wallet backend to send from, if it is acquired
+            already (see backends.acquire())
+        :returns: one transaction object per destination (in order)
+        :raises TransferStateUnknownError: if the transfer failed, but may
+            have been sent (e.g. timed out)
+        :raises RpcConnectionError: in case of a connection error to the rpc
+        :raises WalletBusyError: if all wallet backends are busy
+        :raises ValueError: in case  the JSON returned is bad
+        """
 
-        if len(destination_address) == 95:
-            # payment id
-            payment_id = tools.generate_xmr_payment_id_long()
-            params.update({"payment_id": payment_id})
+        params = WalletRPC.transfer_params(destinations)
+        if backend is None:
+            amount = sum(d["amount"] for d in destinations)
+            with backends.acquire(amount) as backend:
+                result = WalletRPC.transfer(backend, params)
+        else:
+            result = WalletRPC.transfer(backend, params)
+        return WalletRPC.transfer_result(params, result, backend)
 
-        # get the wallet's address
-        rpc_connection = AuthServiceProxy(
-            "http://{0}:{1}/json_rpc".format(
-                settings.WALLET_HOST, settings.WALLET_PORT
-            )
-        )
+    @staticmethod
+    def transfer(backend, params):
+        """Calls transfer_split on a wallet backend.
+
+        :param backend: "host:port" of the wallet
+        :param params: the transfer_split parameters
+        :returns: the RPC's result
+        :raises TransferStateUnknownError: if the transfer failed, but may
+            have been sent (e.g. timed out)
+        :raises RpcConnectionError: in case of a connection error to the rpc
+        """
 
-        result = None
         try:
-            result = rpc_connection.transfer_split(params)
+            return get_client(*backends.address(backend)).call(
+                "transfer_split", params
+            )
         except (
             requests.HTTPError,
             requests.ConnectionError,
+            requests.Timeout,
             JSONRPCException,
         ) as e:
             logger.error("RPC Error on making transaction" + str(e))
+            if is_transient(e):
+                backends.mark_down(backend)
+            if not was_not_sent(e):
+                raise TransferStateUnknownError(str(e))
             raise RpcConnectionError(str(e))
+
+    @staticmethod
+    def transfer_params(destinations):
+        """Returns the transfer_split parameters to pay the destinations.
+
+        :param destinations: list of dicts with "address" and "amount"
+        :returns: dict of parameters
+        """
+
+        # send xmr to all given destinations
+        recipients = [
+            {"address": d["address"], "amount": d["amount"]}
+            for d in destinations
+        ]
+
+        # transfer parameters
+        params = {"destinations": recipients, "mixin": settings.DEFAULT_MIXIN}
+
+        if all(len(d["address"]) == 95 for d in destinations):
+            # payment id
+            # integrated addresses already carry their own payment id
+            payment_id = tools.generate_xmr_payment_id_long()
+            params.update({"payment_id": payment_id})
+
+        return params
+
+    @staticmethod
+    def transfer_result(params, result, backend=""):
+        """Returns the transaction objects of a transfer_split result.
+
+        :param params: the transfer_split parameters
+        :param result: the transfer_split result
+        :param backend: the wallet backend which sent the transfer
+        :returns: one transaction object per destination (in order)
+        :raises ValueError: in case  the JSON returned is bad
+        """
+
         # transfer returns a single tx_hash
         # tarnsfer_split returns a list of tx_hash -> tx_hash_list
         transaction_id = result.get("tx_hash_list", list())
@@ -134,16 +281,18 @@ class WalletRPC:
         if not transaction_id:
             raise ValueError("Error with: {0}".format(result))
 
-        transaction = dict()
-        transaction.update(
-            {
-                "transaction_id": ",".join(transaction_id),
-                "destination_address": destination_address,
-                "amount": amount,
-            }
-        )
+        transactions = list()
+        for recipient in params["destinations"]:
+            transactions.append(
+                {
+                    "transaction_id": ",".join(transaction_id),
+                    "destination_address": recipient["address"],
+                    "amount": recipient["amount"],
+                    "wallet_backend": backend,
+                }
+            )
 
-        return transaction
+        return transactions
 
     @classmethod
     def get_network_type(cls):
@@ -153,19 +302,15 @@ class WalletRPC:
         :raises RpcConnectionError: no connection could be established
         :raises ValueError: retrieved data could not be processed
         """
-        if not cls.network_type:
-            rpc_connection = AuthServiceProxy(
-                "http://{0}:{1}/json_rpc".format(
-                    settings.DAEMON_HOST, settings.DAEMON_PORT
-                )
-            )
-
+        network = networks.active()
+        if not cls.network_types.get(network):
             result = None
             try:
-                result = rpc_connection.get_info()
+                result = get_daemon_client().call("get_info")
             except (
                 requests.HTTPError,
                 requests.ConnectionError,
+                requests.Timeout,
                 JSONRPCException,
             ) as e:
                 logger.error("RPC Error on getting address" + str(e))
@@ -175,26 +320,183 @@ class WalletRPC:
             network_type = result.get("nettype", None)
             if not network_type:
                 raise ValueError("Error with: {0}".format(result))
-            cls.network_type = network_type
-        return cls.network_type
+            cls.network_types[network] = network_type
+        return cls.network_types[network]
+
+    @classmethod
+    def get_cached_address(cls):
+        """Returns the wallet's address.
+
+        The address is only requested again after
+        settings.WALLET_METADATA_TTL seconds.
+
+        :returns: wallet's address if successful
+        :raises RpcConnectionError: no connection could be established
+        :raises ValueError: retrieved data could not be processed
+        """
+
+        network = networks.active()
+        now = time.time()
+        address, fetched_at = cls.addresses.get(network, (None, 0))
+        if not address or now - fetched_at > settings.WALLET_METADATA_TTL:
+            address = cls.get_address()
+            cls.addresses[network] = (address, now)
+        return address
+
+
+def fetch_balance():
+    """Gets the balance from the wallet and stores it in the cache.
+
+    :returns: dict of unlocked_balance ("balance", in XMR format) and the
+        time it was fetched at ("fetched_at")
+    :raises RpcConnectionError: no connection could be established
+    :raises ValueError: retrieved data could not be processed
+    """
+
+    entry = {"balance": WalletRPC.get_balance(), "fetched_at": time.time()}
+    cache.set(
+        networks.cache_key(BALANCE_CACHE_KEY),
+        entry,
+        settings.BALANCE_CACHE_MAX_AGE,
+    )
+    return entry
+
+
+def refresh_balance():
+    """Refreshes the cached balance in the background.
+    """
+
+    try:
+        fetch_balance()
+    except (ValueError, RpcConnectionError) as e:
+        logger.error("Could not refresh balance: " + str(e))
+    finally:
+        cache.delete(networks.cache_key(BALANCE_LOCK_KEY))
+
+
+def get_cached_balance_entry():
+    """Returns the wallet's balance, cached for settings.BALANCE_CACHE_TTL.
+
+    Stale balances are returned while a single background thread refreshes
+    them. If there is no cached balance at all, only one caller (across
+    all processes sharing the cache) asks the wallet, the others wait for
+    its result.
+
+    :returns: dict of unlocked_balance ("balance", in XMR format) and the
+        time it was fetched at ("fetched_at")
+    :raises RpcConnectionError: no connection could be established
+    :raises ValueError: retrieved data could not be processed
+    """
+
+    if settings.BALANCE_CACHE_TTL <= 0:
+        return {"balance": WalletRPC.get_balance(), "fetched_at": time.time()}
+
+    cache_key = networks.cache_key(BALANCE_CACHE_KEY)
+    lock_key = networks.cache_key(BALANCE_LOCK_KEY)
+    lock_timeout = sum(settings.RPC_TIMEOUTS["default"])
+    entry = cache.get(cache_key)
+    if entry is not None:
+        age = time.time() - entry["fetched_at"]
+        if age > settings.BALANCE_CACHE_TTL and cache.add(
+            lock_key, True, lock_timeout
+        ):
+            threading.Thread(
+                target=networks.bind(refresh_balance), daemon=True
+            ).start()
+        return entry
+
+    if cache.add(lock_key, True, lock_timeout):
+        try:
+            return fetch_balance()
+        finally:
+            cache.delete(lock_key)
+
+    # another process is asking the wallet already
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(BALANCE_POLL_INTERVAL)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry
+    return fetch_balance()
+
+
+def get_cached_balance():
+    """Returns the wallet's (cached) balance.
+
+    :returns: unlocked_balance in XMR format
+    :raises RpcConnectionError: no connection could be established
+    :raises ValueError: retrieved data could not be processed
+    """
+
+    return get_cached_balance_entry()["balance"]
 
 
 def get_balance():
     try:
-        return WalletRPC.get_balance()
+        return get_cached_balance()
     except (ValueError, RpcConnectionError) as e:
         raise GetBalanceError("Could not get balance.")
 
 
-def get_current_amount(factor):
+def get_backend_balance(backend):
+    """Returns the cached unlocked balance of a wallet backend.
+
+    The balance is fetched, if it is not cached (e.g. the backend was used
+    since).
+
+    :param backend: "host:port" of the wallet
+    :returns: the balance in XMR format
+    :raises RpcConnectionError: no connection could be established
+    :raises ValueError: retrieved data could not be processed
+    """
+
+    balance = backends.get_balance(backend)
+    if balance is None:
+        balance = WalletRPC.get_backend_balance(backend)
+        backends.set_balance(backend, balance)
+    return balance
+
+
+def get_current_amount(factor, backend=None):
     """Returns the calculated amount to transfer.
     Due to scripts that drain the faucet, the maximum payout amount
     is capped at settings.MAXIMUM_PAYOUT.
 
+    If settings.LEDGER_ENABLE is set, the balance excludes payouts, which
+    are in flight or not yet reflected by the cached wallet balance.
+
     :param factor: the factor to consider when paying out XMR
+    :param backend: the acquired wallet backend to pay from (see
+        backends.acquire()), its own balance is used instead of the total
+        (no other payout is sent from it in the meantime)
     :returns: the XMR to pay out (factored unlocked_balance)
     """
-    balance = get_balance()
+    if backend is not None:
+        try:
+            balance = get_backend_balance(backend)
+        except (ValueError, RpcConnectionError) as e:
+            if isinstance(e, RpcConnectionError):
+                backends.mark_down(backend)
+            raise GetBalanceError("Could not get balance.")
+    elif settings.LEDGER_ENABLE:
+        try:
+            balance = ledger.available_balance(get_cached_balance_entry())
+        except (ValueError, RpcConnectionError) as e:
+            raise GetBalanceError("Could not get balance.")
+    else:
+        balance = get_balance()
+    return payout_amount(balance, factor)
+
+
+def payout_amount(balance, factor):
+    """Returns the amount to transfer of the given balance.
+
+    :param balance: the available balance in XMR format
+    :param factor: the factor to consider when paying out XMR
+    :returns: the XMR to pay out (factored balance, capped)
+    """
+
     if factor <= 0:
         logger.error("Wrong factor provided: " + str(factor))
         raise GetAmountError("FACTOR=" + str(factor))
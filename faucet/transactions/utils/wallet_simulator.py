@@ -0,0 +1,446 @@
+import json
+import os
+import binascii
+import random
+import threading
+import time
+import logging
+from collections import Counter
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# error codes of monero-wallet-rpc
+WRONG_ADDRESS = -2
+WRONG_TXID = -8
+NOT_ENOUGH_MONEY = -17
+ZERO_DESTINATION = -20
+NOT_ENOUGH_UNLOCKED_MONEY = -37
+METHOD_NOT_FOUND = -32601
+
+SIMULATED_ADDRESS = "5" + "A" * 94
+
+# RPC methods of SimulatedWallet
+METHODS = frozenset(
+    [
+        "getbalance",
+        "get_address",
+        "get_info",
+        "get_version",
+        "transfer_split",
+        "get_transfers",
+        "get_transfer_by_txid",
+        "incoming_transfers",
+    ]
+)
+
+
+def random_hash():
+    return binascii.hexlify(os.urandom(32)).decode()
+
+
+class RpcError(Exception):
+    """JSON-RPC error answered by the simulator.
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class SimulatedWallet:
+    """State of a simulated monero wallet and its daemon.
+
+    The balance consists of outputs. Spent outputs are removed, the change
+    of a transfer is locked for unlock_blocks blocks (like Monero's 10 block
+    lock), as are the outputs of transfers to the wallet's own address.
+    Blocks are mined every block_time seconds.
+    """
+
+    def __init__(
+        self,
+        balance=100 * 10 ** 12,
+        outputs=10,
+        block_time=120,
+        unlock_blocks=10,
+        fee=3 * 10 ** 7,
+        address=SIMULATED_ADDRESS,
+        nettype="stagenet",
+        start_height=100000,
+    ):
+        """
+        :param balance: initial (unlocked) balance in XMR format
+        :param outputs: number of outputs the balance is split into
+        :param block_time: seconds per block
+        :param unlock_blocks: blocks until received outputs are unlocked
+        :param fee: fee per transfer in XMR format
+        :param address: the wallet's address
+        :param nettype: the daemon's network type
+        :param start_height: blockchain height at start
+        """
+
+        self.block_time = block_time
+        self.unlock_blocks = unlock_blocks
+        self.fee = fee
+        self.address = address
+        self.nettype = nettype
+        self.start_height = start_height
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        self.outputs = list()
+        self.transfers = list()
+        for amount in self.split(balance, outputs):
+            txid = random_hash()
+            self.add_output(amount, 0, txid)
+            self.transfers.append(
+                self.transfer_entry(
+                    "in", txid, amount, 0, start_height - unlock_blocks
+                )
+            )
+
+    @staticmethod
+    def split(amount, parts):
+        parts = max(1, parts)
+        amounts = [amount // parts] * parts
+        amounts[0] += amount - sum(amounts)
+        return amounts
+
+    def add_output(self, amount, unlock_height, txid):
+        self.outputs.append(
+            {
+                "amount": amount,
+                "unlock_height": unlock_height,
+                "tx_hash": txid,
+                "key_image": random_hash(),
+            }
+        )
+
+    def height(self):
+        return self.start_height + int(
+            (time.time() - self.started) / self.block_time
+        )
+
+    def transfer_entry(self, kind, txid, amount, fee, height, **kwargs):
+        entry = {
+            "address": self.address,
+            "amount": amount,
+            "double_spend_seen": False,
+            "fee": fee,
+            "height": height,
+            "note": "",
+            "payment_id": "0" * 16,
+            "subaddr_index": {"major": 0, "minor": 0},
+            "suggested_confirmations_threshold": 1,
+            "timestamp": int(time.time()),
+            "txid": txid,
+            "type": kind,
+            "unlock_time": 0,
+        }
+        entry.update(kwargs)
+        return entry
+
+    def view(self, transfer, height):
+        """Returns a transfer as seen at the given height.
+        """
+
+        transfer = dict(transfer)
+        if transfer["height"] > height:
+            # not mined yet
+            transfer.update(
+                {"type": "pending", "height": 0, "confirmations": 0}
+            )
+        else:
+            transfer["confirmations"] = height - transfer["height"] + 1
+        return transfer
+
+    def getbalance(self, params):
+        height = self.height()
+        with self.lock:
+            balance = sum(o["amount"] for o in self.outputs)
+            unlocked = sum(
+                o["amount"]
+                for o in self.outputs
+                if o["unlock_height"] <= height
+            )
+            locked = [
+                o["unlock_height"] - height
+                for o in self.outputs
+                if o["unlock_height"] > height
+            ]
+        return {
+            "balance": balance,
+            "unlocked_balance": unlocked,
+            "blocks_to_unlock": max(locked) if locked else 0,
+            "multisig_import_needed": False,
+        }
+
+    def get_address(self, params):
+        return {
+            "address": self.address,
+            "addresses": [
+                {
+                    "address": self.address,
+                    "address_index": 0,
+                    "label": "Primary account",
+                    "used": True,
+                }
+            ],
+        }
+
+    def get_version(self, params):
+        return {"version": 65562}
+
+    def get_info(self, params):
+        height = self.height()
+        return {
+            "height": height,
+            "target_height": height,
+            "nettype": self.nettype,
+            self.nettype: True,
+            "status": "OK",
+            "synchronized": True,
+        }
+
+    def transfer_split(self, params):
+        destinations = params.get("destinations") or list()
+        if not destinations:
+            raise RpcError(
+                ZERO_DESTINATION, "No destinations for this transfer"
+            )
+        for destination in destinations:
+            if len(destination.get("address", "")) not in (95, 106):
+                raise RpcError(WRONG_ADDRESS, "Invalid destination address")
+            if destination.get("amount", 0) <= 0:
+                raise RpcError(ZERO_DESTINATION, "Zero amount")
+        amount = sum(d["amount"] for d in destinations)
+        needed = amount + self.fee
+
+        height = self.height()
+        with self.lock:
+            unlocked = sorted(
+                (o for o in self.outputs if o["unlock_height"] <= height),
+                key=lambda o: o["amount"],
+                reverse=True,
+            )
+            inputs = list()
+            for output in unlocked:
+                if sum(o["amount"] for o in inputs) >= needed:
+                    break
+                inputs.append(output)
+            spent = sum(o["amount"] for o in inputs)
+            if spent < needed:
+                if sum(o["amount"] for o in self.outputs) >= needed:
+                    raise RpcError(
+                        NOT_ENOUGH_UNLOCKED_MONEY, "not enough unlocked money"
+                    )
+                raise RpcError(NOT_ENOUGH_MONEY, "not enough money")
+
+            for output in inputs:
+                self.outputs.remove(output)
+            # mined within the next block
+            mined_at = height + 1
+            unlock_height = mined_at + self.unlock_blocks
+            txid = random_hash()
+            for destination in destinations:
+                if destination["address"] == self.address:
+                    self.add_output(destination["amount"], unlock_height, txid)
+            if spent > needed:
+                self.add_output(spent - needed, unlock_height, txid)
+            self.transfers.append(
+                self.transfer_entry(
+                    "out",
+                    txid,
+                    amount,
+                    self.fee,
+                    mined_at,
+                    destinations=[
+                        {"address": d["address"], "amount": d["amount"]}
+                        for d in destinations
+                    ],
+                    payment_id=params.get("payment_id", "0" * 16),
+                )
+            )
+        return {
+            "tx_hash_list": [txid],
+            "amount_list": [amount],
+            "fee_list": [self.fee],
+            "multisig_txset": "",
+            "unsigned_txset": "",
+        }
+
+    def get_transfers(self, params):
+        height = self.height()
+        min_height = params.get("min_height", 0)
+        max_height = params.get("max_height", height)
+        with self.lock:
+            transfers = [self.view(t, height) for t in self.transfers]
+
+        result = dict()
+        for transfer in transfers:
+            kind = transfer["type"]
+            if not params.get(kind, False):
+                continue
+            if params.get("filter_by_height", False) and not (
+                min_height < transfer["height"] <= max_height
+            ):
+                continue
+            result.setdefault(kind, list()).append(transfer)
+        return result
+
+    def incoming_transfers(self, params):
+        height = self.height()
+        kind = params.get("transfer_type", "all")
+        with self.lock:
+            transfers = [
+                {
+                    "amount": o["amount"],
+                    "spent": False,
+                    "unlocked": o["unlock_height"] <= height,
+                    "frozen": False,
+                    "global_index": index,
+                    "key_image": o["key_image"],
+                    "tx_hash": o["tx_hash"],
+                    "subaddr_index": {"major": 0, "minor": 0},
+                }
+                for index, o in enumerate(self.outputs)
+            ]
+        # spent outputs are not kept ("unavailable")
+        if kind == "unavailable" or not transfers:
+            return {}
+        return {"transfers": transfers}
+
+    def get_transfer_by_txid(self, params):
+        height = self.height()
+        with self.lock:
+            transfers = [
+                self.view(t, height)
+                for t in self.transfers
+                if t["txid"] == params.get("txid")
+            ]
+        if not transfers:
+            raise RpcError(WRONG_TXID, "Transaction not found.")
+        return {"transfer": transfers[0], "transfers": transfers}
+
+
+class WalletSimulatorHandler(BaseHTTPRequestHandler):
+    """Answers JSON-RPC calls with the simulated wallet.
+    """
+
+    # keep-alive connections, as the RPC client reuses them
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length).decode("utf-8"))
+        method = request.get("method")
+        with server.lock:
+            server.calls[method] += 1
+
+        time.sleep(server.get_option(server.latency, method))
+        if random.random() < server.get_option(server.timeout_rate, method):
+            # answer after the client gave up
+            with server.lock:
+                server.timeouts[method] += 1
+            time.sleep(server.hang)
+        if random.random() < server.get_option(server.error_rate, method):
+            with server.lock:
+                server.errors[method] += 1
+            self.respond(500, b"")
+            return
+
+        response = {"id": request.get("id"), "jsonrpc": "2.0"}
+        if method not in METHODS:
+            error = {"code": METHOD_NOT_FOUND, "message": "Method not found"}
+            response["error"] = error
+        else:
+            handler = getattr(server.wallet, method)
+            try:
+                response["result"] = handler(request.get("params") or {})
+            except RpcError as e:
+                response["error"] = {"code": e.code, "message": e.message}
+        self.respond(200, json.dumps(response).encode("utf-8"))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WalletSimulator(ThreadingMixIn, HTTPServer):
+    """monero-wallet-rpc and monerod JSON-RPC simulator.
+
+    Latency, timeouts (answers after hang seconds) and errors (HTTP 500)
+    are configured per method as dicts of method name and value, the value
+    of None applies to all other methods.
+
+    Can be used as context manager, serving in a background thread.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        wallet=None,
+        latency=None,
+        error_rate=None,
+        timeout_rate=None,
+        hang=60,
+    ):
+        """
+        :param host: host to listen on
+        :param port: port to listen on, 0 picks a free port
+        :param wallet: SimulatedWallet (default: SimulatedWallet())
+        :param latency: seconds to wait before answering
+        :param error_rate: share of calls answered with HTTP 500
+        :param timeout_rate: share of calls answered after hang seconds
+        :param hang: seconds to wait when simulating a timeout
+        """
+
+        super().__init__((host, port), WalletSimulatorHandler)
+        self.wallet = wallet or SimulatedWallet()
+        self.latency = latency or dict()
+        self.error_rate = error_rate or dict()
+        self.timeout_rate = timeout_rate or dict()
+        self.hang = hang
+        self.calls = Counter()
+        self.errors = Counter()
+        self.timeouts = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_option(options, method):
+        return options.get(method, options.get(None, 0))
+
+    def start(self):
+        """Serves in a background thread.
+
+        :returns: (host, port) the simulator listens on
+        """
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
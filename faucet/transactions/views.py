@@ -1,17 +1,48 @@
 from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
-from rest_framework.generics import CreateAPIView
+from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+from rest_framework import status
 
 from ratelimit.mixins import RatelimitMixin
 
 from django.conf import settings
-from django.shortcuts import render
+from django.core.cache import cache
+from django.http import (
+    HttpResponse,
+    Http404,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.views.decorators.http import condition
 
-from .utils import tools
-from .serializers import TransactionSerializer
-from .exceptions import MakeTransactionError, RatelimitedByWithdrawalsError
+from prometheus_client import CONTENT_TYPE_LATEST
 
+from .utils import tools, throttle, metrics, history, stats, networks
+from .utils import idempotency, health
+from .models import Transaction
+from .pagination import KeysetPagination
+from .serializers import (
+    TransactionSerializer,
+    TransactionStatusSerializer,
+    TransactionHistorySerializer,
+    DailyPayoutStatsSerializer,
+)
+from .exceptions import (
+    MakeTransactionError,
+    RatelimitedByWithdrawalsError,
+    RatelimitedByIPError,
+    RpcConnectionError,
+)
+
+import hashlib
 import logging
+import threading
+import time
 
 from .utils.wallet_rpc import WalletRPC, get_balance
 
@@ -20,11 +51,27 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def index(request):
+class CachedPage:
+    """A rendered page including its validators.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        self.last_modified = timezone.now().replace(microsecond=0)
+        self.rendered_at = time.time()
+
+
+# per network
+_index_pages = dict()
+_index_page_lock = threading.Lock()
+
+
+def render_index():
     """Render index.html template
 
     Configure text with monero network mode.
-    Configure transaction endpoint with MONERO_ENDPOINT.
+    Configure transaction endpoint with MONERO_ENDPOINT (and the network).
     """
 
     network_type = WalletRPC.get_network_type()
@@ -34,21 +81,73 @@ def index(request):
     elif network_type == "testnet":
         network_type_other = "stagenet"
 
-    return render(
-        request,
+    return render_to_string(
         "transactions/index.html",
         {
-            "wallet_address": WalletRPC.get_address(),
+            "wallet_address": WalletRPC.get_cached_address(),
             "monero_network": network_type,
             "monero_network_other": network_type_other,
-            "endpoint": settings.MONERO_ENDPOINT,
+            "endpoint": networks.endpoint(),
         },
-    )
+    ).encode("utf-8")
+
+
+def get_index_page():
+    """Returns the rendered index page.
+
+    The page only depends on the wallet's address and network type, so it is
+    rendered once and only re-rendered every settings.WALLET_METADATA_TTL
+    seconds. If re-rendering fails, the previous page is kept.
+    """
+
+    network = networks.active()
+    with _index_page_lock:
+        page = _index_pages.get(network)
+        if (
+            page is None
+            or time.time() - page.rendered_at > settings.WALLET_METADATA_TTL
+        ):
+            try:
+                page = CachedPage(render_index())
+            except (ValueError, RpcConnectionError) as e:
+                if page is None:
+                    raise
+                logger.error("Could not render index: " + str(e))
+            _index_pages[network] = page
+        return page
+
+
+def index_etag(request):
+    return get_index_page().etag
+
+
+def index_last_modified(request):
+    return get_index_page().last_modified
+
+
+@condition(etag_func=index_etag, last_modified_func=index_last_modified)
+def index(request):
+    """Serve the cached index page.
+
+    Requests with matching If-None-Match/If-Modified-Since headers are
+    answered with 304 Not Modified.
+    """
+
+    return HttpResponse(get_index_page().content)
 
 
 def get_client_ip(request):
     """Get the correct user IP address.
+
+    Proxy headers are only used for requests of trusted proxies
+    (settings.TRUSTED_PROXIES), otherwise they could be spoofed.
+    X-Forwarded-For is read from right to left, skipping trusted proxies.
     """
+    remote_addr = request.META.get("REMOTE_ADDR")
+    if not throttle.is_trusted_proxy(remote_addr):
+        logger.debug("Took REMOTE_ADDR (untrusted peer)")
+        return remote_addr
+
     x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
     # nginx
     x_real_ip = request.META.get("HTTP_X_REAL_IP")
@@ -57,15 +156,26 @@ def get_client_ip(request):
         return x_real_ip
     elif x_forwarded_for:
         logger.debug("Took HTTP_X_FORWARDED_FOR")
-        return x_forwarded_for.split(",")[-1].strip()
+        forwarded = [ip.strip() for ip in x_forwarded_for.split(",")]
+        for ip in reversed(forwarded):
+            if not throttle.is_trusted_proxy(ip):
+                return ip
+        return forwarded[0]
     else:
         logger.debug("Took REMOTE_ADDR")
 
-        return request.META.get("REMOTE_ADDR")
+        return remote_addr
 
     raise MakeTransactionError()
 
 
+def client_ip_key(group, request):
+    """Rate limitation key of django-ratelimit.
+    """
+
+    return get_client_ip(request)
+
+
 class TransactionsApiView(RatelimitMixin, CreateAPIView):
     """Transactions APIView providing GET and POST.
 
@@ -75,8 +185,10 @@ class TransactionsApiView(RatelimitMixin, CreateAPIView):
     """
 
     # configure rate limit
-    # ratelimit_key = 'ip'  # locally:
-    ratelimit_key = "header:x-real-ip"  # behind proxy (nginx)
+    # works locally as well as behind proxy (nginx)
+    ratelimit_key = client_ip_key
+    # shared with async_views
+    ratelimit_group = "transactions"
     ratelimit_rate = "1/{0}m".format(settings.ONCE_EVERY_N_MINUTE)
     ratelimit_method = "POST"
     ratelimit_block = True
@@ -90,9 +202,226 @@ class TransactionsApiView(RatelimitMixin, CreateAPIView):
         """
         return Response({"balance": int(tools.xmr_to_float(get_balance()))})
 
+    def dispatch(self, request, *args, **kwargs):
+        # retries of a request with an Idempotency-Key are not rate limited
+        self.idempotent_retry = idempotency.is_known(request)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_ratelimit_config(self):
+        config = super().get_ratelimit_config()
+        # separate limits per network
+        config["group"] = networks.cache_key(self.ratelimit_group)
+        if settings.IP_RATELIMIT_BACKEND == "token-bucket" or getattr(
+            self, "idempotent_retry", False
+        ):
+            # token buckets are checked in make_payout() instead, replays
+            # of an Idempotency-Key are not limited
+            config["rate"] = None
+        return config
+
+    def create(self, request, *args, **kwargs):
+        """Makes the payout, once per Idempotency-Key (if given).
+        """
+
+        key = idempotency.get_key(request)
+        if key is None:
+            return self.make_payout(request, *args, **kwargs)
+        request_fingerprint = idempotency.fingerprint(request.data)
+        stored = idempotency.begin(key, request_fingerprint)
+        if stored is not None:
+            status_code, data = stored
+            return Response(data, status=status_code)
+        self.payout = None
+        try:
+            response = self.make_payout(request, *args, **kwargs)
+        except Exception as e:
+            idempotency.fail(
+                key,
+                request_fingerprint,
+                e,
+                getattr(self.payout, "instance", None),
+            )
+            raise
+        idempotency.finish(
+            key, request_fingerprint, response.status_code, response.data
+        )
+        return response
+
+    def make_payout(self, request, *args, **kwargs):
+        if (
+            settings.RATELIMIT_ENABLE
+            and settings.IP_RATELIMIT_BACKEND == "token-bucket"
+            and throttle.is_limited(get_client_ip(request))
+        ):
+            logger.warning("Blocked by token bucket limitation.")
+            raise RatelimitedByIPError
+        response = super().create(request, *args, **kwargs)
+        if settings.PAYOUT_ASYNC_ENABLE:
+            # payout is queued, poll the transaction's status endpoint
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def handle_exception(self, exc):
+        metrics.reject(exc)
+        return super().handle_exception(exc)
+
     def perform_create(self, serializer):
         ip_address = get_client_ip(self.request)
         serializer.validated_data.update(
-            {"ip_address_hash": tools.hash_value(ip_address)}
+            {
+                "ip_address_hash": tools.hash_ip(ip_address),
+                "network": networks.active(),
+            }
         )
+        # its stored payout is kept with the Idempotency-Key, if it fails
+        self.payout = serializer
         serializer.save()
+
+
+class TransactionStatusApiView(RetrieveAPIView):
+    """Transaction status APIView providing GET.
+
+    GET: Get the state of a (queued) payout by the token of its POST
+    response.
+    """
+
+    lookup_field = "token"
+    serializer_class = TransactionStatusSerializer
+    renderer_classes = (JSONRenderer,)
+
+    def get_queryset(self):
+        return Transaction.objects.filter(
+            network=networks.active()
+        ).prefetch_related("hashes")
+
+
+def filtered_transactions(request):
+    """Returns the active network's transactions filtered by the query
+    parameters.
+
+    address: destination address
+    since/until: ISO 8601 date/time range (since including, until excluding)
+    tx_hash: hash of one of the transfer's transactions
+
+    :raises ValidationError: if a date/time is invalid
+    """
+
+    params = request.query_params
+    times = dict()
+    for name in ("since", "until"):
+        if params.get(name):
+            try:
+                times[name] = history.parse_time(params[name])
+            except ValueError as e:
+                raise ValidationError({name: str(e)})
+    tx_hash = params.get("tx_hash")
+    if tx_hash and not tools.is_hash(tx_hash):
+        raise ValidationError({"tx_hash": "Invalid hash."})
+    return history.filter_transactions(
+        Transaction.objects.filter(network=networks.active()),
+        address=params.get("address"),
+        tx_hash=tx_hash,
+        **times
+    )
+
+
+class TransactionHistoryApiView(ListAPIView):
+    """Transaction history APIView providing GET (admins only).
+
+    GET: List payouts, newest first, paginated by cursor.
+    """
+
+    serializer_class = TransactionHistorySerializer
+    pagination_class = KeysetPagination
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (JSONRenderer,)
+
+    def get_queryset(self):
+        return filtered_transactions(self.request).prefetch_related("hashes")
+
+
+class TransactionExportView(APIView):
+    """Transaction export view providing GET (admins only).
+
+    GET: Stream the (filtered) payouts as CSV or NDJSON, oldest first.
+    """
+
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, export_format):
+        if export_format not in history.FORMATS:
+            raise Http404
+        content_type, lines = history.FORMATS[export_format]
+        rows = history.export_rows(filtered_transactions(request))
+        response = StreamingHttpResponse(
+            lines(rows), content_type=content_type
+        )
+        response[
+            "Content-Disposition"
+        ] = 'attachment; filename="transactions.{}"'.format(export_format)
+        return response
+
+
+class PayoutStatsApiView(APIView):
+    """Payout statistics APIView providing GET.
+
+    GET: Get the payouts per day of the last days (parameter days).
+    """
+
+    renderer_classes = (JSONRenderer,)
+    max_days = 366
+
+    def get(self, request, format=None):
+        try:
+            days = int(request.query_params.get("days", 30))
+        except ValueError:
+            raise ValidationError({"days": "Invalid."})
+        days = max(1, min(days, self.max_days))
+
+        key = networks.cache_key("stats:{}".format(days))
+        data = cache.get(key)
+        if data is None:
+            # the rollup is updated by the payout workers (see stats.update)
+            data = DailyPayoutStatsSerializer(
+                stats.daily(days), many=True
+            ).data
+            cache.set(key, data, settings.STATS_CACHE_TTL)
+        return Response({"days": data})
+
+
+def healthz(request):
+    """Liveness of this worker, including the last dependency checks.
+
+    Always answered with 200 OK, the worker is alive if it answers.
+    """
+
+    return JsonResponse(health.status())
+
+
+def readyz(request):
+    """Readiness of this worker to serve the active network.
+
+    Answered with 200 OK once the worker is prewarmed and its last checks
+    of the database, the cache and the network's wallet and daemon
+    succeeded, 503 Service Unavailable otherwise.
+    """
+
+    state = health.status()
+    return JsonResponse(
+        state,
+        status=status.HTTP_200_OK
+        if state["ready"]
+        else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+def metrics_view(request):
+    """Serve the Prometheus metrics of all workers.
+
+    Only available if settings.METRICS_ENABLE is set.
+    """
+
+    if not settings.METRICS_ENABLE:
+        raise Http404
+    return HttpResponse(metrics.generate(), content_type=CONTENT_TYPE_LATEST)